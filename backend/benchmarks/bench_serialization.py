@@ -0,0 +1,86 @@
+'''
+Serialization benchmark
+
+Compares the old listing path (ORM objects, Question.format() and jsonify)
+with the column-tuple path of flaskr.serialization on a listing of
+--questions questions (10k by default), and prints bytes/sec of both as JSON.
+
+From the backend directory:
+
+    python -m benchmarks.bench_serialization --questions 10000 --repeat 20
+'''
+import argparse
+import json
+import time
+
+from flask import jsonify
+
+from flaskr import create_app
+from flaskr.serialization import dumps, question_rows
+from models import setup_db, db, Question, Category
+
+
+def seed(app, questions):
+  with app.app_context():
+    db.create_all()
+    category = Category('Science')
+    db.session.add(category)
+    db.session.commit()
+    db.session.bulk_insert_mappings(Question, [{
+      'question': 'Benchmark question number {}?'.format(i),
+      'answer': 'Answer {}'.format(i),
+      'category': category.id,
+      'difficulty': i % 5 + 1
+    } for i in range(questions)])
+    db.session.commit()
+
+
+def orm_jsonify():
+  questions = [question.format() for question in Question.query.order_by(Question.id).all()]
+  return jsonify({'success': True, 'questions': questions}).get_data()
+
+def tuples_fast_encoder():
+  questions = question_rows(Question.query.order_by(Question.id))
+  return dumps({'success': True, 'questions': questions})
+
+
+def measure(app, serialize, repeat):
+  with app.test_request_context('/questions'):
+    serialize() # warm up
+    size = 0
+    start = time.perf_counter()
+    for _ in range(repeat):
+      size += len(serialize())
+      db.session.expunge_all()
+    elapsed = time.perf_counter() - start
+
+  return {
+    'seconds_per_listing': elapsed / repeat,
+    'bytes_per_listing': size // repeat,
+    'bytes_per_second': size / elapsed
+  }
+
+
+def main():
+  parser = argparse.ArgumentParser(description='Benchmark the serialization of a question listing.')
+  parser.add_argument('--questions', type=int, default=10000)
+  parser.add_argument('--repeat', type=int, default=20)
+  parser.add_argument('--database', default='sqlite://')
+  args = parser.parse_args()
+
+  app = create_app()
+  setup_db(app, args.database)
+  seed(app, args.questions)
+
+  results = {
+    'questions': args.questions,
+    'orm_jsonify': measure(app, orm_jsonify, args.repeat),
+    'tuples_fast_encoder': measure(app, tuples_fast_encoder, args.repeat)
+  }
+  results['speedup'] = results['tuples_fast_encoder']['bytes_per_second'] / results['orm_jsonify']['bytes_per_second']
+
+  print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+  main()
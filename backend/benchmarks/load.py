@@ -0,0 +1,212 @@
+'''
+Load-testing and benchmark suite
+
+Seeds a database with --questions questions spread over --categories
+categories, then drives every read endpoint and the quiz with --clients
+concurrent clients for --requests requests each, and prints per-endpoint
+p50/p95/p99 latency, requests per second, error count and SQL queries per
+request as JSON, so runs can be compared between commits.
+
+From the backend directory:
+
+    python -m benchmarks.load --questions 100000 --categories 6 --clients 8 --output results.json
+    python -m benchmarks.load --questions 100000 --categories 6 --clients 8 --baseline results.json
+
+By default the database is a temporary SQLite file; pass --database with
+the URI of a disposable Postgres database to benchmark against Postgres
+(its questions and categories tables are dropped and recreated).
+'''
+import argparse
+import json
+import os
+import random
+import subprocess
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from sqlalchemy import event
+
+from flaskr import create_app
+from models import setup_db, db, Question, Category
+
+SEED_BATCH_SIZE = 10000
+SEARCH_TERMS = ['who', 'what', 'which', 'title', 'country', 'first']
+WORDS = ['who', 'what', 'which', 'title', 'country', 'first', 'largest', 'river', 'painter', 'team', 'element', 'year']
+
+
+def seed(app, questions, categories):
+  with app.app_context():
+    db.drop_all()
+    db.create_all()
+
+    db.session.bulk_insert_mappings(Category, [{'type': 'Category {}'.format(i)} for i in range(categories)])
+    db.session.commit()
+    category_ids = [category_id for category_id, in db.session.query(Category.id)]
+
+    for start in range(0, questions, SEED_BATCH_SIZE):
+      db.session.bulk_insert_mappings(Question, [{
+        'question': '{} {} question {}?'.format(random.choice(WORDS).title(), random.choice(WORDS), i),
+        'answer': 'Answer {}'.format(i),
+        'category': random.choice(category_ids),
+        'difficulty': random.randint(1, 5)
+      } for i in range(start, min(start + SEED_BATCH_SIZE, questions))])
+      db.session.commit()
+
+    return category_ids
+
+
+'''
+QueryCounter
+
+Counts the statements executed by the engine, per thread, so the queries
+of each request can be attributed to it.
+'''
+class QueryCounter(object):
+
+  def __init__(self, engine):
+    self._local = threading.local()
+    event.listen(engine, 'before_cursor_execute', self._count)
+
+  def _count(self, connection, cursor, statement, parameters, context, executemany):
+    self._local.count = getattr(self._local, 'count', 0) + 1
+
+  def reset(self):
+    self._local.count = 0
+
+  def count(self):
+    return getattr(self._local, 'count', 0)
+
+
+''' The request each endpoint sends, given the random generator and the seeded category ids. '''
+def scenarios(total_questions, category_ids):
+  pages = max(1, total_questions // 10)
+  return {
+    'GET /questions': lambda rng: ('get', '/questions?page={}'.format(rng.randint(1, min(pages, 50))), None),
+    'GET /questions (deep page)': lambda rng: ('get', '/questions?page={}'.format(rng.randint(1, pages)), None),
+    'GET /categories': lambda rng: ('get', '/categories', None),
+    'GET /categories/<id>/questions': lambda rng: ('get', '/categories/{}/questions'.format(rng.choice(category_ids)), None),
+    'POST /questions (search)': lambda rng: ('post', '/questions', {'searchTerm': rng.choice(SEARCH_TERMS)}),
+    'POST /quizzes': lambda rng: ('post', '/quizzes', {
+      'previous_questions': [],
+      'quiz_category': {'type': 'Category', 'id': rng.choice(category_ids)}
+    })
+  }
+
+
+def percentile(sorted_values, fraction):
+  if not sorted_values:
+    return None
+  index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+  return sorted_values[index]
+
+
+def run_endpoint(app, counter, scenario, clients, requests):
+  def client_loop(seed):
+    rng = random.Random(seed)
+    client = app.test_client()
+    samples = []
+    for _ in range(requests):
+      method, url, body = scenario(rng)
+      counter.reset()
+      start = time.perf_counter()
+      response = getattr(client, method)(url, json=body)
+      samples.append((time.perf_counter() - start, response.status_code, counter.count()))
+    return samples
+
+  start = time.perf_counter()
+  with ThreadPoolExecutor(max_workers=clients) as executor:
+    results = list(executor.map(client_loop, range(clients)))
+  elapsed = time.perf_counter() - start
+
+  samples = [sample for result in results for sample in result]
+  latencies = sorted(latency for latency, _, _ in samples)
+
+  return {
+    'requests': len(samples),
+    'errors': sum(1 for _, status, _ in samples if status >= 500),
+    'rps': len(samples) / elapsed,
+    'latency_ms': {
+      'p50': percentile(latencies, 0.50) * 1000,
+      'p95': percentile(latencies, 0.95) * 1000,
+      'p99': percentile(latencies, 0.99) * 1000
+    },
+    'queries_per_request': sum(queries for _, _, queries in samples) / len(samples)
+  }
+
+
+''' Adds the ratio of each endpoint's p95 latency and RPS to the ones of a previous run. '''
+def compare(results, baseline):
+  for name, endpoint in results['endpoints'].items():
+    previous = baseline.get('endpoints', {}).get(name)
+    if previous is None:
+      continue
+    endpoint['baseline'] = {
+      'revision': baseline.get('revision'),
+      'p95_ratio': endpoint['latency_ms']['p95'] / previous['latency_ms']['p95'],
+      'rps_ratio': endpoint['rps'] / previous['rps']
+    }
+
+
+def git_revision():
+  try:
+    return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], stderr=subprocess.DEVNULL).decode().strip()
+  except (OSError, subprocess.CalledProcessError):
+    return None
+
+
+def main():
+  parser = argparse.ArgumentParser(description='Benchmark the latency and throughput of every endpoint.')
+  parser.add_argument('--questions', type=int, default=1000)
+  parser.add_argument('--categories', type=int, default=6)
+  parser.add_argument('--clients', type=int, default=4)
+  parser.add_argument('--requests', type=int, default=200, help='requests per client and endpoint')
+  parser.add_argument('--database', default=None, help='database URI (a temporary SQLite file by default)')
+  parser.add_argument('--endpoint', action='append', default=None, help='only run this endpoint (repeatable)')
+  parser.add_argument('--output', default=None, help='write the results to this file instead of stdout')
+  parser.add_argument('--baseline', default=None, help='results of a previous run to compare against')
+  args = parser.parse_args()
+
+  database = args.database
+  if database is None:
+    handle, path = tempfile.mkstemp(suffix='.db')
+    os.close(handle)
+    database = 'sqlite:///' + path
+
+  # All the simulated clients share one address, which the rate limits would throttle
+  app = create_app({'RATE_LIMIT_ENABLED': False})
+  setup_db(app, database)
+  category_ids = seed(app, args.questions, args.categories)
+
+  results = {
+    'revision': git_revision(),
+    'database': app.config['SQLALCHEMY_DATABASE_URI'].split(':')[0],
+    'questions': args.questions,
+    'categories': args.categories,
+    'clients': args.clients,
+    'endpoints': {}
+  }
+
+  with app.app_context():
+    counter = QueryCounter(db.engine)
+
+  for name, scenario in scenarios(args.questions, category_ids).items():
+    if args.endpoint and name not in args.endpoint:
+      continue
+    results['endpoints'][name] = run_endpoint(app, counter, scenario, args.clients, args.requests)
+
+  if args.baseline:
+    with open(args.baseline) as file:
+      compare(results, json.load(file))
+
+  output = json.dumps(results, indent=2)
+  if args.output:
+    with open(args.output, 'w') as file:
+      file.write(output)
+  else:
+    print(output)
+
+
+if __name__ == '__main__':
+  main()
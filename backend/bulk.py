@@ -0,0 +1,252 @@
+import csv
+import io
+import json
+from collections import Counter
+
+import click
+from flask.cli import AppGroup
+
+from models import db, notify_question_write, Question, Category, CategoryQuestionCount, MAX_DIFFICULTY, MIN_DIFFICULTY
+
+IMPORT_BATCH_SIZE = 500
+EXPORT_BATCH_SIZE = 1000
+MAX_REPORTED_ERRORS = 100
+QUESTION_FIELDS = ['question', 'answer', 'category', 'difficulty']
+
+
+'''
+Helper Methods to stream-parse JSON Lines and CSV into (line number, row)
+pairs. The lines may be bytes (e.g. an uploaded body), decoded as UTF-8;
+a row with a line that is not valid UTF-8 is reported as a ValueError.
+'''
+
+def decode_line(line):
+  return line.decode('utf-8') if isinstance(line, bytes) else line
+
+def parse_jsonl(lines):
+  for line_number, line in enumerate(lines, 1):
+    try:
+      line = decode_line(line)
+    except UnicodeDecodeError as error:
+      yield line_number, ValueError('invalid UTF-8: {}'.format(error))
+      continue
+    if not line.strip():
+      continue
+    try:
+      row = json.loads(line)
+    except ValueError as error:
+      yield line_number, ValueError('invalid JSON: {}'.format(error))
+      continue
+    yield line_number, row
+
+def parse_csv(lines):
+  invalid_lines = []
+
+  def decoded(lines):
+    for line_number, line in enumerate(lines, 1):
+      try:
+        yield decode_line(line)
+      except UnicodeDecodeError:
+        invalid_lines.append(line_number)
+        yield line.decode('utf-8', 'replace')
+
+  reader = csv.DictReader(decoded(lines))
+  for row in reader:
+    # Header is line 1. A quoted field may span several lines, all read by now
+    if invalid_lines:
+      del invalid_lines[:]
+      yield reader.line_num, ValueError('invalid UTF-8')
+      continue
+    yield reader.line_num, row
+
+PARSERS = {
+  'jsonl': parse_jsonl,
+  'csv': parse_csv
+}
+
+MIMETYPES = {
+  'jsonl': 'application/x-ndjson',
+  'csv': 'text/csv'
+}
+
+
+'''
+validate_row(row, category_ids)
+
+Returns the column mapping of a parsed row, ready for a bulk insert.
+Raises ValueError with a readable message if the row is not a valid question.
+'''
+def validate_row(row, category_ids):
+  if isinstance(row, Exception):
+    raise row
+  if not isinstance(row, dict):
+    raise ValueError('expected an object with the fields {}'.format(', '.join(QUESTION_FIELDS)))
+
+  mapping = {}
+  for field in ['question', 'answer']:
+    value = row.get(field)
+    if not isinstance(value, str) or not value.strip():
+      raise ValueError('{} is required'.format(field))
+    mapping[field] = value
+
+  for field in ['category', 'difficulty']:
+    value = row.get(field)
+    # int() would take true as 1 and cut 2.9 down to 2
+    if isinstance(value, bool) or (isinstance(value, float) and not value.is_integer()):
+      raise ValueError('{} must be an integer'.format(field))
+    try:
+      mapping[field] = int(value)
+    except (TypeError, ValueError):
+      raise ValueError('{} must be an integer'.format(field))
+
+  if mapping['category'] not in category_ids:
+    raise ValueError('category {} does not exist'.format(mapping['category']))
+  if not MIN_DIFFICULTY <= mapping['difficulty'] <= MAX_DIFFICULTY:
+    raise ValueError('difficulty must be between {} and {}'.format(MIN_DIFFICULTY, MAX_DIFFICULTY))
+
+  return mapping
+
+
+'''
+import_questions(lines, format, batch_size)
+
+Stream-parses `lines` (JSON Lines or CSV) and inserts the valid rows in
+batches of `batch_size`, each batch committed in its own transaction
+together with its question counts. A batch rejected by the database is retried row by row, so one bad row only
+costs itself. Invalid rows are reported, not fatal.
+
+Returns:
+    - number of inserted rows
+    - number of failed rows
+    - the first MAX_REPORTED_ERRORS errors, as {line, error}
+'''
+def import_questions(lines, format='jsonl', batch_size=IMPORT_BATCH_SIZE):
+  category_ids = set(category_id for category_id, in db.session.query(Category.id))
+  report = {'inserted': 0, 'failed': 0, 'errors': []}
+
+  def fail(line_number, error):
+    report['failed'] += 1
+    if len(report['errors']) < MAX_REPORTED_ERRORS:
+      report['errors'].append({'line': line_number, 'error': str(error)})
+
+  def flush(batch):
+    try:
+      db.session.bulk_insert_mappings(Question, [mapping for _, mapping in batch])
+      CategoryQuestionCount.adjust(Counter(mapping['category'] for _, mapping in batch))
+      db.session.commit()
+      report['inserted'] += len(batch)
+      return
+    except Exception:
+      db.session.rollback()
+
+    for line_number, mapping in batch:
+      try:
+        db.session.bulk_insert_mappings(Question, [mapping])
+        CategoryQuestionCount.adjust({mapping['category']: 1})
+        db.session.commit()
+        report['inserted'] += 1
+      except Exception as error:
+        db.session.rollback()
+        fail(line_number, getattr(error, 'orig', error))
+
+  batch = []
+  try:
+    for line_number, row in PARSERS[format](lines):
+      try:
+        batch.append((line_number, validate_row(row, category_ids)))
+      except ValueError as error:
+        fail(line_number, error)
+        continue
+
+      if len(batch) >= batch_size:
+        flush(batch)
+        batch = []
+
+    if batch:
+      flush(batch)
+  finally:
+    if report['inserted']:
+      notify_question_write('bulk', None)
+
+  return report
+
+
+'''
+export_questions(format, batch_size)
+
+Generates the whole question bank, ordered by id, as chunks of JSON Lines
+or CSV (with a header row). Rows are read as plain tuples from a
+server-side cursor `batch_size` at a time and one chunk is produced per
+batch, so memory use does not depend on the size of the table.
+'''
+def export_questions(format='jsonl', batch_size=EXPORT_BATCH_SIZE):
+  columns = [getattr(Question, field) for field in ['id'] + QUESTION_FIELDS]
+  rows = db.session.query(*columns).order_by(Question.id).execution_options(stream_results=True).yield_per(batch_size)
+
+  buffer = io.StringIO()
+  writer = csv.writer(buffer, lineterminator='\n')
+  if format == 'csv':
+    writer.writerow(['id'] + QUESTION_FIELDS)
+
+  count = 0
+  for row in rows:
+    if format == 'csv':
+      writer.writerow(row)
+    else:
+      buffer.write(json.dumps(dict(zip(['id'] + QUESTION_FIELDS, row))))
+      buffer.write('\n')
+
+    count += 1
+    if count % batch_size == 0:
+      yield buffer.getvalue()
+      buffer.seek(0)
+      buffer.truncate()
+
+  if buffer.tell():
+    yield buffer.getvalue()
+
+
+'''
+Flask CLI commands, registered by setup_db()
+
+    flask questions import FILE [--format jsonl|csv] [--batch-size N]
+    flask questions export [FILE] [--format jsonl|csv] [--batch-size N]
+    flask questions recount
+'''
+questions_cli = AppGroup('questions', help='Manage the question bank.')
+
+@questions_cli.command('import', help='Import questions from a JSON Lines or CSV file.')
+@click.argument('file', type=click.File('rb'))
+@click.option('--format', 'format', type=click.Choice(sorted(PARSERS)), default=None,
+              help='Input format, guessed from the file extension by default.')
+@click.option('--batch-size', default=IMPORT_BATCH_SIZE, show_default=True,
+              help='Number of rows inserted per transaction.')
+def import_command(file, format, batch_size):
+  if format is None:
+    format = 'csv' if file.name.endswith('.csv') else 'jsonl'
+
+  report = import_questions(file, format, batch_size)
+
+  click.echo('Inserted {} questions, {} failed.'.format(report['inserted'], report['failed']))
+  for error in report['errors']:
+    click.echo('line {}: {}'.format(error['line'], error['error']), err=True)
+
+@questions_cli.command('export', help='Export the question bank as JSON Lines or CSV (stdout by default).')
+@click.argument('file', type=click.File('w', encoding='utf-8'), default='-')
+@click.option('--format', 'format', type=click.Choice(sorted(PARSERS)), default=None,
+              help='Output format, guessed from the file extension by default.')
+@click.option('--batch-size', default=EXPORT_BATCH_SIZE, show_default=True,
+              help='Number of rows read from the database at a time.')
+def export_command(file, format, batch_size):
+  if format is None:
+    format = 'csv' if file.name.endswith('.csv') else 'jsonl'
+
+  for chunk in export_questions(format, batch_size):
+    file.write(chunk)
+
+@questions_cli.command('recount', help='Rebuild the per-category question counts from the questions table.')
+def recount_command():
+  counts = CategoryQuestionCount.recount()
+  total = counts.pop(CategoryQuestionCount.TOTAL_QUESTIONS)
+
+  click.echo('{} questions in {} categories.'.format(total, len(counts)))
@@ -0,0 +1,161 @@
+import os
+import threading
+import time
+
+from sqlalchemy import exc
+from sqlalchemy.pool import QueuePool
+
+'''
+Connection pool settings, read from the app config (e.g. create_app(test_config))
+and then from the environment. They only apply to pooled databases (not SQLite).
+
+    - DB_POOL_SIZE          connections kept open in the pool
+    - DB_MAX_OVERFLOW       connections opened beyond the pool size under load
+    - DB_POOL_TIMEOUT       seconds to wait for a connection before giving up
+    - DB_POOL_RECYCLE       seconds after which a connection is replaced
+    - DB_POOL_PRE_PING      test connections with a ping on checkout
+    - DB_STATEMENT_TIMEOUT  Postgres statement_timeout in milliseconds (0 disables it)
+'''
+POOL_SETTINGS = {
+  'DB_POOL_SIZE': (int, 5),
+  'DB_MAX_OVERFLOW': (int, 10),
+  'DB_POOL_TIMEOUT': (int, 30),
+  'DB_POOL_RECYCLE': (int, 3600),
+  'DB_POOL_PRE_PING': (lambda value: str(value).lower() in ('1', 'true', 'yes', 'on'), True),
+  'DB_STATEMENT_TIMEOUT': (int, 0)
+}
+
+# Weight of the latest checkout in the moving average of the checkout wait
+RECENT_WAIT_WEIGHT = 0.1
+
+
+def pool_setting(app, name):
+  cast, default = POOL_SETTINGS[name]
+  value = app.config.get(name, os.environ.get(name))
+  return default if value is None else cast(value)
+
+
+'''
+engine_options(app, database_path)
+
+Builds the SQLALCHEMY_ENGINE_OPTIONS for `database_path` from the pool
+settings, with the InstrumentedQueuePool so checkouts are measured.
+'''
+def engine_options(app, database_path):
+  if database_path.startswith('sqlite'):
+    return {}
+
+  options = {
+    'poolclass': InstrumentedQueuePool,
+    'pool_size': pool_setting(app, 'DB_POOL_SIZE'),
+    'max_overflow': pool_setting(app, 'DB_MAX_OVERFLOW'),
+    'pool_timeout': pool_setting(app, 'DB_POOL_TIMEOUT'),
+    'pool_recycle': pool_setting(app, 'DB_POOL_RECYCLE'),
+    'pool_pre_ping': pool_setting(app, 'DB_POOL_PRE_PING')
+  }
+
+  statement_timeout = pool_setting(app, 'DB_STATEMENT_TIMEOUT')
+  if statement_timeout and database_path.startswith('postgres'):
+    options['connect_args'] = {'options': '-c statement_timeout={}'.format(statement_timeout)}
+
+  return options
+
+
+'''
+PoolStats
+
+Process-wide counters of the connection checkouts: how many there were,
+how long they waited for a connection (in total, at most, and as a moving
+average of the recent ones, with the time of the last one), how many had to open an overflow connection
+and how many timed out.
+'''
+class PoolStats(object):
+
+  def __init__(self):
+    self._lock = threading.Lock()
+    self.reset()
+
+  def reset(self):
+    with self._lock:
+      self.checkouts = 0
+      self.wait_total = 0.0
+      self.wait_max = 0.0
+      self.recent_wait = 0.0
+      self.recent_wait_at = 0.0
+      self.overflow_events = 0
+      self.timeouts = 0
+
+  def _record_wait(self, wait):
+    self.wait_total += wait
+    self.wait_max = max(self.wait_max, wait)
+    self.recent_wait += RECENT_WAIT_WEIGHT * (wait - self.recent_wait)
+    self.recent_wait_at = time.time()
+
+  def record_checkout(self, wait, overflowed):
+    with self._lock:
+      self.checkouts += 1
+      self._record_wait(wait)
+      if overflowed:
+        self.overflow_events += 1
+
+  def record_timeout(self, wait):
+    with self._lock:
+      self.timeouts += 1
+      self._record_wait(wait)
+
+  def snapshot(self):
+    with self._lock:
+      return {
+        'checkouts': self.checkouts,
+        'checkout_wait_seconds_total': self.wait_total,
+        'checkout_wait_seconds_max': self.wait_max,
+        'checkout_wait_seconds_recent': self.recent_wait,
+        'overflow_events': self.overflow_events,
+        'timeouts': self.timeouts
+      }
+
+
+pool_stats = PoolStats()
+
+
+'''
+InstrumentedQueuePool
+
+QueuePool that times every checkout (including waiting for a connection to
+be returned when the pool is exhausted) and records it in pool_stats.
+'''
+class InstrumentedQueuePool(QueuePool):
+
+  def _do_get(self):
+    overflow = self._overflow
+    start = time.perf_counter()
+
+    try:
+      connection = super(InstrumentedQueuePool, self)._do_get()
+    except exc.TimeoutError:
+      pool_stats.record_timeout(time.perf_counter() - start)
+      raise
+
+    pool_stats.record_checkout(time.perf_counter() - start, self._overflow > max(overflow, 0))
+    return connection
+
+
+'''
+pool_status(engine)
+
+Current state of the pool of `engine` and the checkout counters.
+'''
+def pool_status(engine):
+  pool = engine.pool
+  status = {'pool': type(pool).__name__}
+
+  if isinstance(pool, QueuePool):
+    status.update({
+      'size': pool.size(),
+      'checked_in': pool.checkedin(),
+      'checked_out': pool.checkedout(),
+      'overflow': max(pool.overflow(), 0)
+    })
+
+  status.update(pool_stats.snapshot())
+  return status
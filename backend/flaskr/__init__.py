@@ -1,22 +1,77 @@
-import os
-from flask import Flask, request, abort, jsonify
-from flask_sqlalchemy import SQLAlchemy
+from flask import Flask, Response, request, abort, g, jsonify, stream_with_context
 from flask_cors import CORS
-import random
-
-from models import setup_db, Question, Category
+from sqlalchemy.exc import SQLAlchemyError
+from werkzeug.exceptions import BadRequest
+
+from models import setup_db, db, Question, CategoryQuestionCount
+from db_pool import pool_status
+from bulk import EXPORT_BATCH_SIZE, IMPORT_BATCH_SIZE, MIMETYPES, PARSERS, export_questions, import_questions
+from .cache import init_category_cache
+from .counts import init_question_counts
+from .http_cache import conditional
+from .metrics import metrics, track_requests
+from .pagination import paginate_questions
+from .profiling import QueryProfiler
+from .quiz import (ALL_CATEGORIES, BATCH_QUESTION_FIELDS, MAX_CHECKED_ANSWERS, difficulty_tiers, grade_answer,
+                   init_question_ids, quiz_batch_size, select_random_question, select_random_questions)
+from .rate_limit import RateLimiter
+from .response_cache import cached, init_response_cache
+from .search import init_search_index, search_questions
+from .serialization import json_response
+from .sessions import QUIZ_SESSION_MAX_ENTRIES, QUIZ_SESSION_TTL, QuizSessions
+from .suggest import MAX_SUGGESTIONS, SUGGESTIONS, init_suggest_index, suggest_questions
+from .store import MemoryStore
+from .versions import init_table_versions
 
 # Initialization of global variables
-QUESTIONS_PER_PAGE = 10
 ERROR_400_MESSAGE = "Bad request"
 ERROR_404_MESSAGE = "Resource not found"
 ERROR_405_MESSAGE = "Method not found"
 ERROR_422_MESSAGE = "Uprocessable"
+ERROR_429_MESSAGE = "Too many requests"
+ERROR_503_MESSAGE = "Service unavailable"
 
 def create_app(test_config=None):
   # create and configure the app
   app = Flask(__name__)
+  if test_config is not None:
+    app.config.from_mapping(test_config)
   setup_db(app)
+
+  '''
+  The category cache, the question counts and the in-process indexes of the
+  quiz, search and autocomplete endpoints belong to the app, so that apps
+  sharing the process never see each other's data.
+  '''
+  init_category_cache(app)
+  init_question_counts(app)
+  init_question_ids(app)
+  init_search_index(app)
+  init_suggest_index(app)
+  category_cache = app.extensions['category_cache']
+  question_counts = app.extensions['question_counts']
+
+  '''
+  Quiz sessions are kept in QUIZ_SESSION_STORE, or else in an in-process
+  MemoryStore of at most QUIZ_SESSION_MAX_ENTRIES sessions.
+  '''
+  quiz_sessions = QuizSessions(
+    app.config.get('QUIZ_SESSION_STORE') or MemoryStore(app.config.get('QUIZ_SESSION_MAX_ENTRIES', QUIZ_SESSION_MAX_ENTRIES)),
+    app.extensions['question_ids'], ttl=app.config.get('QUIZ_SESSION_TTL', QUIZ_SESSION_TTL))
+
+  '''
+  Table versions behind the ETags are kept in VERSION_STORE when one is
+  configured, so that all the workers agree on them. Without it they are
+  kept in process, and a worker may send a stale ETag for at most
+  VERSION_EPOCH_TTL seconds.
+  '''
+  init_table_versions(app)
+
+  '''
+  Pages of questions are cached in RESPONSE_CACHE_STORE when one is
+  configured, in process otherwise.
+  '''
+  init_response_cache(app)
   
   '''
   Set up CORS. Allowed '*' for origins.
@@ -32,51 +87,97 @@ def create_app(test_config=None):
     response.headers.add('Access-Control-Allow-Methods', 'GET, PUT, POST, PATCH, DELETE, OPTIONS')
     return response
 
+  '''
+  Record the latency, status and size of every request for GET /metrics.
+  '''
+  track_requests(app)
+
+  '''
+  Rate limit the quiz and search endpoints per client, and shed them while
+  the database is overloaded.
+  '''
+  rate_limiter = RateLimiter(app)
+
+  '''
+  Build the autocomplete index of GET /questions/suggest before serving the
+  first request, so that suggestions never wait for the database.
+  '''
+  @app.before_first_request
+  def build_suggest_index():
+    app.extensions['suggest_index'].build()
+
+  '''
+  Create the question counts table before the first request if it is missing,
+  e.g. in a database restored from trivia.psql without running the migrations.
+  It is filled on first use.
+  '''
+  @app.before_first_request
+  def create_question_counts():
+    CategoryQuestionCount.__table__.create(db.engine, checkfirst=True)
+
+  '''
+  Count and time the SQL statements of every request (Server-Timing header,
+  GET /debug/queries and the query budgets).
+  '''
+  query_profiler = QueryProfiler(app)
+
+
+  ''' Helper Method for the /debug endpoints, which expose SQL and pool internals. '''
+  def debug_endpoints_enabled():
+    return app.config.get('DEBUG_ENDPOINTS', app.debug or app.testing)
+
+
+  ''' Helper Methods for minimal write responses. '''
+
+  def prefers_minimal_response(request):
+    return 'return=minimal' in request.headers.get('Prefer', '')
+
+  def wants_minimal_response(request):
+    return request.args.get('return') == 'minimal' or prefers_minimal_response(request)
+
+  def minimal_response(payload):
+    response = jsonify(payload)
+    if prefers_minimal_response(request):
+      response.headers['Preference-Applied'] = 'return=minimal'
+    return response
 
   '''
   GET /categories
 
   Endpoint to handle GET requests for all available categories.
+  Conditional requests (If-None-Match / If-Modified-Since) are answered with 304
+  while the categories and questions are unchanged.
 
   Returns:
       - list of categories
+      - number of questions of every category
       - success value
       - total number of categories
   '''
   @app.route('/categories', methods=['GET'])
+  @conditional('categories', 'questions')
   def retrive_categories():
 
-    selection = Category.query.all()
-    categories = {}
-
-    for category in selection:
-      categories[category.id] = category.type
+    # Served from the shared category cache
+    categories = category_cache.types()
       
     if categories is None or len(categories) == 0:
       abort(404)
     else:
-      return jsonify({
+      return json_response({
         'success': True,
         'categories': categories,
+        'question_counts': question_counts.categories(),
         'total_categories': len(categories)
       })
 
-  ''' Helper Method for pagination. '''
-
-  def paginate_questions(request, selection):
-    page = request.args.get('page', 1, type=int)
-    start = (page-1) * QUESTIONS_PER_PAGE
-    end = start + QUESTIONS_PER_PAGE
-
-    questions = [question.format() for question in selection]
-    current_questions = questions[start:end]
-
-    return current_questions
-
   '''
   GET /questions
 
   Endpoint to handle GET requests for questions, including pagination (every 10 questions). 
+  Pass ?cursor=<next_cursor> (or ?after_id=<id>) and ?limit=N instead of ?page=N
+  for keyset pagination. Conditional requests are answered with 304 while the questions
+  and categories are unchanged, and pages are served from the response cache.
   
   Returns:
       - list of categories
@@ -84,29 +185,29 @@ def create_app(test_config=None):
       - list of questions
       - success value
       - total number of questions
+      - cursor for the next page
   '''
   @app.route('/questions', methods=['GET'])
+  @conditional('questions', 'categories')
+  @cached('questions', 'categories')
   def retrive_questions():
 
-    # Querying all the questions in the order of their IDs
-    selection = Question.query.order_by(Question.id).all()
-    current_questions = paginate_questions(request, selection)
+    # Querying one page of questions in the order of their IDs
+    selection = paginate_questions(request, Question.query.order_by(Question.id), question_counts.total())
+    current_questions = selection.questions
 
     if current_questions is None or len(current_questions) == 0:
       abort(404)
     else:
-      categories_selction = Category.query.all()
-      categories = {}
-
-      for category in categories_selction:
-        categories[category.id] = category.type
+      categories = category_cache.types()
 
-      return jsonify({
+      return json_response({
         'success': True,
         'questions': current_questions,
-        'total_questions': len(selection),
+        'total_questions': selection.total,
         'current_category': None,
-        'categories': categories
+        'categories': categories,
+        'next_cursor': selection.next_cursor
       })
 
   
@@ -114,6 +215,8 @@ def create_app(test_config=None):
   DELETE /questions/<int:question_id>
   
   Endpoint to DELETE question using a question ID.
+  With ?return=minimal (or a `Prefer: return=minimal` header) only the deleted
+  question id, the success value and the total number of questions are returned.
 
   Returns:
       - list of categories
@@ -125,33 +228,42 @@ def create_app(test_config=None):
   '''
   @app.route('/questions/<int:question_id>', methods=['DELETE'])
   def delete_question(question_id):
+    # Querying for the Question with ID equal to question_id
+    question = Question.query.filter(Question.id == question_id).one_or_none()
+
+    if question is None:
+      abort(422) # Unprocessable Entity, as documented for a question that does not exist
+
     try:
-      # Querying for the Question with ID equal to question_id
-      question = Question.query.filter(Question.id == question_id).one_or_none()
-      
-      if question is None:
-        abort(404) # Not Found
-      
       question.delete()
-      # Update UI with updated set of questions
-      questions_selection = Question.query.order_by(Question.id).all()
-      current_questions = paginate_questions(request, questions_selection)
-
-      # Querying for all the categories available
-      categories_selection = Category.query.order_by(Category.type).all()
-      categories = [category.format() for category in categories_selection]
+    except SQLAlchemyError:
+      db.session.rollback()
+      abort(422) # Unprocessable Entity
 
-      return jsonify({
+    # The question is deleted from here on, so errors (e.g. a 400 for a bad cursor)
+    # are reported as they are rather than as a failed delete
+    if wants_minimal_response(request):
+      return minimal_response({
         'success': True,
         'deleted': question_id,
-        'questions': current_questions,
-        'total_questions': len(questions_selection),
-        'current_category': None,
-        'categories': categories
+        'total_questions': question_counts.total()
       })
 
-    except:
-      abort(422) # Unprocessable Entity
+    # Update UI with updated set of questions
+    questions_selection = paginate_questions(request, Question.query.order_by(Question.id), question_counts.total())
+    current_questions = questions_selection.questions
+
+    # All the categories available, ordered by type
+    categories = category_cache.formatted()
+
+    return jsonify({
+      'success': True,
+      'deleted': question_id,
+      'questions': current_questions,
+      'total_questions': questions_selection.total,
+      'current_category': None,
+      'categories': categories
+    })
 
   
   '''
@@ -165,6 +277,9 @@ def create_app(test_config=None):
       - category
       - difficulty score.
 
+  With ?return=minimal (or a `Prefer: return=minimal` header) only the created
+  question id, the success value and the total number of questions are returned.
+
   Returns:
       - list of categories
       - created question id
@@ -189,33 +304,37 @@ def create_app(test_config=None):
 
       try:
         if search:
-          questions_selection = Question.query.order_by(Question.id).filter(Question.question.ilike('%{}%'.format(search))).all()
-          current_questions = paginate_questions(request, questions_selection)
+          # Ranked and paginated by the search backend
+          questions_selection = search_questions(request, search)
+          current_questions = questions_selection.questions
 
-          return jsonify({
+          return json_response({
             'success': True,
             'questions': current_questions,
-            'total_questions': len(questions_selection),
+            'total_questions': questions_selection.total,
             'current_category': None
           })
         else:
           question = Question(new_question, new_answer, new_category, new_difficulty_score)
           question.insert()
 
-          questions_selection = Question.query.order_by(Question.id).all()
-          current_questions = paginate_questions(request, questions_selection)
+          if wants_minimal_response(request):
+            return minimal_response({
+              'success': True,
+              'created': question.id,
+              'total_questions': question_counts.total()
+            })
 
-          categories_selection = Category.query.all()
-          categories = {}
+          questions_selection = paginate_questions(request, Question.query.order_by(Question.id), question_counts.total())
+          current_questions = questions_selection.questions
 
-          for category in categories_selection:
-            categories[category.id] = category.type
+          categories = category_cache.types()
 
           return jsonify({
             'success': True,
             'created': question.id,
             'questions': current_questions,
-            'total_questions': len(questions_selection),
+            'total_questions': questions_selection.total,
             'current_category': question.category,
             'categories': categories
           })
@@ -227,6 +346,7 @@ def create_app(test_config=None):
   POST /questions
 
   Endpoint to get questions based on a search term ( search term is the substring of the question ).
+  Results are ranked by how well they match, best match first, and paginated with ?page=N.
 
   Returns:
       - current category (always None)
@@ -239,35 +359,136 @@ def create_app(test_config=None):
   '''
 
 
+  '''
+  POST /questions/bulk
+
+  Endpoint to import many questions at once. The body is streamed as JSON Lines
+  (default, or `Content-Type: application/x-ndjson`) or CSV with a header row
+  (?format=csv or `Content-Type: text/csv`), each row with the question, answer,
+  category and difficulty fields. Rows are inserted in batches of ?batch_size=N,
+  one transaction per batch, and invalid rows are reported instead of aborting
+  the import.
+
+  Returns:
+      - number of inserted questions
+      - number of failed rows
+      - list of row errors (line number and error)
+      - success value
+      - total number of questions
+  '''
+  @app.route('/questions/bulk', methods=['POST'])
+  def bulk_import_questions():
+    format = request.args.get('format', None)
+    if format is None:
+      format = 'csv' if request.mimetype == 'text/csv' else 'jsonl'
+    if format not in PARSERS:
+      abort(400) # Bad Request
+
+    batch_size = request.args.get('batch_size', IMPORT_BATCH_SIZE, type=int)
+    if batch_size < 1:
+      abort(400) # Bad Request
+
+    # Decoded line by line by the parser, which reports the lines that are not UTF-8
+    report = import_questions(request.stream, format, batch_size)
+
+    return jsonify({
+      'success': True,
+      'inserted': report['inserted'],
+      'failed': report['failed'],
+      'errors': report['errors'],
+      'total_questions': question_counts.total()
+    })
+
+
+  '''
+  GET /questions/export
+
+  Endpoint to download the whole question bank as JSON Lines (default) or CSV
+  (?format=csv). Rows are streamed from a server-side cursor in a chunked
+  response, so memory use stays the same however big the table is.
+
+  Returns:
+      - one line per question with its id, question, answer, category and difficulty
+  '''
+  @app.route('/questions/export', methods=['GET'])
+  def export_question_bank():
+    format = request.args.get('format', 'jsonl')
+    if format not in PARSERS:
+      abort(400) # Bad Request
+
+    batch_size = request.args.get('batch_size', EXPORT_BATCH_SIZE, type=int)
+    if batch_size < 1:
+      abort(400) # Bad Request
+
+    response = Response(stream_with_context(export_questions(format, batch_size)), mimetype=MIMETYPES[format])
+    response.headers['Content-Disposition'] = 'attachment; filename=questions.{}'.format(format)
+    return response
+
+
+  '''
+  GET /questions/suggest
+
+  Endpoint to autocomplete the search box: completes the last word of ?q= with the
+  words of the question texts, the most used first, from an in-memory prefix index
+  (no database query). ?limit=N sets the number of suggestions (default 10, at most 50).
+
+  Returns:
+      - list of suggested search terms
+      - success value
+  '''
+  @app.route('/questions/suggest', methods=['GET'])
+  def suggest_search_terms():
+    query = request.args.get('q', None)
+    if query is None:
+      abort(400) # Bad Request
+
+    limit = request.args.get('limit', SUGGESTIONS, type=int)
+    limit = max(1, min(limit, MAX_SUGGESTIONS))
+
+    return json_response({
+      'success': True,
+      'suggestions': suggest_questions(query, limit)
+    })
+
+
   '''
   GET categories/<int:category_id>/questions
 
   Endpoint to get questions based on category.
+  Supports the same ?page=N and ?cursor=<next_cursor> pagination, conditional
+  requests and response cache as GET /questions.
   
   Returns:
       - current category
       - list of questions
       - success value
       - total number of questions
+      - cursor for the next page
   '''
   @app.route('/categories/<int:category_id>/questions', methods=['GET'])
+  @conditional('questions', 'categories')
+  @cached('questions', 'categories')
   def get_questions_based_on_category(category_id):
     try:
       # Check if category with 'category_id' is available and return the response.
-      category = Category.query.filter(Category.id == category_id).one_or_none()
+      category_type = category_cache.get_type(category_id)
       
-      if category is None:
+      if category_type is None:
         abort(404)
       else:
-        questions_selection = Question.query.order_by(Question.id).filter(Question.category == category_id).all()
-        questions_with_category_id = paginate_questions(request, questions_selection)
+        questions_query = Question.query.order_by(Question.id).filter(Question.category == category_id)
+        questions_selection = paginate_questions(request, questions_query, question_counts.category(category_id))
+        questions_with_category_id = questions_selection.questions
       
-        return jsonify({
+        return json_response({
           'success': True,
           'questions': questions_with_category_id,
-          'total_questions': len(questions_selection),
-          'current_category': category.type
+          'total_questions': questions_selection.total,
+          'current_category': category_type,
+          'next_cursor': questions_selection.next_cursor
           })
+    except BadRequest:
+      raise
     except:
       abort(404)
       
@@ -281,9 +502,19 @@ def create_app(test_config=None):
       - list of previous question ids, list can be empty while starting the game
       - quiz category
 
+  Optional:
+      - difficulty: N or {"min": N, "max": M} to only ask questions of those difficulties
+      - adaptive: {"difficulty": N, "correct": true|false} to ask the next question one
+        difficulty level above (after a correct answer) or below (after a wrong one) the
+        difficulty N of the previous question
+      - count: K (up to 20) to get the next K questions at once, without their answers
+        (to have the guesses checked with POST /quizzes/answers, get the batches from
+        a quiz session instead)
+
   Returns:
       - previousQuestions
-      - a random question (that is not one of the previous questions)
+      - a random question (that is not one of the previous questions),
+        or a list of `count` random questions
       - success value
   '''
   @app.route('/quizzes', methods=['POST'])
@@ -299,58 +530,52 @@ def create_app(test_config=None):
         quiz_category_response = body.get('quiz_category', None)
 
         if quiz_category_response['type'] == 'ALL' and quiz_category_response['id'] == 0:
-          
-          
-          # Query the questions in all the Categories
-          questions_of_quiz_category = Question.query.order_by(Question.id).all()
-          formated_questions = paginate_questions(request, questions_of_quiz_category)
-
-        else:  
+          # Sample from the questions in all the Categories
+          quiz_category_id = ALL_CATEGORIES
+        else:
           # Get the `quiz_category_id`
-          quiz_category_id = quiz_category_response['id']
-
-          # Query the questions in the Category with `quiz_category_id`
-          questions_of_quiz_category = Category.query.get(quiz_category_id).questions
-          formated_questions = paginate_questions(request, questions_of_quiz_category)
-
-        # Initialization
-        question_ids = []
-        random_question_id = 0
-        new_random_question = None
-       
-        ## Edge case: If the length of `previous_questions` is equal to the len `formated_questions`
-        # return the response with `question` & `previousQuestions` as None.
-        if len(previous_questions) == len(formated_questions):
-          return jsonify({
-          'success': True,
-          'question': new_random_question,
-          'previousQuestions': None
+          quiz_category_id = int(quiz_category_response['id'])
+
+        # The ids of the previous questions, used as the exclusion set
+        previous_questions = [int(id) for id in previous_questions]
+
+        if 'count' in body:
+          # Batch of questions, drawn from the id index and loaded with one query
+          questions = select_random_questions(quiz_category_id, previous_questions, quiz_batch_size(body),
+                                              tiers=difficulty_tiers(body))
+
+          if not questions and quiz_category_id != ALL_CATEGORIES and category_cache.get_type(quiz_category_id) is None:
+            abort(422) # Unprocessable Entity
+
+          metrics.inc('trivia_quiz_questions_served_total', (('mode', 'batch'),), len(questions))
+
+          return json_response({
+            'success': True,
+            'questions': questions,
+            'previousQuestions': previous_questions + [question['id'] for question in questions]
           })
-        
-        # Generate a list of questions ids in `question_ids`
-        for question in formated_questions:
-          question_ids.append(question.get('id'))
 
-        if len(previous_questions) == 0:
-          # Generate a random question id from the full list of `question_ids` and append it to the `previous_questions`
-          random_question_id = random.choice(question_ids)
-          previous_questions.append(random_question_id)
+        # Pick a random unseen question of the requested difficulties using the
+        # per-category id index, loading only the chosen row
+        new_random_question = select_random_question(quiz_category_id, previous_questions,
+                                                     tiers=difficulty_tiers(body))
 
-        else:
-          # Eliminate the previous question id's from the full list of `question_ids`
-          for id in previous_questions:
-            if id in question_ids:
-              question_ids.remove(id)
+        ## Edge case: If every question of the category has been played
+        # return the response with `question` & `previousQuestions` as None.
+        if new_random_question is None:
+          if quiz_category_id != ALL_CATEGORIES and category_cache.get_type(quiz_category_id) is None:
+            abort(422) # Unprocessable Entity
 
-          # Generate a random question id from `question_ids` list
-          random_question_id = random.choice(question_ids)
+          return json_response({
+          'success': True,
+          'question': None,
+          'previousQuestions': None
+          })
 
-        # Looping through `formated_questions` to get the question with id `random_question_id`
-        for question in formated_questions:
-          if question.get('id') == random_question_id:
-            new_random_question = question
+        previous_questions.append(new_random_question['id'])
+        metrics.inc('trivia_quiz_questions_served_total', (('mode', 'quiz'),))
 
-        return jsonify({
+        return json_response({
           'success': True,
           'question': new_random_question,
           'previousQuestions': previous_questions
@@ -358,8 +583,263 @@ def create_app(test_config=None):
       except:
         abort(422) # Unprocessable Entity
 
+  '''
+  POST /quizzes/answers
+
+  Endpoint to check the guesses for the questions a quiz session has sent, e.g. in
+  a batch from POST /quizzes/sessions/<session_id>/next, with the same rule as the
+  quiz page (the guess must be one of the words of the answer).
+
+  Requires:
+      - session_id: the quiz session the questions were sent by
+      - answers: the guess for each question, as {question id: guess}
+
+  Returns:
+      - for each question id, whether the guess is correct and the answer, or an
+        error when the id is not a number, the guess is not a string or the
+        question was not sent by the session
+      - number of correct guesses
+      - success value
+  '''
+  @app.route('/quizzes/answers', methods=['POST'])
+  def check_quiz_answers():
+    body = request.get_json()
+
+    if body is None:
+      abort(422) # Unprocessable Entity
+
+    try:
+      session_id = body['session_id']
+      items = list(body['answers'].items())
+    except (AttributeError, KeyError, TypeError):
+      abort(422) # Unprocessable Entity
+
+    if not isinstance(session_id, str) or len(items) > MAX_CHECKED_ANSWERS:
+      abort(422) # Unprocessable Entity
+
+    results = {}
+    guesses = []
+    for key, guess in items:
+      try:
+        question_id = int(key)
+      except ValueError:
+        results[key] = {'error': 'invalid question id'}
+        continue
+
+      if isinstance(guess, str):
+        guesses.append((key, question_id, guess))
+      else:
+        results[key] = {'error': 'guess must be a string'}
+
+    try:
+      served = quiz_sessions.served(session_id, [question_id for _, question_id, _ in guesses])
+    except KeyError:
+      abort(404) # Not Found
+
+    answers = {}
+    if served:
+      answers = dict(db.session.query(Question.id, Question.answer).filter(Question.id.in_(list(served))))
+
+    for key, question_id, guess in guesses:
+      if question_id in answers:
+        results[key] = {
+          'correct': grade_answer(answers[question_id], guess),
+          'answer': answers[question_id]
+        }
+      else:
+        results[key] = {'error': 'not sent by this quiz session'}
+
+    return json_response({
+      'success': True,
+      'results': results,
+      'correct': sum(1 for result in results.values() if result.get('correct'))
+    })
+
+  '''
+  POST /quizzes/sessions
+
+  Endpoint to start a quiz session. The server keeps a shuffled order of the
+  questions of the category, so the client does not have to send the list
+  of previous questions with every request.
+
+  Requires:
+      - quiz category
+
+  Returns:
+      - session id
+      - total number of questions in the session
+      - success value
+  '''
+  @app.route('/quizzes/sessions', methods=['POST'])
+  def start_quiz_session():
+    body = request.get_json()
+
+    if body is None:
+      abort(422) # Unprocessable Entity
+
+    try:
+      quiz_category_response = body.get('quiz_category', None)
+
+      if quiz_category_response['type'] == 'ALL' and quiz_category_response['id'] == 0:
+        quiz_category_id = ALL_CATEGORIES
+      else:
+        quiz_category_id = int(quiz_category_response['id'])
+        if category_cache.get_type(quiz_category_id) is None:
+          abort(422) # Unprocessable Entity
+
+      session_id, total_questions = quiz_sessions.start(quiz_category_id)
+      metrics.inc('trivia_quiz_sessions_started_total')
+
+      return jsonify({
+        'success': True,
+        'session_id': session_id,
+        'total_questions': total_questions
+      })
+    except:
+      abort(422) # Unprocessable Entity
+
+  '''
+  POST /quizzes/sessions/<session_id>/next
+
+  Endpoint to get the next question of a quiz session, or with "count": K in the
+  body the next K questions at once, without their answers. Their guesses are then
+  checked with POST /quizzes/answers.
+
+  Returns:
+      - the next question (None once all the questions have been played), or the
+        next questions (fewer once they run out)
+      - number of questions left
+      - success value
+  '''
+  @app.route('/quizzes/sessions/<session_id>/next', methods=['POST'])
+  def next_quiz_session_question(session_id):
+    body = request.get_json(silent=True) or {}
+
+    try:
+      count = quiz_batch_size(body) if 'count' in body else None
+    except (KeyError, TypeError, ValueError):
+      abort(422) # Unprocessable Entity
+
+    try:
+      if count is not None:
+        questions, remaining = quiz_sessions.next_questions(session_id, count, BATCH_QUESTION_FIELDS)
+      else:
+        question, remaining = quiz_sessions.next_question(session_id)
+    except KeyError:
+      abort(404) # Not Found
+
+    if count is not None:
+      metrics.inc('trivia_quiz_questions_served_total', (('mode', 'session'),), len(questions))
+
+      return json_response({
+        'success': True,
+        'questions': questions,
+        'remaining_questions': remaining
+      })
+
+    if question is not None:
+      metrics.inc('trivia_quiz_questions_served_total', (('mode', 'session'),))
+
+    return json_response({
+      'success': True,
+      'question': question,
+      'remaining_questions': remaining
+    })
+
+  '''
+  DELETE /quizzes/sessions/<session_id>
+
+  Endpoint to end a quiz session before it expires.
+
+  Returns:
+      - ended session id
+      - success value
+  '''
+  @app.route('/quizzes/sessions/<session_id>', methods=['DELETE'])
+  def end_quiz_session(session_id):
+    if not quiz_sessions.end(session_id):
+      abort(404) # Not Found
+
+    return jsonify({
+      'success': True,
+      'ended': session_id
+    })
+
+  '''
+  GET /debug/pool
+
+  Endpoint to inspect the database connection pool. Only served with DEBUG_ENDPOINTS = True
+  (by default in debug and testing mode).
+
+  Returns:
+      - pool size, checked in, checked out and overflow connections
+      - number of checkouts, checkout wait times, overflow events and timeouts
+      - success value
+  '''
+  @app.route('/debug/pool', methods=['GET'])
+  def get_pool_status():
+    if not debug_endpoints_enabled():
+      abort(404)
+
+    return jsonify({
+      'success': True,
+      'pool': pool_status(db.engine)
+    })
+
+  '''
+  GET /debug/queries
+
+  Endpoint to inspect the SQL statements of the latest requests. Only served with
+  DEBUG_ENDPOINTS = True (by default in debug and testing mode).
+
+  Returns:
+      - list of the latest requests, each with its endpoint, number of queries,
+        total database time and slowest statements
+      - success value
+  '''
+  @app.route('/debug/queries', methods=['GET'])
+  def get_query_profiles():
+    if not debug_endpoints_enabled():
+      abort(404)
+
+    return jsonify({
+      'success': True,
+      'requests': list(query_profiler.recent)
+    })
+
+  '''
+  GET /metrics
+
+  Endpoint for Prometheus to scrape: request counts, latency and response size
+  histograms, in-flight requests and error counts per endpoint, quiz sessions,
+  cache hit rates and connection pool statistics, in the Prometheus text format.
+  '''
+  @app.route('/metrics', methods=['GET'])
+  def get_metrics():
+    extra = {}
+
+    for name, stats in (('category_cache', category_cache.stats()), ('response_cache', app.extensions['response_cache'].stats())):
+      extra['trivia_{}_hits_total'.format(name)] = ('counter', 'Hits of the {}.'.format(name.replace('_', ' ')), stats['hits'])
+      extra['trivia_{}_misses_total'.format(name)] = ('counter', 'Misses of the {}.'.format(name.replace('_', ' ')), stats['misses'])
+
+    for name, value in pool_status(db.engine).items():
+      if isinstance(value, (int, float)):
+        extra['trivia_db_pool_{}'.format(name)] = ('gauge', 'Connection pool {}.'.format(name.replace('_', ' ')), value)
+
+    return Response(metrics.render(extra), mimetype='text/plain; version=0.0.4')
+
   ''' Error handlers for all the expected errors '''
 
+  ''' ERROR 400 '''
+  @app.errorhandler(400)
+  def bad_request(error):
+    return jsonify({
+      'success': False,
+      'error': 400,
+      'message': ERROR_400_MESSAGE,
+      'error_message': str(error)
+    }), 400
+
   ''' ERROR 404 '''
   @app.errorhandler(404)
   def resource_not_found(error):
@@ -380,6 +860,30 @@ def create_app(test_config=None):
       'error_message': str(error)
     }), 422
 
+  ''' ERROR 429 '''
+  @app.errorhandler(429)
+  def too_many_requests(error):
+    response = jsonify({
+      'success': False,
+      'error': 429,
+      'message': ERROR_429_MESSAGE,
+      'error_message': str(error)
+    })
+    response.headers['Retry-After'] = str(g.get('retry_after', 1))
+    return response, 429
+
+  ''' ERROR 503 '''
+  @app.errorhandler(503)
+  def service_unavailable(error):
+    response = jsonify({
+      'success': False,
+      'error': 503,
+      'message': ERROR_503_MESSAGE,
+      'error_message': str(error)
+    })
+    response.headers['Retry-After'] = str(g.get('retry_after', 1))
+    return response, 503
+
   ''' ERROR 405 '''
   @app.errorhandler(405)
   def method_not_allowed(error):
@@ -0,0 +1,485 @@
+'''
+Async serving mode
+
+ASGI entry point for the app. The quiz and listing endpoints, which make up
+most of the traffic, are served by async handlers on an asyncpg connection
+pool, so a waiting database query no longer holds a worker thread. Every
+other request is passed on to the regular Flask app created by
+create_app(), so all the routes, error handlers and response shapes stay
+the same. The async handlers parse their arguments like the Flask views,
+are rate limited and shed by the same RateLimiter, and send the same
+ETag / Cache-Control / Server-Timing headers and request metrics;
+test_asgi.py compares the two.
+
+    - GET  /questions                               (?page=N, ?cursor= / ?after_id= with ?limit=N)
+    - GET  /categories/<int:category_id>/questions
+    - POST /quizzes
+
+Needs the optional asyncpg and asgiref packages and an ASGI server, e.g.
+from the backend directory:
+
+    uvicorn --factory flaskr.asgi:create_asgi_app
+'''
+import json
+import re
+import time
+from contextlib import asynccontextmanager
+from urllib.parse import parse_qsl
+
+from werkzeug.datastructures import MultiDict
+from werkzeug.exceptions import (BadRequest, HTTPException, NotFound, ServiceUnavailable, TooManyRequests,
+                                 UnprocessableEntity, abort)
+from werkzeug.http import http_date, parse_date, parse_etags
+
+try:
+  import asyncpg
+except ImportError:
+  asyncpg = None
+
+try:
+  from asgiref.wsgi import WsgiToAsgi
+except ImportError:
+  WsgiToAsgi = None
+
+from db_pool import pool_setting, pool_stats
+from . import create_app, ERROR_400_MESSAGE, ERROR_404_MESSAGE, ERROR_422_MESSAGE, ERROR_429_MESSAGE, ERROR_503_MESSAGE
+from .counts import TOTAL_QUESTIONS
+from .http_cache import HTTP_CACHE_MAX_AGE, is_not_modified, validators
+from .metrics import LATENCY_BUCKETS, SIZE_BUCKETS, metrics
+from .pagination import EMPTY_PAGE, cut_page, page_window
+from .quiz import (ALL_CATEGORIES, QUESTION_COUNT, QUESTION_ID_ROWS, difficulty_tiers, draw_question, draw_questions,
+                   quiz_batch_size)
+from .profiling import RequestProfile
+from .serialization import QUESTION_FIELDS, dumps
+
+QUESTION_SELECT = 'SELECT {} FROM questions'.format(', '.join(QUESTION_FIELDS))
+
+ERROR_MESSAGES = {
+  400: (ERROR_400_MESSAGE, BadRequest),
+  404: (ERROR_404_MESSAGE, NotFound),
+  422: (ERROR_422_MESSAGE, UnprocessableEntity),
+  429: (ERROR_429_MESSAGE, TooManyRequests),
+  503: (ERROR_503_MESSAGE, ServiceUnavailable)
+}
+
+CORS_HEADERS = [
+  (b'access-control-allow-headers', b'Content-Type,Authorization,true'),
+  (b'access-control-allow-methods', b'GET, PUT, POST, PATCH, DELETE, OPTIONS')
+]
+
+CATEGORY_QUESTIONS_PATH = re.compile(r'^/categories/(\d+)/questions$')
+# Tables the conditional (ETag) listings depend on, as with @conditional in create_app()
+LISTING_TABLES = ('questions', 'categories')
+
+
+''' Helper Method to tell a JSON body apart, like request.is_json. '''
+def is_json(headers):
+  mimetype = headers.get(b'content-type', b'').decode('latin-1').split(';')[0].strip().lower()
+  return mimetype == 'application/json' or (mimetype.startswith('application/') and mimetype.endswith('+json'))
+
+
+def error_payload(status):
+  message, exception = ERROR_MESSAGES[status]
+  return {
+    'success': False,
+    'error': status,
+    'message': message,
+    'error_message': str(exception())
+  }
+
+
+'''
+TimedConnection
+
+Wraps an asyncpg connection to count and time its queries in a
+RequestProfile, for the Server-Timing header of the async handlers.
+'''
+class TimedConnection(object):
+
+  def __init__(self, connection, profile):
+    self.connection = connection
+    self.profile = profile
+
+  async def _timed(self, method, query, args):
+    start = time.perf_counter()
+    try:
+      return await method(query, *args)
+    finally:
+      self.profile.record(query, time.perf_counter() - start)
+
+  async def fetch(self, query, *args):
+    return await self._timed(self.connection.fetch, query, args)
+
+  async def fetchrow(self, query, *args):
+    return await self._timed(self.connection.fetchrow, query, args)
+
+  async def fetchval(self, query, *args):
+    return await self._timed(self.connection.fetchval, query, args)
+
+
+'''
+AsyncTriviaApp
+
+The ASGI application. The connection pool is opened and closed with the
+ASGI lifespan events and sized like the synchronous one (DB_POOL_SIZE,
+DB_MAX_OVERFLOW). The handlers share the pagination, the category cache
+and the quiz draws (and their question id index) of the Flask views, and
+only run the queries.
+'''
+class AsyncTriviaApp(object):
+
+  def __init__(self, flask_app):
+    self.flask_app = flask_app
+    self.wsgi = WsgiToAsgi(flask_app)
+    self.pool = None
+    self.category_cache = flask_app.extensions['category_cache']
+    self.index = flask_app.extensions['question_ids']
+
+  async def startup(self):
+    pool_size = pool_setting(self.flask_app, 'DB_POOL_SIZE')
+    database_url = self.flask_app.config['SQLALCHEMY_DATABASE_URI'].replace('postgresql+psycopg2://', 'postgresql://')
+    self.pool = await asyncpg.create_pool(
+      database_url,
+      min_size=pool_size,
+      max_size=pool_size + pool_setting(self.flask_app, 'DB_MAX_OVERFLOW'),
+      max_inactive_connection_lifetime=pool_setting(self.flask_app, 'DB_POOL_RECYCLE'))
+
+  async def shutdown(self):
+    if self.pool is not None:
+      await self.pool.close()
+
+  async def __call__(self, scope, receive, send):
+    if scope['type'] == 'lifespan':
+      await self.lifespan(receive, send)
+      return
+
+    route = self.route(scope)
+    if route is None:
+      await self.wsgi(scope, receive, send)
+      return
+
+    endpoint, handler, tables = route
+    started_at = time.perf_counter()
+    metrics.track_in_flight(1)
+
+    # Same rate limits and load shedding as the Flask endpoint
+    rate_limiter = self.flask_app.extensions['rate_limiter']
+    limited, rejected = rate_limiter.limits(endpoint), None
+    if limited:
+      client = scope.get('client') or (None, None)
+      rejected = rate_limiter.admit(endpoint, 'ip:{}'.format(client[0]))
+
+    try:
+      if rejected is not None:
+        status, retry_after = rejected
+        body = dumps(error_payload(status))
+        headers = [(b'content-type', b'application/json'), (b'content-length', str(len(body)).encode('latin-1')),
+                   (b'retry-after', str(retry_after).encode('latin-1'))]
+      else:
+        status, headers, body = await self.respond(scope, receive, handler, tables)
+    except Exception:
+      metrics.inc('trivia_http_errors_total', (('endpoint', endpoint), ('status', 500)))
+      raise
+    finally:
+      metrics.track_in_flight(-1)
+      if limited and rejected is None:
+        rate_limiter.release()
+
+    # Same request metrics as metrics.track_requests()
+    metrics.inc('trivia_http_requests_total', (('endpoint', endpoint), ('method', scope['method']), ('status', status)))
+    if status >= 400:
+      metrics.inc('trivia_http_errors_total', (('endpoint', endpoint), ('status', status)))
+    metrics.observe('trivia_http_request_duration_seconds', (('endpoint', endpoint),), time.perf_counter() - started_at, LATENCY_BUCKETS)
+    metrics.observe('trivia_http_response_size_bytes', (('endpoint', endpoint),), len(body), SIZE_BUCKETS)
+
+    await send({
+      'type': 'http.response.start',
+      'status': status,
+      'headers': headers + CORS_HEADERS
+    })
+    await send({'type': 'http.response.body', 'body': body})
+
+  '''
+  Runs the handler and builds the response, with the same conditional
+  request handling and headers as the Flask views: a 304 for a current
+  If-None-Match / If-Modified-Since (for If-None-Match: * only once the
+  handler found the resource), the ETag, Last-Modified and
+  Cache-Control of the `tables`, and a Server-Timing header.
+  '''
+  async def respond(self, scope, receive, handler, tables):
+    profile = RequestProfile()
+    headers = []
+
+    if tables:
+      etag, last_modified = validators(self.flask_app.extensions['table_versions'], tables)
+      request_headers = dict(scope['headers'])
+      if_none_match = parse_etags(request_headers.get(b'if-none-match', b'').decode('latin-1') or None)
+      if_modified_since = parse_date(request_headers.get(b'if-modified-since', b'').decode('latin-1') or None)
+
+      max_age = self.flask_app.config.get('HTTP_CACHE_MAX_AGE', HTTP_CACHE_MAX_AGE)
+      validator_headers = [
+        (b'etag', 'W/"{}"'.format(etag).encode('latin-1')),
+        (b'last-modified', http_date(last_modified).encode('latin-1')),
+        (b'cache-control', ('public, max-age={}'.format(max_age) if max_age else 'public, no-cache').encode('latin-1'))
+      ]
+
+      # Without the entity headers, as Werkzeug sends a 304
+      not_modified_headers = [header for header in validator_headers if header[0] != b'last-modified']
+      if is_not_modified(etag, last_modified, if_none_match, if_modified_since):
+        return 304, not_modified_headers + [self.server_timing(profile)], b''
+
+    try:
+      status, payload = 200, await handler(scope, receive, profile)
+    except HTTPException as error:
+      status, payload = error.code, error_payload(error.code)
+
+    if tables and status == 200 and if_none_match.star_tag:
+      # If-None-Match: * matches now that the handler found the resource
+      return 304, not_modified_headers + [self.server_timing(profile)], b''
+
+    body = dumps(payload)
+    headers.append((b'content-type', b'application/json'))
+    headers.append((b'content-length', str(len(body)).encode('latin-1')))
+    if tables and status == 200:
+      headers.extend(validator_headers)
+    headers.append(self.server_timing(profile))
+    return status, headers, body
+
+  def server_timing(self, profile):
+    value = 'db;dur={:.2f};desc="{} queries"'.format(profile.duration * 1000, profile.count)
+    return (b'server-timing', value.encode('latin-1'))
+
+  '''
+  A pool connection whose queries are recorded in `profile`. The wait for it
+  is recorded in pool_stats, which the load shedding reads.
+  '''
+  @asynccontextmanager
+  async def connection(self, profile):
+    start = time.perf_counter()
+    async with self.pool.acquire() as connection:
+      pool_stats.record_checkout(time.perf_counter() - start, False)
+      yield TimedConnection(connection, profile)
+
+  async def lifespan(self, receive, send):
+    while True:
+      message = await receive()
+      if message['type'] == 'lifespan.startup':
+        try:
+          await self.startup()
+        except Exception as error:
+          await send({'type': 'lifespan.startup.failed', 'message': str(error)})
+          return
+        await send({'type': 'lifespan.startup.complete'})
+      elif message['type'] == 'lifespan.shutdown':
+        await self.shutdown()
+        await send({'type': 'lifespan.shutdown.complete'})
+        return
+
+  '''
+  Returns the (endpoint, async handler, conditional tables) of the request,
+  or None to let Flask serve it. Paths match exactly like the Flask routes,
+  so e.g. /questions/ is left to Flask and its 404.
+  '''
+  def route(self, scope):
+    method, path = scope['method'], scope['path']
+
+    if method == 'GET' and path == '/questions':
+      return 'retrive_questions', self.retrive_questions, LISTING_TABLES
+    if method == 'GET' and CATEGORY_QUESTIONS_PATH.match(path):
+      return 'get_questions_based_on_category', self.get_questions_based_on_category, LISTING_TABLES
+    if method == 'POST' and path == '/quizzes':
+      return 'play_quiz', self.play_quiz, ()
+    return None
+
+  ''' Helper Methods to read the request. '''
+
+  ''' The query string arguments, as a MultiDict like request.args. '''
+  def arguments(self, scope):
+    return MultiDict(parse_qsl(scope.get('query_string', b'').decode('latin-1'), keep_blank_values=True))
+
+  ''' The JSON body, None when it is not JSON like request.get_json(). Invalid JSON is a 400. '''
+  async def body(self, scope, receive):
+    chunks = []
+    while True:
+      message = await receive()
+      chunks.append(message.get('body', b''))
+      if not message.get('more_body', False):
+        break
+
+    if not is_json(dict(scope['headers'])):
+      return None
+    try:
+      return json.loads(b''.join(chunks).decode('utf-8'))
+    except ValueError:
+      abort(400) # Bad Request
+
+  ''' The {id: type} dict of the categories, from the category cache of the Flask views. '''
+  async def category_types(self, connection):
+    snapshot = self.category_cache.cached()
+    if snapshot is None:
+      rows = await connection.fetch('SELECT id, type FROM categories ORDER BY id')
+      snapshot = self.category_cache.fill(tuple(row) for row in rows)
+    return snapshot[1]
+
+  ''' Reads the total from the question counts, counted when they have not been filled yet. '''
+  async def question_count(self, connection, category_id=None):
+    total = await connection.fetchval('SELECT count FROM category_question_counts WHERE category_id = $1',
+                                      TOTAL_QUESTIONS if category_id is None else category_id)
+    if total is None:
+      where = ' WHERE category = $1' if category_id is not None else ''
+      total = await connection.fetchval('SELECT count(*) FROM questions' + where,
+                                        *([category_id] if category_id is not None else []))
+    return total
+
+  ''' Runs the queries of pagination.page_window() of the request, see pagination.paginate_questions(). '''
+  async def paginate(self, connection, arguments, category_id=None):
+    window = page_window(arguments)
+    if window is None:
+      return EMPTY_PAGE
+
+    where, parameters = '', []
+    if category_id is not None:
+      where, parameters = ' WHERE category = $1', [category_id]
+
+    total = await self.question_count(connection, category_id)
+
+    if window.after_id is not None:
+      seek = '{} id > ${}'.format(' AND' if where else ' WHERE', len(parameters) + 1)
+      rows = await connection.fetch(
+        '{}{}{} ORDER BY id LIMIT ${}'.format(QUESTION_SELECT, where, seek, len(parameters) + 2),
+        *(parameters + [window.after_id, window.rows]))
+    else:
+      rows = await connection.fetch(
+        '{}{} ORDER BY id LIMIT ${} OFFSET ${}'.format(QUESTION_SELECT, where, len(parameters) + 1, len(parameters) + 2),
+        *(parameters + [window.rows, window.offset]))
+
+    return cut_page(window, [dict(zip(QUESTION_FIELDS, tuple(row))) for row in rows], total)
+
+  '''
+  Runs a quiz draw, see quiz.draw_question(), with its reads made on the
+  connection.
+  '''
+  async def run_draw(self, connection, draw):
+    try:
+      read = next(draw)
+      while True:
+        read = draw.send(await self.read_for_draw(connection, *read))
+    except StopIteration as stop:
+      return stop.value
+
+  async def read_for_draw(self, connection, kind, *arguments):
+    if kind == QUESTION_ID_ROWS:
+      category_id, = arguments
+      if category_id == ALL_CATEGORIES:
+        rows = await connection.fetch('SELECT id, difficulty FROM questions ORDER BY id')
+      else:
+        rows = await connection.fetch('SELECT id, difficulty FROM questions WHERE category = $1 ORDER BY id', category_id)
+      return [tuple(row) for row in rows]
+
+    if kind == QUESTION_COUNT:
+      category_id, = arguments
+      return await connection.fetchval('SELECT count FROM category_question_counts WHERE category_id = $1',
+                                       TOTAL_QUESTIONS if category_id == ALL_CATEGORIES else category_id)
+
+    ids, fields = arguments
+    rows = await connection.fetch('SELECT {} FROM questions WHERE id = ANY($1::int[])'.format(', '.join(fields)), ids)
+    return [dict(zip(fields, tuple(row))) for row in rows]
+
+  ''' GET /questions, see create_app(). '''
+  async def retrive_questions(self, scope, receive, profile):
+    async with self.connection(profile) as connection:
+      selection = await self.paginate(connection, self.arguments(scope))
+      if not selection.questions:
+        abort(404)
+
+      categories = await self.category_types(connection)
+
+    return {
+      'success': True,
+      'questions': selection.questions,
+      'total_questions': selection.total,
+      'current_category': None,
+      'categories': categories,
+      'next_cursor': selection.next_cursor
+    }
+
+  ''' GET /categories/<int:category_id>/questions, see create_app(). '''
+  async def get_questions_based_on_category(self, scope, receive, profile):
+    category_id = int(CATEGORY_QUESTIONS_PATH.match(scope['path']).group(1))
+
+    async with self.connection(profile) as connection:
+      category_type = (await self.category_types(connection)).get(category_id)
+      if category_type is None:
+        abort(404)
+
+      selection = await self.paginate(connection, self.arguments(scope), category_id)
+
+    return {
+      'success': True,
+      'questions': selection.questions,
+      'total_questions': selection.total,
+      'current_category': category_type,
+      'next_cursor': selection.next_cursor
+    }
+
+  ''' POST /quizzes, see create_app(). '''
+  async def play_quiz(self, scope, receive, profile):
+    body = await self.body(scope, receive)
+    if body is None:
+      abort(422)
+
+    try:
+      quiz_category = body['quiz_category']
+      if quiz_category['type'] == 'ALL' and quiz_category['id'] == 0:
+        category_id = ALL_CATEGORIES
+      else:
+        category_id = int(quiz_category['id'])
+      previous_questions = [int(id) for id in body['previous_questions']]
+      tiers = difficulty_tiers(body)
+      count = quiz_batch_size(body) if 'count' in body else None
+    except (AttributeError, KeyError, TypeError, ValueError):
+      abort(422)
+
+    async with self.connection(profile) as connection:
+      if count is not None:
+        drawn = await self.run_draw(connection, draw_questions(self.index, category_id, previous_questions, count, tiers))
+      else:
+        drawn = await self.run_draw(connection, draw_question(self.index, category_id, previous_questions, tiers))
+
+      if not drawn and category_id != ALL_CATEGORIES and (await self.category_types(connection)).get(category_id) is None:
+        abort(422)
+
+    if count is not None:
+      metrics.inc('trivia_quiz_questions_served_total', (('mode', 'batch'),), len(drawn))
+      return {
+        'success': True,
+        'questions': drawn,
+        'previousQuestions': previous_questions + [question['id'] for question in drawn]
+      }
+
+    if drawn is None:
+      return {
+        'success': True,
+        'question': None,
+        'previousQuestions': None
+      }
+
+    metrics.inc('trivia_quiz_questions_served_total', (('mode', 'quiz'),))
+    return {
+      'success': True,
+      'question': drawn,
+      'previousQuestions': previous_questions + [drawn['id']]
+    }
+
+
+'''
+create_asgi_app(test_config)
+
+Creates the Flask app with create_app(test_config) and wraps it in the
+AsyncTriviaApp.
+'''
+def create_asgi_app(test_config=None):
+  if asyncpg is None or WsgiToAsgi is None:
+    raise RuntimeError('The async serving mode needs the asyncpg and asgiref packages.')
+
+  return AsyncTriviaApp(create_app(test_config))
@@ -0,0 +1,110 @@
+import threading
+import time
+import weakref
+
+from flask import current_app
+
+from models import db, on_category_write, Category
+from .profiling import cache_fill
+
+CATEGORY_CACHE_TTL = 5 * 60
+
+# Every CategoryCache of the process, invalidated by the write hooks
+_all_category_caches = weakref.WeakSet()
+
+
+'''
+CategoryCache
+
+In-process cache of the categories table, which almost never changes, kept
+per app. The cached snapshot is dropped whenever a category is written
+through the model, and refreshed after `ttl` seconds at the latest so
+writes made by other workers show up too. Hits and misses are counted.
+The async handlers fill it through cached() and fill() with their own query.
+'''
+class CategoryCache(object):
+
+  def __init__(self, ttl=CATEGORY_CACHE_TTL):
+    self.ttl = ttl
+    self.hits = 0
+    self.misses = 0
+    self._snapshot = None
+    self._lock = threading.Lock()
+    _all_category_caches.add(self)
+
+  ''' The current (expires_at, types, formatted) snapshot, or None when it has to be loaded. Counts the hit or miss. '''
+  def cached(self):
+    snapshot = self._snapshot
+
+    if snapshot is not None and snapshot[0] >= time.time():
+      self.hits += 1
+      return snapshot
+
+    self.misses += 1
+    return None
+
+  ''' Stores the snapshot built from the (id, type) rows of all the categories, and returns it. '''
+  def fill(self, rows):
+    types = {}
+    for category_id, category_type in rows:
+      types[category_id] = category_type
+
+    formatted = sorted([{'id': category_id, 'type': category_type} for category_id, category_type in types.items()],
+                       key=lambda category: category['type'])
+    snapshot = (time.time() + self.ttl, types, formatted)
+
+    with self._lock:
+      self._snapshot = snapshot
+
+    return snapshot
+
+  def _load(self):
+    snapshot = self.cached()
+    if snapshot is None:
+      with cache_fill():
+        rows = db.session.query(Category.id, Category.type).order_by(Category.id).all()
+      snapshot = self.fill(rows)
+    return snapshot
+
+  ''' The {id: type} dict of all the categories. Must not be modified. '''
+  def types(self):
+    return self._load()[1]
+
+  ''' The formatted categories ordered by type. Must not be modified. '''
+  def formatted(self):
+    return self._load()[2]
+
+  ''' The type of the category with `category_id`, or None if there is none. '''
+  def get_type(self, category_id):
+    return self.types().get(category_id)
+
+  def invalidate(self):
+    with self._lock:
+      self._snapshot = None
+
+  def stats(self):
+    return {
+      'hits': self.hits,
+      'misses': self.misses
+    }
+
+
+'''
+init_category_cache(app)
+
+Attaches the CategoryCache of the app, refreshed every CATEGORY_CACHE_TTL
+seconds at the latest.
+'''
+def init_category_cache(app):
+  app.extensions['category_cache'] = CategoryCache(app.config.get('CATEGORY_CACHE_TTL', CATEGORY_CACHE_TTL))
+
+
+''' The CategoryCache of the current app. '''
+def current_category_cache():
+  return current_app.extensions['category_cache']
+
+
+@on_category_write
+def _invalidate_categories(action, category):
+  for category_cache in list(_all_category_caches):
+    category_cache.invalidate()
@@ -0,0 +1,86 @@
+import time
+
+from flask import current_app
+from sqlalchemy.exc import IntegrityError
+
+from models import db, CategoryQuestionCount
+from .cache import current_category_cache
+from .profiling import cache_fill
+
+TOTAL_QUESTIONS = CategoryQuestionCount.TOTAL_QUESTIONS
+QUESTION_COUNTS_TTL = 5 * 60
+
+
+'''
+QuestionCounts
+
+Reads the number of questions, in total or per category, from the
+category_question_counts table kept up to date by the question writes.
+Every read is a primary key lookup. The table is rebuilt from the questions
+table first when it has not been filled yet (no total row, e.g. a database
+created with db.create_all()), when a known category has no row (created
+without Category.insert(), e.g. with SQL), when the counts do not add up
+(a negative count, or more questions in the categories than in total), and
+at least every `ttl` seconds, so that questions written without the models
+are counted right again after a while.
+'''
+class QuestionCounts(object):
+
+  def __init__(self, ttl=QUESTION_COUNTS_TTL):
+    self.ttl = ttl
+    self._expires_at = 0
+
+  def _stale(self, rows):
+    return (self._expires_at < time.time() or TOTAL_QUESTIONS not in rows
+            or any(count < 0 for count in rows.values()))
+
+  def total(self):
+    return self.category(TOTAL_QUESTIONS)
+
+  def category(self, category_id):
+    rows = dict(db.session.query(CategoryQuestionCount.category_id, CategoryQuestionCount.count)
+      .filter(CategoryQuestionCount.category_id.in_([category_id, TOTAL_QUESTIONS])))
+
+    if self._stale(rows) or (category_id not in rows and current_category_cache().get_type(category_id) is not None) \
+        or rows.get(category_id, 0) > rows[TOTAL_QUESTIONS]:
+      rows = self.recount()
+    return rows.get(category_id, 0)
+
+  ''' The counts of all the categories, as {category_id: count}, without the total. '''
+  def categories(self):
+    rows = dict(db.session.query(CategoryQuestionCount.category_id, CategoryQuestionCount.count))
+
+    if self._stale(rows) or any(category_id not in rows for category_id in current_category_cache().types()):
+      rows = self.recount()
+    total = rows.pop(TOTAL_QUESTIONS)
+
+    if sum(rows.values()) > total:
+      rows = self.recount()
+      rows.pop(TOTAL_QUESTIONS)
+    return rows
+
+  def recount(self):
+    with cache_fill():
+      try:
+        rows = CategoryQuestionCount.recount()
+      except IntegrityError:
+        # Filled at the same time by another worker
+        db.session.rollback()
+        rows = dict(db.session.query(CategoryQuestionCount.category_id, CategoryQuestionCount.count))
+    self._expires_at = time.time() + self.ttl
+    return rows
+
+
+'''
+init_question_counts(app)
+
+Attaches the QuestionCounts of the app, reconciled with the questions table
+every QUESTION_COUNTS_TTL seconds at the latest.
+'''
+def init_question_counts(app):
+  app.extensions['question_counts'] = QuestionCounts(app.config.get('QUESTION_COUNTS_TTL', QUESTION_COUNTS_TTL))
+
+
+''' The QuestionCounts of the current app. '''
+def current_question_counts():
+  return current_app.extensions['question_counts']
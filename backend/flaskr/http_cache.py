@@ -0,0 +1,71 @@
+from datetime import datetime
+from functools import wraps
+
+from flask import current_app, request
+
+from .versions import current_versions
+
+HTTP_CACHE_MAX_AGE = 0
+
+
+''' Helper Method for the Cache-Control header, from HTTP_CACHE_MAX_AGE (seconds). '''
+def cache_control(response):
+  max_age = current_app.config.get('HTTP_CACHE_MAX_AGE', HTTP_CACHE_MAX_AGE)
+  response.cache_control.public = True
+  if max_age:
+    response.cache_control.max_age = max_age
+  else:
+    # Caches may store the response but have to revalidate it every time
+    response.cache_control.no_cache = True
+  return response
+
+
+'''
+Helper Methods for the validators of the `tables`: a weak ETag and a
+Last-Modified date from their versions, and whether a conditional request
+(If-None-Match, or If-Modified-Since) still matches them. If-None-Match: *
+matches any current representation, which only the view can tell exists,
+so it is left to the caller, see conditional().
+'''
+def validators(versions, tables):
+  etag = versions.tag(tables)
+  last_modified = datetime.utcfromtimestamp(int(max(versions.modified_at(table) for table in tables)))
+  return etag, last_modified
+
+def is_not_modified(etag, last_modified, if_none_match, if_modified_since):
+  if if_none_match:
+    return not if_none_match.star_tag and if_none_match.contains_weak(etag)
+  return if_modified_since is not None and last_modified <= if_modified_since.replace(tzinfo=None)
+
+
+'''
+conditional(*tables)
+
+Decorator for read endpoints whose response only depends on the request
+URL and on the content of `tables`. Responses get an ETag and a
+Last-Modified header derived from the table versions, and a conditional
+request whose validator is still current is answered with 304 Not Modified
+before the view runs, so it does not touch the database. If-None-Match: *
+is answered with 304 only once the view found the resource, so a missing
+one still gets its 404.
+'''
+def conditional(*tables):
+  def decorator(view):
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+      etag, last_modified = validators(current_versions(), tables)
+
+      if is_not_modified(etag, last_modified, request.if_none_match, request.if_modified_since):
+        response = current_app.response_class(status=304)
+      else:
+        response = current_app.make_response(view(*args, **kwargs))
+        if response.status_code != 200:
+          return response
+        if request.if_none_match.star_tag:
+          response = current_app.response_class(status=304)
+
+      response.set_etag(etag, weak=True)
+      response.last_modified = last_modified
+      return cache_control(response)
+    return wrapper
+  return decorator
@@ -0,0 +1,201 @@
+import threading
+import time
+
+from flask import g, request
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+SIZE_BUCKETS = (100, 1000, 10000, 100000, 1000000)
+
+'''
+The metrics served on /metrics, with their Prometheus type and help text.
+'''
+METRICS = {
+  'trivia_http_requests_total': ('counter', 'HTTP requests by endpoint, method and status.'),
+  'trivia_http_errors_total': ('counter', 'HTTP responses with an error status (4xx/5xx) by endpoint and status.'),
+  'trivia_http_request_duration_seconds': ('histogram', 'Time spent handling HTTP requests by endpoint.'),
+  'trivia_http_response_size_bytes': ('histogram', 'Size of the HTTP response bodies by endpoint.'),
+  'trivia_http_requests_in_flight': ('gauge', 'HTTP requests being handled.'),
+  'trivia_quiz_sessions_started_total': ('counter', 'Quiz sessions started.'),
+  'trivia_quiz_questions_served_total': ('counter', 'Quiz questions served, by mode.')
+}
+
+
+class ThreadMetrics(object):
+
+  def __init__(self):
+    self.counters = {}
+    self.histograms = {}
+    self.in_flight = 0
+
+  ''' Adds the values of `other` to these. '''
+  def merge(self, other):
+    self.in_flight += other.in_flight
+    for key, value in list(other.counters.items()):
+      self.counters[key] = self.counters.get(key, 0) + value
+    for key, (buckets, counts, total, count) in list(other.histograms.items()):
+      merged = self.histograms.setdefault(key, [buckets, [0] * len(buckets), 0.0, 0])
+      merged[1] = [a + b for a, b in zip(merged[1], counts)]
+      merged[2] += total
+      merged[3] += count
+
+
+'''
+Metrics
+
+Low-overhead metrics registry. Every thread records into its own
+ThreadMetrics, so recording never takes a lock; the per-thread values are
+only added up when /metrics is scraped. The values of the threads that
+have ended (e.g. with a thread per request) are folded into one retired
+ThreadMetrics whenever a new thread registers or /metrics is scraped, so
+the number of entries stays that of the live threads.
+'''
+class Metrics(object):
+
+  def __init__(self):
+    self._local = threading.local()
+    self._threads = []
+    self._retired = ThreadMetrics()
+    self._lock = threading.Lock()
+
+  def _mine(self):
+    metrics = getattr(self._local, 'metrics', None)
+    if metrics is None:
+      metrics = self._local.metrics = ThreadMetrics()
+      with self._lock:
+        self._retire_finished()
+        self._threads.append((threading.current_thread(), metrics))
+    return metrics
+
+  ''' Folds the metrics of the threads that have ended into the retired ones. Called with the lock held. '''
+  def _retire_finished(self):
+    alive = []
+    for thread, metrics in self._threads:
+      if thread.is_alive():
+        alive.append((thread, metrics))
+      else:
+        self._retired.merge(metrics)
+    self._threads = alive
+
+  def inc(self, name, labels=(), value=1):
+    counters = self._mine().counters
+    key = (name, labels)
+    counters[key] = counters.get(key, 0) + value
+
+  def observe(self, name, labels, value, buckets):
+    histograms = self._mine().histograms
+    key = (name, labels)
+    histogram = histograms.get(key)
+    if histogram is None:
+      histogram = histograms[key] = [buckets, [0] * len(buckets), 0.0, 0]
+
+    for i, bound in enumerate(buckets):
+      if value <= bound:
+        histogram[1][i] += 1
+        break
+    histogram[2] += value
+    histogram[3] += 1
+
+  def track_in_flight(self, delta):
+    self._mine().in_flight += delta
+
+  ''' Adds up the values of all the threads. '''
+  def collect(self):
+    total = ThreadMetrics()
+    with self._lock:
+      self._retire_finished()
+      total.merge(self._retired)
+      for _, metrics in self._threads:
+        total.merge(metrics)
+
+    return total.counters, total.histograms, total.in_flight
+
+  '''
+  render(extra)
+
+  The metrics in the Prometheus text exposition format. `extra` holds
+  {name: (type, help, value)} samples read at scrape time (caches, pool).
+  '''
+  def render(self, extra=None):
+    counters, histograms, in_flight = self.collect()
+    samples = dict((name, []) for name in METRICS)
+
+    for (name, labels), value in counters.items():
+      samples[name].append('{}{} {}'.format(name, format_labels(labels), value))
+
+    for (name, labels), (buckets, counts, total, count) in histograms.items():
+      cumulative = 0
+      for bound, bucket_count in zip(buckets, counts):
+        cumulative += bucket_count
+        samples[name].append('{}_bucket{} {}'.format(name, format_labels(labels + (('le', repr(float(bound))),)), cumulative))
+      samples[name].append('{}_bucket{} {}'.format(name, format_labels(labels + (('le', '+Inf'),)), count))
+      samples[name].append('{}_sum{} {}'.format(name, format_labels(labels), total))
+      samples[name].append('{}_count{} {}'.format(name, format_labels(labels), count))
+
+    samples['trivia_http_requests_in_flight'].append('trivia_http_requests_in_flight {}'.format(in_flight))
+
+    lines = []
+    for name, (kind, help) in METRICS.items():
+      lines.append('# HELP {} {}'.format(name, help))
+      lines.append('# TYPE {} {}'.format(name, kind))
+      lines.extend(sorted(samples[name]))
+
+    for name, (kind, help, value) in sorted((extra or {}).items()):
+      lines.append('# HELP {} {}'.format(name, help))
+      lines.append('# TYPE {} {}'.format(name, kind))
+      lines.append('{} {}'.format(name, value))
+
+    return '\n'.join(lines) + '\n'
+
+
+def format_labels(labels):
+  if not labels:
+    return ''
+  escaped = ('{}="{}"'.format(name, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')) for name, value in labels)
+  return '{' + ','.join(escaped) + '}'
+
+
+metrics = Metrics()
+
+
+'''
+track_requests(app)
+
+Records the latency, status, size and in-flight count of every request with
+before/after/teardown request hooks.
+'''
+def track_requests(app):
+
+  @app.before_request
+  def start_request_metrics():
+    g.metrics_started_at = time.perf_counter()
+    metrics.track_in_flight(1)
+
+  @app.after_request
+  def record_request_metrics(response):
+    started_at = g.pop('metrics_started_at', None)
+    if started_at is None:
+      return response
+
+    endpoint = request.endpoint or 'unmatched'
+    status = response.status_code
+
+    metrics.inc('trivia_http_requests_total', (('endpoint', endpoint), ('method', request.method), ('status', status)))
+    if status >= 400:
+      metrics.inc('trivia_http_errors_total', (('endpoint', endpoint), ('status', status)))
+
+    metrics.observe('trivia_http_request_duration_seconds', (('endpoint', endpoint),), time.perf_counter() - started_at, LATENCY_BUCKETS)
+    if response.content_length is not None:
+      metrics.observe('trivia_http_response_size_bytes', (('endpoint', endpoint),), response.content_length, SIZE_BUCKETS)
+
+    return response
+
+  @app.teardown_request
+  def finish_request_metrics(exception):
+    metrics.track_in_flight(-1)
+
+    # An unhandled exception is recorded by record_request_metrics() with the 500
+    # response, unless it propagated (debug and testing mode) before any response
+    if exception is not None and g.pop('metrics_started_at', None) is not None:
+      endpoint = request.endpoint or 'unmatched'
+      metrics.inc('trivia_http_requests_total', (('endpoint', endpoint), ('method', request.method), ('status', 500)))
+      metrics.inc('trivia_http_errors_total', (('endpoint', endpoint), ('status', 500)))
@@ -0,0 +1,139 @@
+import base64
+import binascii
+from collections import namedtuple
+
+from flask import abort
+
+from models import Question
+from .serialization import question_rows
+
+QUESTIONS_PER_PAGE = 10
+MAX_QUESTIONS_PER_PAGE = 100
+
+'''
+Page
+
+A single page of formatted questions together with the total number of
+rows matched by the query the page was cut from, and an opaque cursor for
+the page that follows it (None on the last page).
+'''
+Page = namedtuple('Page', ['questions', 'total', 'next_cursor'])
+
+
+''' Helper Methods for the opaque keyset cursors. '''
+
+def encode_cursor(question_id):
+  token = 'id:{}'.format(question_id).encode('utf-8')
+  return base64.urlsafe_b64encode(token).decode('ascii').rstrip('=')
+
+def decode_cursor(cursor):
+  try:
+    padded = cursor + '=' * (-len(cursor) % 4)
+    token = base64.urlsafe_b64decode(padded.encode('ascii')).decode('utf-8')
+    prefix, question_id = token.split(':', 1)
+    if prefix != 'id':
+      raise ValueError(token)
+    return int(question_id)
+  except (ValueError, UnicodeError, binascii.Error):
+    abort(400) # Bad Request
+
+
+'''
+PageWindow
+
+The rows a request asks for, read from its ?page=N or ?cursor= / ?after_id=
+and ?limit=N arguments by page_window(): either `limit` rows from `offset`
+(after_id None), or `limit` rows with an id above `after_id` (offset None).
+Shared by the Flask views and the async serving mode, which only run the
+queries, see cut_page().
+'''
+class PageWindow(namedtuple('PageWindow', ['offset', 'after_id', 'limit'])):
+
+  ''' Number of rows to fetch: one extra after a cursor, to know whether another page follows. '''
+  @property
+  def rows(self):
+    return self.limit + 1 if self.after_id is not None else self.limit
+
+EMPTY_PAGE = Page([], 0, None)
+
+
+''' The PageWindow of ?page=N, or None before the first page. '''
+def offset_window(args):
+  page = args.get('page', 1, type=int)
+  start = (page-1) * QUESTIONS_PER_PAGE
+
+  if start < 0:
+    return None
+  return PageWindow(start, None, QUESTIONS_PER_PAGE)
+
+''' The PageWindow of ?page=N, or of ?cursor= / ?after_id= with ?limit=N. Aborts with 400 on a bad cursor. '''
+def page_window(args):
+  cursor = args.get('cursor', None)
+  after_id = args.get('after_id', None)
+
+  if cursor is None and after_id is None:
+    return offset_window(args)
+
+  if cursor is not None:
+    after_id = decode_cursor(cursor)
+  else:
+    after_id = args.get('after_id', type=int)
+    if after_id is None:
+      abort(400) # Bad Request
+
+  limit = args.get('limit', QUESTIONS_PER_PAGE, type=int)
+  return PageWindow(None, after_id, max(1, min(limit, MAX_QUESTIONS_PER_PAGE)))
+
+''' The Page of the `questions` fetched for the `window` (window.rows of them at most), out of `total`. '''
+def cut_page(window, questions, total):
+  if window.after_id is not None:
+    more = len(questions) > window.limit
+    questions = questions[:window.limit]
+  else:
+    more = window.offset + len(questions) < total
+
+  next_cursor = None
+  if questions and more:
+    next_cursor = encode_cursor(questions[-1]['id'])
+
+  return Page(questions, total, next_cursor)
+
+
+'''
+paginate_questions(request, query, total)
+
+Helper Method for pagination. Takes a Question query ordered by Question.id
+and pushes the page window into SQL, so only the requested rows are loaded
+as column tuples. The total is `total` when the caller knows it (e.g. from
+the question counts), otherwise it is taken with a separate COUNT query with
+the ordering stripped, which the database can answer without sorting.
+
+Two modes are supported:
+    - ?page=N (default), which uses LIMIT/OFFSET
+    - ?cursor=<next_cursor> or ?after_id=<id>, optionally with ?limit=N,
+      which seeks on the questions.id primary key, so the cost of a page
+      does not grow with its depth
+'''
+def paginate_questions(request, query, total=None):
+  return paginate_window(page_window(request.args), query, total)
+
+
+''' LIMIT/OFFSET pagination (?page=N) of any ordered Question query. '''
+def paginate_by_offset(request, query, total=None):
+  return paginate_window(offset_window(request.args), query, total)
+
+
+def paginate_window(window, query, total=None):
+  if window is None:
+    return EMPTY_PAGE
+
+  if window.after_id is not None:
+    page_query = query.filter(Question.id > window.after_id).limit(window.rows)
+  else:
+    page_query = query.limit(window.rows).offset(window.offset)
+
+  questions = question_rows(page_query)
+  if total is None:
+    total = query.order_by(None).count()
+
+  return cut_page(window, questions, total)
@@ -0,0 +1,154 @@
+import logging
+import time
+from collections import deque
+from contextlib import contextmanager
+
+from flask import g, has_request_context, request
+from sqlalchemy import event
+
+from models import db
+
+SLOWEST_STATEMENTS = 5
+RECENT_PROFILES = 100
+
+logger = logging.getLogger(__name__)
+
+
+'''
+Query budgets: the most SQL statements each endpoint may issue per request.
+A request over budget is logged, or fails with QueryBudgetExceeded when
+QUERY_BUDGET_STRICT is set (e.g. in the test suite), which catches N+1
+query patterns. QUERY_BUDGETS in the app config overrides these.
+The statements filling a shared cache are left out, see cache_fill().
+'''
+DEFAULT_QUERY_BUDGETS = {
+  'retrive_categories': 2,
+  'retrive_questions': 2,
+  'get_questions_based_on_category': 2,
+  'create_question': 5,
+  'delete_question': 5,
+  'play_quiz': 3,
+  'check_quiz_answers': 1,
+  'start_quiz_session': 2,
+  'next_quiz_session_question': 2
+}
+
+
+class QueryBudgetExceeded(AssertionError):
+  pass
+
+
+'''
+RequestProfile
+
+The SQL statements of one request: how many, their total time, and the
+slowest of them.
+'''
+class RequestProfile(object):
+
+  def __init__(self):
+    self.count = 0
+    self.duration = 0.0
+    self.slowest = []
+    self.cache_fills = 0
+    self._filling = 0
+
+  def record(self, statement, duration):
+    self.count += 1
+    if self._filling:
+      self.cache_fills += 1
+    self.duration += duration
+    self.slowest.append((duration, statement))
+    self.slowest.sort(key=lambda entry: entry[0], reverse=True)
+    del self.slowest[SLOWEST_STATEMENTS:]
+
+  def format(self):
+    return {
+      'queries': self.count,
+      'cache_fill_queries': self.cache_fills,
+      'duration_ms': self.duration * 1000,
+      'slowest': [{'duration_ms': duration * 1000, 'statement': statement} for duration, statement in self.slowest]
+    }
+
+
+'''
+cache_fill()
+
+Context manager around the statements that fill a shared cache (the
+category cache, the question counts, the in-process indexes). They are
+timed and listed like the others, but left out of the query budget: they
+are paid once per cache lifetime, not by every request, and a cold cache
+must not fail a request under QUERY_BUDGET_STRICT.
+'''
+@contextmanager
+def cache_fill():
+  profile = g.get('query_profile') if has_request_context() else None
+  if profile is None:
+    yield
+    return
+
+  profile._filling += 1
+  try:
+    yield
+  finally:
+    profile._filling -= 1
+
+
+''' Engine event listeners timing every statement of the current request. '''
+
+def _before_cursor_execute(connection, cursor, statement, parameters, context, executemany):
+  # On the execution context of the statement, so a failed statement leaves nothing behind
+  context._query_start = time.perf_counter()
+
+def _after_cursor_execute(connection, cursor, statement, parameters, context, executemany):
+  if has_request_context() and 'query_profile' in g:
+    g.query_profile.record(statement, time.perf_counter() - context._query_start)
+
+
+'''
+QueryProfiler
+
+Per-request SQL instrumentation: counts and times the statements of every
+request, reports them in a Server-Timing header, keeps the profiles of the
+last RECENT_PROFILES requests for GET /debug/queries, and enforces the
+query budgets.
+'''
+class QueryProfiler(object):
+
+  def __init__(self, app):
+    self.app = app
+    self.recent = deque(maxlen=RECENT_PROFILES)
+    self.budgets = dict(DEFAULT_QUERY_BUDGETS)
+    self.budgets.update(app.config.get('QUERY_BUDGETS', {}))
+
+    app.before_request(self.before_request)
+    app.after_request(self.after_request)
+
+  def before_request(self):
+    engine = db.engine
+    if not event.contains(engine, 'before_cursor_execute', _before_cursor_execute):
+      event.listen(engine, 'before_cursor_execute', _before_cursor_execute)
+      event.listen(engine, 'after_cursor_execute', _after_cursor_execute)
+
+    g.query_profile = RequestProfile()
+
+  def after_request(self, response):
+    profile = g.pop('query_profile', None)
+    if profile is None:
+      return response
+
+    response.headers.add('Server-Timing', 'db;dur={:.2f};desc="{} queries"'.format(profile.duration * 1000, profile.count))
+
+    entry = profile.format()
+    entry.update({'endpoint': request.endpoint, 'method': request.method, 'path': request.full_path.rstrip('?')})
+    self.recent.append(entry)
+
+    budget = self.budgets.get(request.endpoint)
+    count = profile.count - profile.cache_fills
+    if budget is not None and count > budget:
+      message = '{} issued {} queries, over its budget of {}'.format(request.endpoint, count, budget)
+      if self.app.config.get('QUERY_BUDGET_STRICT', False):
+        raise QueryBudgetExceeded(message)
+      logger.warning(message)
+
+    return response
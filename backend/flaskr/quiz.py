@@ -0,0 +1,405 @@
+import random
+import re
+import threading
+import time
+import weakref
+
+from flask import current_app
+
+from models import db, on_question_write, Question, MAX_DIFFICULTY, MIN_DIFFICULTY
+from .counts import TOTAL_QUESTIONS, current_question_counts
+from .profiling import cache_fill
+from .serialization import QUESTION_FIELDS, question_rows
+
+# Index key of the "ALL" categories quiz (the frontend sends it as id 0, which
+# can also be the id of a real category, so it is never used as the key)
+ALL_CATEGORIES = None
+EMPTY_BUCKET = ([], frozenset())
+MAX_QUIZ_BATCH = 20
+MAX_CHECKED_ANSWERS = 100
+
+# Questions of a batch are sent without their answer, see select_random_questions()
+BATCH_QUESTION_FIELDS = ('id', 'question', 'category', 'difficulty')
+GUESS_PUNCTUATION = re.compile(r'[.,/#!$%^&*;:{}=\-_`~()]')
+QUESTION_ID_INDEX_TTL = 60
+MAX_RANDOM_PROBES = 8
+MAX_LOOKUPS = 3
+
+# Every QuestionIdIndex of the process, invalidated by the write hooks
+_all_question_ids = weakref.WeakSet()
+
+# Database reads of the quiz draws, see draw_question()
+QUESTION_ID_ROWS = 'question_id_rows'
+QUESTION_COUNT = 'question_count'
+QUESTION_ROWS = 'question_rows'
+
+
+'''
+QuestionIdIndex
+
+Keeps sorted arrays (and sets, for membership tests) of the question ids of
+every category, split into buckets by difficulty, so a random question can
+be picked without loading the category's rows. The bucket of all the
+difficulties is stored under None. An entry is rebuilt with a single
+(id, difficulty) query when it is missing, when a question of that category
+is written, or after `ttl` seconds, which bounds how long another worker's
+writes stay invisible. The async handlers fill it through cached() and
+fill() with their own queries.
+'''
+class QuestionIdIndex(object):
+
+  def __init__(self, ttl=QUESTION_ID_INDEX_TTL):
+    self.ttl = ttl
+    self._entries = {}
+    self._lock = threading.Lock()
+    _all_question_ids.add(self)
+
+  ''' The {difficulty: (ids, id set)} buckets of the category, or None when they have to be loaded. '''
+  def cached(self, category_id):
+    entry = self._entries.get(category_id)
+    if entry is None or entry[0] < time.time():
+      return None
+    return entry[1]
+
+  ''' Stores the buckets of the category built from its (id, difficulty) rows ordered by id, and returns them. '''
+  def fill(self, category_id, rows):
+    entry = (time.time() + self.ttl, build_buckets(rows))
+    with self._lock:
+      self._entries[category_id] = entry
+    return entry[1]
+
+  ''' The {difficulty: (ids, id set)} buckets of the category. '''
+  def buckets(self, category_id):
+    return run_draw(index_buckets(self, category_id))
+
+  ''' The ids of all the questions of the category, and their set. '''
+  def get(self, category_id):
+    return self.buckets(category_id)[None]
+
+  ''' Drops the entries of the given categories (and of ALL_CATEGORIES), or every entry. '''
+  def invalidate(self, *category_ids):
+    with self._lock:
+      if not category_ids:
+        self._entries.clear()
+      for category_id in category_ids:
+        self._entries.pop(category_id, None)
+        self._entries.pop(ALL_CATEGORIES, None)
+
+
+'''
+build_buckets(rows)
+
+Splits (id, difficulty) rows ordered by id into {difficulty: (ids, id set)},
+with every id also in the bucket None.
+'''
+def build_buckets(rows):
+  grouped = {None: []}
+  for question_id, difficulty in rows:
+    grouped[None].append(question_id)
+    grouped.setdefault(difficulty, []).append(question_id)
+
+  return dict((difficulty, (ids, frozenset(ids))) for difficulty, ids in grouped.items())
+
+
+'''
+init_question_ids(app)
+
+Attaches the QuestionIdIndex of the app, whose entries are rebuilt every
+QUESTION_ID_INDEX_TTL seconds.
+'''
+def init_question_ids(app):
+  app.extensions['question_ids'] = QuestionIdIndex(app.config.get('QUESTION_ID_INDEX_TTL', QUESTION_ID_INDEX_TTL))
+
+
+''' The QuestionIdIndex of the current app. '''
+def current_question_ids():
+  return current_app.extensions['question_ids']
+
+
+@on_question_write
+def _invalidate_question_ids(action, question):
+  for question_ids in list(_all_question_ids):
+    if action in ('update', 'bulk'):
+      # The category itself may have changed, or a bulk load touched many
+      question_ids.invalidate()
+    else:
+      question_ids.invalidate(question.category)
+
+
+'''
+pick_unseen_id(ids, seen)
+
+Draws a random id from `ids` that is not in `seen`. Draws are rejected while
+they hit `seen`, which takes only a few probes as long as most of the
+category is unplayed; only a nearly exhausted category falls back to
+filtering the array.
+'''
+def pick_unseen_id(ids, seen):
+  for _ in range(MAX_RANDOM_PROBES):
+    candidate = random.choice(ids)
+    if candidate not in seen:
+      return candidate
+
+  remaining = [question_id for question_id in ids if question_id not in seen]
+  return random.choice(remaining) if remaining else None
+
+
+'''
+Difficulty tiers
+
+A quiz can be restricted to some difficulties with a list of tiers, each a
+list of difficulties: questions are drawn from the first tier that still
+has unplayed questions, evenly across its difficulties. The body of
+POST /quizzes selects them with either
+
+    - "difficulty": N or {"min": N, "max": M}, a single tier with the range
+    - "adaptive": {"difficulty": N, "correct": true|false}, which steps one
+      level up after a correct answer and one down after a wrong one (or
+      starts at N when "correct" is missing), then falls back to the
+      nearest levels once that one is played out
+'''
+def difficulty_range(minimum, maximum):
+  difficulties = list(range(max(minimum, MIN_DIFFICULTY), min(maximum, MAX_DIFFICULTY) + 1))
+  if not difficulties:
+    # Inverted, or outside MIN_DIFFICULTY..MAX_DIFFICULTY: no question could ever match
+    raise ValueError('no difficulty between {} and {}'.format(minimum, maximum))
+  return [difficulties]
+
+def difficulty_steps(target):
+  tiers = [[target]]
+  for distance in range(1, MAX_DIFFICULTY - MIN_DIFFICULTY + 1):
+    tier = [level for level in (target - distance, target + distance) if MIN_DIFFICULTY <= level <= MAX_DIFFICULTY]
+    if tier:
+      tiers.append(tier)
+  return tiers
+
+def next_difficulty(current, correct):
+  step = 1 if correct else -1
+  return max(MIN_DIFFICULTY, min(current + step, MAX_DIFFICULTY))
+
+''' The difficulty tiers requested by a POST /quizzes body, or None. Raises ValueError/TypeError when invalid. '''
+def difficulty_tiers(body):
+  adaptive = body.get('adaptive', None)
+  if adaptive is not None:
+    current = int(adaptive.get('difficulty', (MIN_DIFFICULTY + MAX_DIFFICULTY) // 2))
+    correct = adaptive.get('correct', None)
+    if correct is not None:
+      if not isinstance(correct, bool):
+        # "false", 0 or [] would otherwise be taken for a correct answer or not by their truthiness
+        raise TypeError('correct must be true or false')
+      current = next_difficulty(current, correct)
+    return difficulty_steps(max(MIN_DIFFICULTY, min(current, MAX_DIFFICULTY)))
+
+  difficulty = body.get('difficulty', None)
+  if difficulty is None:
+    return None
+  if isinstance(difficulty, dict):
+    return difficulty_range(int(difficulty.get('min', MIN_DIFFICULTY)), int(difficulty.get('max', MAX_DIFFICULTY)))
+  return difficulty_range(int(difficulty), int(difficulty))
+
+
+'''
+pick_unseen_question_id(buckets, seen, tiers)
+
+Draws a random id that is not in `seen` from the difficulty buckets of a
+category, following the difficulty `tiers` (all the difficulties when None).
+Within a tier a bucket is chosen in proportion to its unplayed questions, so
+each of them is equally likely. Costs a few set operations per bucket,
+however the quiz is filtered.
+'''
+def pick_unseen_question_id(buckets, seen, tiers=None):
+  for tier in tiers or [[None]]:
+    candidates = []
+    for difficulty in tier:
+      ids, id_set = buckets.get(difficulty, EMPTY_BUCKET)
+      unplayed = len(ids) - len(seen & id_set)
+      if unplayed > 0:
+        candidates.append((unplayed, ids))
+
+    if candidates:
+      draw = random.randrange(sum(unplayed for unplayed, _ in candidates))
+      for unplayed, ids in candidates:
+        if draw < unplayed:
+          return pick_unseen_id(ids, seen)
+        draw -= unplayed
+
+  return None
+
+
+'''
+Quiz draws
+
+The draws are written once, as generators, and run against SQLAlchemy by
+run_draw() and against asyncpg by the async serving mode. A draw yields
+the database reads it needs, as tuples, and is sent their results:
+
+    - (QUESTION_ID_ROWS, category_id): the (id, difficulty) rows of the
+      category (ALL_CATEGORIES for every question), ordered by id
+    - (QUESTION_COUNT, category_id): its number of questions, from the
+      question counts
+    - (QUESTION_ROWS, ids, fields): the rows with these ids, as dicts of
+      the `fields`, in any order
+
+Its return value is the result of the draw.
+'''
+
+''' The buckets of the category from the index, read with QUESTION_ID_ROWS when missing. '''
+def index_buckets(index, category_id):
+  buckets = index.cached(category_id)
+  if buckets is None:
+    rows = yield (QUESTION_ID_ROWS, category_id)
+    buckets = index.fill(category_id, rows)
+  return buckets
+
+'''
+index_is_outdated(index, category_id)
+
+Exhaustion check against the question counts, which are always up to date:
+when the category holds more questions than the id index knows of (added
+by another worker within the index TTL), the entry is dropped so that the
+next lookup reloads it. Costs one primary key read, and is only needed once
+the index says the quiz is over.
+'''
+def index_is_outdated(index, category_id):
+  ids, _ = (yield from index_buckets(index, category_id))[None]
+  count = yield (QUESTION_COUNT, category_id)
+  if count is not None and count > len(ids):
+    index.invalidate(category_id)
+    return True
+  return False
+
+
+'''
+draw_question(index, category_id, previous_questions, tiers)
+
+Draws a random question of the category (ALL_CATEGORIES for every
+category) that is not one of `previous_questions`, optionally restricted to
+the difficulty `tiers`, and returns it formatted, or None once all of them
+have been played. The question is drawn from the whole category, and only
+the chosen row is loaded, by primary key.
+'''
+def draw_question(index, category_id, previous_questions, tiers=None):
+  seen = set(previous_questions)
+  checked_counts = False
+
+  for _ in range(MAX_LOOKUPS):
+    question_id = pick_unseen_question_id((yield from index_buckets(index, category_id)), seen, tiers)
+    if question_id is None:
+      if checked_counts or not (yield from index_is_outdated(index, category_id)):
+        return None
+      checked_counts = True
+      continue
+
+    rows = yield (QUESTION_ROWS, [question_id], QUESTION_FIELDS)
+    if rows:
+      return rows[0]
+
+    # Deleted by another worker since the index was built
+    seen.add(question_id)
+    index.invalidate(category_id)
+
+  return None
+
+
+'''
+run_draw(draw)
+
+Runs a quiz draw, see draw_question(), with the reads made through
+SQLAlchemy in the current app context.
+'''
+def run_draw(draw):
+  try:
+    read = next(draw)
+    while True:
+      read = draw.send(read_for_draw(*read))
+  except StopIteration as stop:
+    return stop.value
+
+def read_for_draw(kind, *arguments):
+  if kind == QUESTION_ID_ROWS:
+    category_id, = arguments
+    query = db.session.query(Question.id, Question.difficulty).order_by(Question.id)
+    if category_id != ALL_CATEGORIES:
+      query = query.filter(Question.category == category_id)
+    with cache_fill():
+      return query.all()
+
+  if kind == QUESTION_COUNT:
+    category_id, = arguments
+    return current_question_counts().category(TOTAL_QUESTIONS if category_id == ALL_CATEGORIES else category_id)
+
+  ids, fields = arguments
+  return question_rows(Question.query.filter(Question.id.in_(ids)), fields)
+
+
+''' Draws and loads one question from `index` (the app's QuestionIdIndex by default), see draw_question(). '''
+def select_random_question(category_id, previous_questions, index=None, tiers=None):
+  index = index if index is not None else current_question_ids()
+  return run_draw(draw_question(index, category_id, previous_questions, tiers))
+
+
+'''
+Quiz batches
+
+With "count": K in the body of POST /quizzes or of
+POST /quizzes/sessions/<session_id>/next, the next K unplayed questions are
+sent at once, without their answers. The guesses for the questions a
+session has sent are then checked in one POST /quizzes/answers request, so
+a whole session quiz takes three requests.
+'''
+def quiz_batch_size(body):
+  count = int(body['count'])
+  if not 1 <= count <= MAX_QUIZ_BATCH:
+    raise ValueError('count must be between 1 and {}'.format(MAX_QUIZ_BATCH))
+  return count
+
+''' Draws up to `count` distinct ids that are not in `seen`, see pick_unseen_question_id(). '''
+def pick_unseen_question_ids(buckets, seen, count, tiers=None):
+  seen = set(seen)
+  question_ids = []
+
+  while len(question_ids) < count:
+    question_id = pick_unseen_question_id(buckets, seen, tiers)
+    if question_id is None:
+      break
+    seen.add(question_id)
+    question_ids.append(question_id)
+
+  return question_ids
+
+
+'''
+draw_questions(index, category_id, previous_questions, count, tiers)
+
+Batch version of draw_question(): up to `count` random unplayed questions,
+drawn from the id index and loaded with a single primary key IN query, as
+dicts without the answer. Fewer are returned once the category runs out.
+'''
+def draw_questions(index, category_id, previous_questions, count, tiers=None):
+  ids = pick_unseen_question_ids((yield from index_buckets(index, category_id)), previous_questions, count, tiers)
+  if not ids and (yield from index_is_outdated(index, category_id)):
+    ids = pick_unseen_question_ids((yield from index_buckets(index, category_id)), previous_questions, count, tiers)
+  if not ids:
+    return []
+
+  rows = dict((row['id'], row) for row in (yield (QUESTION_ROWS, ids, BATCH_QUESTION_FIELDS)))
+  if len(rows) < len(ids):
+    # Some were deleted by another worker since the index was built
+    index.invalidate(category_id)
+
+  return [rows[question_id] for question_id in ids if question_id in rows]
+
+''' Draws and loads a batch of questions from `index` (the app's QuestionIdIndex by default), see draw_questions(). '''
+def select_random_questions(category_id, previous_questions, count, index=None, tiers=None):
+  index = index if index is not None else current_question_ids()
+  return run_draw(draw_questions(index, category_id, previous_questions, count, tiers))
+
+
+'''
+grade_answer(answer, guess)
+
+Same rule as the frontend's QuizView: the guess, without punctuation, has
+to be one of the words of the answer.
+'''
+def grade_answer(answer, guess):
+  return GUESS_PUNCTUATION.sub('', guess).lower() in answer.lower().split(' ')
@@ -0,0 +1,156 @@
+import math
+import threading
+import time
+
+from flask import abort, g, request
+
+from db_pool import pool_stats
+from .store import MemoryStore
+
+'''
+Rate limits of the endpoints that hit the database the hardest, as
+(requests per second, burst). RATE_LIMITS in the app config overrides them.
+'''
+DEFAULT_RATE_LIMITS = {
+  'create_question': (5, 30),   # includes search-as-you-type
+  'play_quiz': (5, 30),
+  'check_quiz_answers': (2, 10),
+  'start_quiz_session': (1, 10),
+  'next_quiz_session_question': (5, 30)
+}
+
+# Shed the rate-limited endpoints when connection checkouts wait longer than this (seconds)
+LOAD_SHED_POOL_WAIT = 0.5
+# Only as long as that wait was measured this recently (seconds), so that shedding
+# stops once no checkout has been seen to wait for a while
+LOAD_SHED_WINDOW = 5
+SHED_RETRY_AFTER = 1
+
+
+'''
+TokenBucket
+
+Token bucket per client in a Store: a client may make `burst` requests at
+once, then `rate` requests per second. Each bucket is one key holding its
+tokens and the time they were counted, which expires once the bucket would
+be full again.
+
+With the in-process MemoryStore a take() is atomic. With a shared store it
+is a read followed by a write, so concurrent requests of one client on
+different workers can occasionally spend the same token; the limit is then
+approximate, never much looser.
+'''
+class TokenBucket(object):
+
+  def __init__(self, store, rate, burst):
+    self.store = store
+    self.rate = float(rate)
+    self.burst = burst
+    self.ttl = int(math.ceil(burst / self.rate))
+    self._lock = threading.Lock()
+
+  '''
+  Takes a token from the bucket of `key`. Returns 0 when the request is
+  allowed, otherwise the number of seconds until a token is available.
+  '''
+  def take(self, key):
+    with self._lock:
+      now = time.time()
+      state = self.store.get(key)
+
+      if state is None:
+        tokens = self.burst
+      else:
+        tokens = min(self.burst, state[0] + (now - state[1]) * self.rate)
+
+      if tokens < 1:
+        return int(math.ceil((1 - tokens) / self.rate))
+
+      self.store.set(key, (tokens - 1, now), self.ttl)
+      return 0
+
+
+'''
+RateLimiter
+
+Token bucket rate limiting and load shedding for the endpoints in the rate
+limits, checked before the view runs:
+
+    - 429 Too Many Requests when the client (its quiz session, or its IP
+      address) has used up its bucket
+    - 503 Service Unavailable, before any query is made, when connection
+      checkouts have waited more than LOAD_SHED_POOL_WAIT seconds on average
+      in the last LOAD_SHED_WINDOW seconds, or when MAX_CONCURRENT_REQUESTS
+      of these requests are already running
+
+Both carry a Retry-After header. Configured with RATE_LIMIT_ENABLED,
+RATE_LIMITS, RATE_LIMIT_STORE (an in-process MemoryStore by default),
+LOAD_SHED_POOL_WAIT and MAX_CONCURRENT_REQUESTS. The limiter is kept in
+app.extensions['rate_limiter'] so the async serving mode applies the same
+limits with admit() and release().
+'''
+class RateLimiter(object):
+
+  def __init__(self, app):
+    self.enabled = app.config.get('RATE_LIMIT_ENABLED', True)
+    self.store = app.config.get('RATE_LIMIT_STORE') or MemoryStore()
+    self.pool_wait = app.config.get('LOAD_SHED_POOL_WAIT', LOAD_SHED_POOL_WAIT)
+    self.max_concurrent = app.config.get('MAX_CONCURRENT_REQUESTS', None)
+
+    limits = dict(DEFAULT_RATE_LIMITS)
+    limits.update(app.config.get('RATE_LIMITS', {}))
+    self.buckets = dict((endpoint, TokenBucket(self.store, rate, burst)) for endpoint, (rate, burst) in limits.items())
+
+    self.in_flight = 0
+    self._lock = threading.Lock()
+
+    app.extensions['rate_limiter'] = self
+    app.before_request(self.before_request)
+    app.teardown_request(self.teardown_request)
+
+  ''' Whether requests of the endpoint are limited. '''
+  def limits(self, endpoint):
+    return self.enabled and endpoint in self.buckets
+
+  '''
+  admit(endpoint, client)
+
+  Checks a request of a limited endpoint from `client` (its quiz session,
+  or its IP address). Returns None when it may run, in which case it counts
+  as in flight until release() is called, otherwise the (status,
+  retry_after) to answer with.
+  '''
+  def admit(self, endpoint, client):
+    if pool_stats.recent_wait > self.pool_wait and time.time() - pool_stats.recent_wait_at < LOAD_SHED_WINDOW:
+      return 503, SHED_RETRY_AFTER # Service Unavailable
+
+    retry_after = self.buckets[endpoint].take('ratelimit:{}:{}'.format(endpoint, client))
+    if retry_after:
+      return 429, retry_after # Too Many Requests
+
+    with self._lock:
+      if self.max_concurrent is not None and self.in_flight >= self.max_concurrent:
+        return 503, SHED_RETRY_AFTER # Service Unavailable
+      self.in_flight += 1
+    return None
+
+  def release(self):
+    with self._lock:
+      self.in_flight -= 1
+
+  def before_request(self):
+    if not self.limits(request.endpoint):
+      return
+
+    session_id = (request.view_args or {}).get('session_id')
+    client = 'session:{}'.format(session_id) if session_id else 'ip:{}'.format(request.remote_addr)
+
+    rejected = self.admit(request.endpoint, client)
+    if rejected is not None:
+      status, g.retry_after = rejected
+      abort(status)
+    g.rate_limited_request = True
+
+  def teardown_request(self, exception):
+    if g.pop('rate_limited_request', False):
+      self.release()
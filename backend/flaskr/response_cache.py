@@ -0,0 +1,96 @@
+from functools import wraps
+from urllib.parse import urlencode
+
+from flask import current_app, request
+
+from .store import MemoryStore
+from .versions import current_versions
+
+RESPONSE_CACHE_SIZE = 512
+RESPONSE_CACHE_TTL = 60
+
+
+'''
+ResponseCache
+
+Cache of the serialized JSON bodies of read endpoints. Entries are keyed by
+the endpoint, its arguments and the current versions of the tables the
+response is built from, so every Question.insert() / Question.delete()
+(through the write hooks bumping the versions) makes the cached pages of
+the old version unreachable, and the bounded store evicts them.
+
+The default store is an in-process MemoryStore limited to
+RESPONSE_CACHE_SIZE entries; a shared Store can be configured instead with
+RESPONSE_CACHE_STORE. Entries also expire after `ttl` seconds.
+'''
+class ResponseCache(object):
+
+  def __init__(self, store=None, ttl=RESPONSE_CACHE_TTL):
+    self.store = store if store is not None else MemoryStore(max_entries=RESPONSE_CACHE_SIZE)
+    self.ttl = ttl
+    self.hits = 0
+    self.misses = 0
+
+  def key(self, tables):
+    arguments = urlencode(sorted(request.args.items(multi=True)))
+    return 'response:{}:{}?{}:{}'.format(request.endpoint, request.path, arguments, current_versions().tag(tables))
+
+  def get(self, key):
+    body = self.store.get(key)
+    if body is None:
+      self.misses += 1
+    else:
+      self.hits += 1
+    return body
+
+  def set(self, key, body):
+    self.store.set(key, body, self.ttl)
+
+  def stats(self):
+    return {
+      'hits': self.hits,
+      'misses': self.misses
+    }
+
+
+'''
+init_response_cache(app)
+
+Attaches the ResponseCache of the app: in RESPONSE_CACHE_STORE when one is
+configured, in process otherwise, with entries kept for RESPONSE_CACHE_TTL
+seconds.
+'''
+def init_response_cache(app):
+  app.extensions['response_cache'] = ResponseCache(app.config.get('RESPONSE_CACHE_STORE'),
+                                                   ttl=app.config.get('RESPONSE_CACHE_TTL', RESPONSE_CACHE_TTL))
+
+
+''' The ResponseCache of the current app. '''
+def current_response_cache():
+  return current_app.extensions['response_cache']
+
+
+'''
+cached(*tables)
+
+Decorator for read endpoints whose response only depends on the request
+URL and on the content of `tables`. Successful responses are stored as
+bytes, and a hit is sent as is, skipping both the queries and jsonify.
+'''
+def cached(*tables):
+  def decorator(view):
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+      response_cache = current_response_cache()
+      key = response_cache.key(tables)
+      body = response_cache.get(key)
+
+      if body is not None:
+        return current_app.response_class(body, mimetype='application/json')
+
+      response = current_app.make_response(view(*args, **kwargs))
+      if response.status_code == 200:
+        response_cache.set(key, response.get_data())
+      return response
+    return wrapper
+  return decorator
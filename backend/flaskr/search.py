@@ -0,0 +1,290 @@
+import logging
+import threading
+import time
+import weakref
+
+from flask import current_app
+from sqlalchemy import func
+
+from models import db, on_question_write, Question
+from .pagination import EMPTY_PAGE, Page, offset_window, paginate_by_offset
+from .profiling import cache_fill
+from .serialization import question_rows
+
+SEARCH_INDEX_TTL = 5 * 60
+TRIGRAM_LENGTH = 3
+
+# Every TrigramIndex of the process, kept up to date by the write hooks
+_all_search_indexes = weakref.WeakSet()
+
+logger = logging.getLogger(__name__)
+
+
+''' Helper Method to split lowered text into its trigrams. '''
+def trigrams(text):
+  return set(text[i:i + TRIGRAM_LENGTH] for i in range(len(text) - TRIGRAM_LENGTH + 1))
+
+
+''' Helper Method to escape the LIKE wildcards of a search term. '''
+def escape_like(term):
+  return term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+'''
+TrigramIndex
+
+In-process inverted index from the trigrams of the question texts to the
+ids of the questions containing them. It answers case-insensitive
+substring searches of 3 characters or more the same way ILIKE '%term%'
+does for the databases that have no trigram index (SQLite test runs,
+Postgres without pg_trgm).
+
+Searches take no lock: the texts and the postings are published together as
+one (texts, postings) reference, and the postings are frozensets that the
+write hooks replace rather than change, so a search never sees one change
+while it reads it. Only the writes are serialized. The index is built on
+first use, kept up to date by the question write hooks, and built again on
+the next search after a bulk write. After `ttl` seconds a new index is
+built from the database in a background thread while the current one keeps
+answering, then swapped in, so writes made by other workers show up too.
+'''
+class TrigramIndex(object):
+
+  def __init__(self, ttl=SEARCH_INDEX_TTL):
+    self.ttl = ttl
+    self._index = None
+    self._expires_at = 0
+    # Writes made while a new index is built, replayed on it once swapped in
+    self._pending = None
+    self._rebuilding = False
+    self._lock = threading.Lock()
+    self._build_lock = threading.Lock()
+    _all_search_indexes.add(self)
+
+  def _add(self, question_id, text):
+    texts, postings = self._index
+    text = text.lower()
+    texts[question_id] = text
+    for trigram in trigrams(text):
+      postings[trigram] = postings.get(trigram, frozenset()) | {question_id}
+
+  def _remove(self, question_id):
+    texts, postings = self._index
+    text = texts.pop(question_id, None)
+    if text is None:
+      return
+    for trigram in trigrams(text):
+      ids = postings.get(trigram, frozenset()) - {question_id}
+      if ids:
+        postings[trigram] = ids
+      else:
+        postings.pop(trigram, None)
+
+  ''' Reads the texts of every question, and builds their (texts, postings). '''
+  def _load(self):
+    texts = {}
+    postings = {}
+    with cache_fill():
+      rows = db.session.query(Question.id, Question.question).all()
+    for question_id, text in rows:
+      text = texts[question_id] = text.lower()
+      for trigram in trigrams(text):
+        postings.setdefault(trigram, []).append(question_id)
+    return texts, dict((trigram, frozenset(ids)) for trigram, ids in postings.items())
+
+  ''' Swaps in a freshly loaded index, then replays the writes made while it was loaded. '''
+  def _swap(self, index):
+    with self._lock:
+      self._index = index
+      self._expires_at = time.time() + self.ttl
+
+      pending, self._pending = self._pending, None
+      if pending is None and self._rebuilding:
+        # A bulk write came in during the load, the new index may miss it
+        self._expires_at = 0
+      for question_id, text in pending or ():
+        self._remove(question_id)
+        if text is not None:
+          self._add(question_id, text)
+      self._rebuilding = False
+
+  def _rebuild(self, app):
+    with app.app_context():
+      try:
+        loaded = self._load()
+      except Exception:
+        logger.exception('Failed to rebuild the search index')
+        with self._lock:
+          self._rebuilding = False
+          self._pending = None
+        return
+    self._swap(loaded)
+
+  ''' Builds the index in the calling thread, unless another thread just did. '''
+  def build(self):
+    with self._build_lock:
+      if self._index is not None:
+        return
+      with self._lock:
+        self._rebuilding = True
+        self._pending = []
+      try:
+        loaded = self._load()
+      except Exception:
+        with self._lock:
+          self._rebuilding = False
+          self._pending = None
+        raise
+      self._swap(loaded)
+
+  def add(self, question_id, text):
+    with self._lock:
+      if self._index is not None:
+        self._remove(question_id)
+        self._add(question_id, text)
+      if self._pending is not None:
+        self._pending.append((question_id, text))
+
+  def remove(self, question_id):
+    with self._lock:
+      if self._index is not None:
+        self._remove(question_id)
+      if self._pending is not None:
+        self._pending.append((question_id, None))
+
+  def invalidate(self):
+    with self._lock:
+      self._index = None
+      self._pending = None
+
+  ''' Whether to start a rebuild. '''
+  def _should_rebuild(self):
+    with self._lock:
+      if self._rebuilding or self._expires_at >= time.time():
+        return False
+      self._rebuilding = True
+      self._pending = []
+      return True
+
+  '''
+  Returns the ids of the questions whose text contains `term`, best match
+  first: the larger the share of the text the term covers, the higher the
+  question ranks, ties broken by id. The term needs at least one trigram,
+  shorter terms are searched in the database, see search_questions().
+  '''
+  def search(self, term):
+    term_trigrams = trigrams(term.lower())
+    if not term_trigrams:
+      raise ValueError('search terms need at least {} characters'.format(TRIGRAM_LENGTH))
+
+    if self._index is None:
+      self.build()
+    elif self._should_rebuild():
+      threading.Thread(target=self._rebuild, args=(current_app._get_current_object(),), daemon=True).start()
+
+    term = term.lower()
+    texts, postings = self._index
+    candidates = sorted((postings.get(trigram, frozenset()) for trigram in term_trigrams), key=len)
+
+    matches = []
+    for question_id in candidates[0].intersection(*candidates[1:]):
+      # Removed since the postings were read
+      text = texts.get(question_id)
+      if text is not None and term in text:
+        matches.append((len(term) / len(text), question_id))
+
+    matches.sort(key=lambda match: (-match[0], match[1]))
+    return [question_id for _, question_id in matches]
+
+
+'''
+init_search_index(app)
+
+Attaches the TrigramIndex of the app, rebuilt every SEARCH_INDEX_TTL seconds.
+'''
+def init_search_index(app):
+  app.extensions['search_index'] = TrigramIndex(app.config.get('SEARCH_INDEX_TTL', SEARCH_INDEX_TTL))
+
+
+''' The TrigramIndex of the current app. '''
+def current_search_index():
+  return current_app.extensions['search_index']
+
+
+@on_question_write
+def _update_search_index(action, question):
+  for search_index in list(_all_search_indexes):
+    if action == 'bulk':
+      search_index.invalidate()
+    elif action == 'delete':
+      search_index.remove(question.id)
+    else:
+      search_index.add(question.id, question.question)
+
+
+# Whether the pg_trgm extension is installed, by database URL
+_pg_trgm_installed = {}
+
+'''
+Helper Method to tell whether the pg_trgm extension (word_similarity() and
+the trigram index) is installed. A database restored from trivia.psql
+without running the migrations lacks it. Checked once per database.
+'''
+def has_pg_trgm():
+  url = str(db.engine.url)
+  installed = _pg_trgm_installed.get(url)
+  if installed is None:
+    row = db.session.execute("SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'").first()
+    installed = _pg_trgm_installed[url] = row is not None
+  return installed
+
+
+'''
+Helper Method to pick the search backend from SEARCH_BACKEND, or else
+'postgresql' on a Postgres database with pg_trgm and 'memory' otherwise.
+'''
+def search_backend():
+  backend = current_app.config.get('SEARCH_BACKEND')
+  if backend is None:
+    backend = 'postgresql' if db.engine.dialect.name == 'postgresql' and has_pg_trgm() else 'memory'
+  return backend
+
+
+'''
+search_questions(request, term)
+
+Returns one Page of the questions whose text contains `term`
+(case-insensitive), ranked by how well they match.
+
+On Postgres with pg_trgm the ILIKE filter is served by the trigram GIN
+index on questions.question and the results are ranked by word_similarity()
+and paginated in the database. Elsewhere the in-process TrigramIndex finds and
+ranks the matching ids, and only the rows of the requested page are loaded.
+A term shorter than a trigram has nothing to look up in the index, so it is
+filtered, ranked (the shortest texts first, as the index does) and paginated
+by the database instead.
+'''
+def search_questions(request, term):
+  query = Question.query.filter(Question.question.ilike('%{}%'.format(escape_like(term)), escape='\\'))
+
+  if search_backend() == 'postgresql':
+    ranked = query.order_by(func.word_similarity(term, Question.question).desc(), Question.id)
+    return paginate_by_offset(request, ranked)
+
+  if len(term) < TRIGRAM_LENGTH:
+    return paginate_by_offset(request, query.order_by(func.length(Question.question), Question.id))
+
+  window = offset_window(request.args)
+  if window is None:
+    return EMPTY_PAGE
+
+  ids = current_search_index().search(term)
+  page_ids = ids[window.offset:window.offset + window.limit]
+
+  questions = []
+  if page_ids:
+    selection = question_rows(Question.query.filter(Question.id.in_(page_ids)))
+    by_id = dict((question['id'], question) for question in selection)
+    questions = [by_id[question_id] for question_id in page_ids if question_id in by_id]
+
+  return Page(questions, len(ids), None)
@@ -0,0 +1,44 @@
+import json
+
+from flask import current_app
+
+from models import Question
+
+try:
+  # Optional fast JSON encoder, used when it is installed
+  import orjson
+except ImportError:
+  orjson = None
+
+QUESTION_FIELDS = ('id', 'question', 'answer', 'category', 'difficulty')
+QUESTION_COLUMNS = tuple(getattr(Question, field) for field in QUESTION_FIELDS)
+
+
+'''
+question_rows(query, fields)
+
+Runs a Question query selecting only the columns of Question.format() (or
+the given `fields` of them) as plain tuples, which skips building ORM
+objects and the identity map, and returns them as the same dicts
+Question.format() would.
+'''
+def question_rows(query, fields=QUESTION_FIELDS):
+  columns = QUESTION_COLUMNS if fields is QUESTION_FIELDS else [getattr(Question, field) for field in fields]
+  return [dict(zip(fields, row)) for row in query.with_entities(*columns)]
+
+
+''' Helper Method to encode a payload to JSON bytes, with orjson when it is installed. '''
+def dumps(payload):
+  if orjson is not None:
+    return orjson.dumps(payload, option=orjson.OPT_NON_STR_KEYS)
+  return json.dumps(payload, separators=(',', ':')).encode('utf-8')
+
+
+'''
+json_response(payload, status)
+
+Drop-in replacement for jsonify() on the hot endpoints, encoding compact
+JSON with dumps().
+'''
+def json_response(payload, status=200):
+  return current_app.response_class(dumps(payload), status=status, mimetype='application/json')
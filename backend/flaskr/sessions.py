@@ -0,0 +1,131 @@
+import heapq
+import secrets
+
+from models import Question
+from .serialization import QUESTION_FIELDS, question_rows
+
+QUIZ_SESSION_TTL = 60 * 60
+# Sessions kept by the default in-process store, the least recently used are dropped first
+QUIZ_SESSION_MAX_ENTRIES = 100000
+
+MASK_64 = (1 << 64) - 1
+
+
+'''
+Helper Method giving the place of a question in the order of a session: a
+keyed 64-bit mix (splitmix64) of its id, distinct for every id, so sorting
+the ids of a category by it shuffles them the same way every time.
+'''
+def order_key(seed, question_id):
+  z = (question_id + seed + 0x9E3779B97F4A7C15) & MASK_64
+  z = ((z ^ (z >> 30)) * 0xBF58476D1CE4E5B9) & MASK_64
+  z = ((z ^ (z >> 27)) * 0x94D049BB133111EB) & MASK_64
+  return z ^ (z >> 31)
+
+
+'''
+QuizSessions
+
+Server-side quiz sessions. A session plays the questions of its category in
+a shuffled order without the client sending the list of previous questions.
+The order is not stored: it is the order of the keys order_key(seed, id)
+of the ids, regenerated from the QuestionIdIndex `index` of the app, so
+every session takes the same few bytes in the Store whatever the size of
+its category, and the questions it has sent are the ones whose key is at
+most the key of the last one:
+
+    - quiz:<session_id>   the category, the number of questions, the seed,
+                          the highest id when it started (questions added
+                          later are not part of it) and the key of the last
+                          question played
+
+Sessions expire `ttl` seconds after they were last used.
+'''
+class QuizSessions(object):
+
+  def __init__(self, store, index, ttl=QUIZ_SESSION_TTL):
+    self.store = store
+    self.ttl = ttl
+    self.index = index
+
+  def _key(self, session_id):
+    return 'quiz:{}'.format(session_id)
+
+  def start(self, category_id):
+    ids, _ = self.index.get(category_id)
+
+    session_id = secrets.token_urlsafe(16)
+    self.store.set(self._key(session_id), {
+      'category': category_id,
+      'total': len(ids),
+      'seed': secrets.randbits(64),
+      'max_id': ids[-1] if ids else 0,
+      'last': -1
+    }, self.ttl)
+
+    return session_id, len(ids)
+
+  def _get(self, session_id):
+    session = self.store.get(self._key(session_id))
+    if session is None:
+      raise KeyError(session_id)
+    return session
+
+  '''
+  Returns the next `count` questions of the session (fewer once it runs
+  out), as dicts of `fields`, loaded with one primary key IN query, and the
+  number of questions left after them. Raises KeyError if the session does
+  not exist or has expired.
+  '''
+  def next_questions(self, session_id, count, fields=QUESTION_FIELDS):
+    session = self._get(session_id)
+    ids, _ = self.index.get(session['category'])
+
+    # The unplayed questions of the session, the lowest key next
+    unplayed = []
+    for question_id in ids:
+      if question_id <= session['max_id']:
+        position = order_key(session['seed'], question_id)
+        if position > session['last']:
+          unplayed.append((position, question_id))
+    heapq.heapify(unplayed)
+
+    questions = []
+    while unplayed and len(questions) < count:
+      drawn = [heapq.heappop(unplayed) for _ in range(min(count - len(questions), len(unplayed)))]
+      session['last'] = drawn[-1][0]
+
+      # Skip questions deleted since the session started
+      query = Question.query.filter(Question.id.in_([question_id for _, question_id in drawn]))
+      rows = dict((row['id'], row) for row in question_rows(query, fields))
+      questions.extend(rows[question_id] for _, question_id in drawn if question_id in rows)
+
+    self.store.set(self._key(session_id), session, self.ttl)
+    return questions, len(unplayed)
+
+  '''
+  Returns the next question of the session, as Question.format() would, and
+  the number of questions left after it. The question is None once the
+  session is exhausted. Raises KeyError if the session does not exist or
+  has expired.
+  '''
+  def next_question(self, session_id):
+    questions, remaining = self.next_questions(session_id, 1)
+    return (questions[0] if questions else None), remaining
+
+  '''
+  Returns the ids among `question_ids` that the session has sent already,
+  which are the ones of its category whose key is at most the key of the
+  last question played. Raises KeyError if the session does not exist or
+  has expired.
+  '''
+  def served(self, session_id, question_ids):
+    session = self._get(session_id)
+    _, id_set = self.index.get(session['category'])
+
+    return set(question_id for question_id in question_ids
+               if question_id in id_set and question_id <= session['max_id']
+               and order_key(session['seed'], question_id) <= session['last'])
+
+  def end(self, session_id):
+    return self.store.delete(self._key(session_id))
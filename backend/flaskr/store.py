@@ -0,0 +1,147 @@
+import threading
+import time
+from collections import OrderedDict
+
+SWEEP_INTERVAL = 1000
+
+
+'''
+Store
+
+Interface of the key/value stores used for state that outlives a request
+(quiz sessions, ...). It mirrors the small subset of Redis commands the app
+needs, so a shared store used by several workers only has to map each
+method onto the matching command:
+
+    - get(key)                  GET
+    - set(key, value, ttl)      SET key value EX ttl
+    - delete(key)               DEL
+    - incr(key)                 INCR
+    - expire(key, ttl)          EXPIRE
+    - push(key, values, ttl)    RPUSH + EXPIRE
+    - pop(key)                  RPOP
+    - length(key)               LLEN
+
+A ttl of None means the key never expires.
+'''
+class Store(object):
+
+  def get(self, key):
+    raise NotImplementedError
+
+  def set(self, key, value, ttl=None):
+    raise NotImplementedError
+
+  def delete(self, key):
+    raise NotImplementedError
+
+  def incr(self, key):
+    raise NotImplementedError
+
+  def expire(self, key, ttl):
+    raise NotImplementedError
+
+  def push(self, key, values, ttl=None):
+    raise NotImplementedError
+
+  def pop(self, key):
+    raise NotImplementedError
+
+  def length(self, key):
+    raise NotImplementedError
+
+
+'''
+MemoryStore
+
+In-process Store. Expired keys are dropped when they are read, and the
+whole store is swept for expired keys every SWEEP_INTERVAL writes so keys
+that are never read again do not pile up. With `max_entries` the store is
+bounded, evicting the least recently used keys first.
+'''
+class MemoryStore(Store):
+
+  def __init__(self, max_entries=None):
+    self.max_entries = max_entries
+    self._data = OrderedDict()
+    self._lock = threading.Lock()
+    self._writes = 0
+
+  def _expires_at(self, ttl):
+    return None if ttl is None else time.time() + ttl
+
+  def _entry(self, key):
+    entry = self._data.get(key)
+    if entry is not None and entry[0] is not None and entry[0] < time.time():
+      del self._data[key]
+      return None
+    if entry is not None and self.max_entries is not None:
+      self._data.move_to_end(key)
+    return entry
+
+  def _written(self):
+    if self.max_entries is not None:
+      while len(self._data) > self.max_entries:
+        self._data.popitem(last=False)
+
+    self._writes += 1
+    if self._writes % SWEEP_INTERVAL == 0:
+      now = time.time()
+      expired = [key for key, entry in self._data.items() if entry[0] is not None and entry[0] < now]
+      for key in expired:
+        del self._data[key]
+
+  def get(self, key):
+    with self._lock:
+      entry = self._entry(key)
+      return None if entry is None else entry[1]
+
+  def set(self, key, value, ttl=None):
+    with self._lock:
+      self._data[key] = [self._expires_at(ttl), value]
+      self._data.move_to_end(key)
+      self._written()
+
+  def delete(self, key):
+    with self._lock:
+      return self._data.pop(key, None) is not None
+
+  def incr(self, key):
+    with self._lock:
+      entry = self._entry(key)
+      if entry is None:
+        entry = self._data[key] = [None, 0]
+        self._written()
+      entry[1] += 1
+      return entry[1]
+
+  def expire(self, key, ttl):
+    with self._lock:
+      entry = self._entry(key)
+      if entry is None:
+        return False
+      entry[0] = self._expires_at(ttl)
+      return True
+
+  def push(self, key, values, ttl=None):
+    with self._lock:
+      entry = self._entry(key)
+      if entry is None:
+        entry = self._data[key] = [self._expires_at(ttl), []]
+      elif ttl is not None:
+        entry[0] = self._expires_at(ttl)
+      entry[1].extend(values)
+      self._written()
+      return len(entry[1])
+
+  def pop(self, key):
+    with self._lock:
+      entry = self._entry(key)
+      if entry is None or not entry[1]:
+        return None
+      return entry[1].pop()
+
+  def length(self, key):
+    with self._lock:
+      entry = self._entry(key)
+      return 0 if entry is None else len(entry[1])
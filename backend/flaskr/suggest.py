@@ -0,0 +1,244 @@
+import bisect
+import heapq
+import logging
+import re
+import threading
+import time
+import weakref
+
+from flask import current_app
+
+from models import db, on_question_write, Question
+from .profiling import cache_fill
+
+SUGGEST_INDEX_TTL = 5 * 60
+SUGGESTIONS = 10
+MAX_SUGGESTIONS = 50
+# Prefix ranges longer than this are ranked once and their top words cached
+MAX_CANDIDATES = 2000
+
+TOKEN = re.compile(r'\w+', re.UNICODE)
+
+# Every PrefixIndex of the process, kept up to date by the write hooks
+_all_suggest_indexes = weakref.WeakSet()
+
+logger = logging.getLogger(__name__)
+
+
+''' Helper Method to split a question text into its distinct lowered words (of 2 characters or more). '''
+def tokenize(text):
+  return frozenset(token for token in TOKEN.findall(text.lower()) if len(token) > 1)
+
+
+'''
+PrefixIndex
+
+In-process autocomplete index over the words of the question texts: a
+sorted array of the distinct words, searched with bisect, and the number of
+questions using each word, used to rank the completions. A prefix matching
+more than MAX_CANDIDATES words is ranked over its whole range once, and its
+MAX_SUGGESTIONS most used words are kept until a write changes one of them.
+
+The index is built before the first request and kept up to date by the
+question write hooks (an insert or a delete only touches the words of that
+question). After `ttl` seconds, or a bulk write, a new index is built from
+the database in a background thread while the current one keeps answering,
+then swapped in, so writes made by other workers show up too.
+'''
+class PrefixIndex(object):
+
+  def __init__(self, ttl=SUGGEST_INDEX_TTL):
+    self.ttl = ttl
+    self._tokens = None
+    self._frequency = {}
+    self._question_tokens = {}
+    self._top = {}
+    self._expires_at = 0
+    # Writes made while a new index is built, replayed on it once swapped in
+    self._pending = None
+    self._rebuilding = False
+    self._lock = threading.Lock()
+    _all_suggest_indexes.add(self)
+
+  def _add(self, question_id, text):
+    tokens = tokenize(text)
+    self._question_tokens[question_id] = tokens
+    for token in tokens:
+      count = self._frequency.get(token, 0)
+      if count == 0:
+        bisect.insort(self._tokens, token)
+      self._frequency[token] = count + 1
+      self._forget_top(token)
+
+  def _remove(self, question_id):
+    for token in self._question_tokens.pop(question_id, ()):
+      count = self._frequency.pop(token) - 1
+      if count:
+        self._frequency[token] = count
+      else:
+        del self._tokens[bisect.bisect_left(self._tokens, token)]
+      self._forget_top(token)
+
+  def _forget_top(self, token):
+    if self._top:
+      for end in range(1, len(token) + 1):
+        self._top.pop(token[:end], None)
+
+  ''' Reads the words of every question, as (question_tokens, frequency). '''
+  def _load(self):
+    question_tokens = {}
+    frequency = {}
+    with cache_fill():
+      rows = db.session.query(Question.id, Question.question).all()
+    for question_id, text in rows:
+      tokens = question_tokens[question_id] = tokenize(text)
+      for token in tokens:
+        frequency[token] = frequency.get(token, 0) + 1
+    return question_tokens, frequency
+
+  ''' Swaps in a freshly loaded index, then replays the writes made while it was loaded. '''
+  def _swap(self, question_tokens, frequency):
+    with self._lock:
+      self._question_tokens = question_tokens
+      self._frequency = frequency
+      self._tokens = sorted(frequency)
+      self._top = {}
+      self._expires_at = time.time() + self.ttl
+
+      pending, self._pending = self._pending, None
+      if pending is None and self._rebuilding:
+        # A bulk write came in during the rebuild, the new index may miss it
+        self._expires_at = 0
+      for question_id, text in pending or ():
+        self._remove(question_id)
+        if text is not None:
+          self._add(question_id, text)
+      self._rebuilding = False
+
+  def _rebuild(self, app):
+    with app.app_context():
+      try:
+        loaded = self._load()
+      except Exception:
+        logger.exception('Failed to rebuild the autocomplete index')
+        with self._lock:
+          self._rebuilding = False
+          self._pending = None
+        return
+    self._swap(*loaded)
+
+  def build(self):
+    with self._lock:
+      self._rebuilding = True
+      self._pending = []
+    try:
+      loaded = self._load()
+    except Exception:
+      with self._lock:
+        self._rebuilding = False
+        self._pending = None
+      raise
+    self._swap(*loaded)
+
+  def add(self, question_id, text):
+    with self._lock:
+      if self._tokens is not None:
+        self._remove(question_id)
+        self._add(question_id, text)
+      if self._pending is not None:
+        self._pending.append((question_id, text))
+
+  def remove(self, question_id):
+    with self._lock:
+      if self._tokens is not None:
+        self._remove(question_id)
+      if self._pending is not None:
+        self._pending.append((question_id, None))
+
+  def invalidate(self):
+    with self._lock:
+      self._expires_at = 0
+      self._pending = None
+
+  ''' Whether to start a rebuild, called under the lock. '''
+  def _should_rebuild(self):
+    if self._rebuilding or self._expires_at >= time.time():
+      return False
+    self._rebuilding = True
+    self._pending = []
+    return True
+
+  ''' Ranks the words of the sorted range [start, end), called under the lock. '''
+  def _rank(self, start, end, limit):
+    frequency = self._frequency
+    return heapq.nsmallest(limit, self._tokens[start:end], key=lambda token: (-frequency[token], token))
+
+  '''
+  Returns up to `limit` words starting with `prefix`, the words used by the
+  most questions first, ties in alphabetical order.
+  '''
+  def complete(self, prefix, limit=SUGGESTIONS):
+    prefix = prefix.lower()
+
+    if self._tokens is None:
+      self.build()
+
+    with self._lock:
+      rebuild = self._should_rebuild()
+
+      start = bisect.bisect_left(self._tokens, prefix)
+      end = bisect.bisect_left(self._tokens, prefix + '\uffff', start)
+      if end - start <= MAX_CANDIDATES or limit > MAX_SUGGESTIONS:
+        completions = self._rank(start, end, limit)
+      else:
+        top = self._top.get(prefix)
+        if top is None:
+          top = self._top[prefix] = self._rank(start, end, MAX_SUGGESTIONS)
+        completions = top[:limit]
+
+    if rebuild:
+      threading.Thread(target=self._rebuild, args=(current_app._get_current_object(),), daemon=True).start()
+    return completions
+
+
+'''
+init_suggest_index(app)
+
+Attaches the PrefixIndex of the app, rebuilt every SUGGEST_INDEX_TTL seconds.
+'''
+def init_suggest_index(app):
+  app.extensions['suggest_index'] = PrefixIndex(app.config.get('SUGGEST_INDEX_TTL', SUGGEST_INDEX_TTL))
+
+
+''' The PrefixIndex of the current app. '''
+def current_suggest_index():
+  return current_app.extensions['suggest_index']
+
+
+@on_question_write
+def _update_suggest_index(action, question):
+  for suggest_index in list(_all_suggest_indexes):
+    if action == 'bulk':
+      suggest_index.invalidate()
+    elif action == 'delete':
+      suggest_index.remove(question.id)
+    else:
+      suggest_index.add(question.id, question.question)
+
+
+'''
+suggest_questions(query, limit)
+
+Autocomplete for the question search box: completes the last word of
+`query` from the PrefixIndex and returns the whole query with each
+completion, e.g. "who wro" -> ["who wrote", ...]. No database query is
+made once the index is built.
+'''
+def suggest_questions(query, limit=SUGGESTIONS):
+  words = query.lower().split()
+  if not words or query[-1:].isspace():
+    return []
+
+  head = ' '.join(words[:-1])
+  completions = current_suggest_index().complete(words[-1], limit)
+  return [(head + ' ' + completion) if head else completion for completion in completions]
@@ -0,0 +1,88 @@
+import secrets
+import time
+import weakref
+
+from flask import current_app
+
+from models import on_category_write, on_question_write
+from .store import MemoryStore
+
+VERSION_EPOCH_TTL = 60
+
+# Every TableVersions of the process, bumped by the write hooks
+_all_versions = weakref.WeakSet()
+
+
+'''
+TableVersions
+
+Version counter of each table, bumped by the write hooks on every insert,
+update and delete, together with the time of the last write. Anything
+derived from a table (ETags, cached responses) can be validated against
+its version without querying the database.
+
+The counters live in a Store, and a random epoch kept in the same store
+tells counters of a restarted store apart from the previous ones. With an
+in-process MemoryStore each worker only sees its own writes, so the epoch
+expires after `epoch_ttl` seconds: a new epoch changes every tag, which
+bounds how long a worker answers with the tag of data another worker has
+changed since. A shared store seen by all the workers needs no epoch_ttl.
+'''
+class TableVersions(object):
+
+  def __init__(self, store=None, epoch_ttl=None):
+    self.store = store if store is not None else MemoryStore()
+    self.epoch_ttl = epoch_ttl
+    _all_versions.add(self)
+
+  ''' The current epoch, as (token, started_at). '''
+  def epoch(self):
+    epoch = self.store.get('version:epoch')
+    if epoch is None:
+      epoch = (secrets.token_hex(4), time.time())
+      self.store.set('version:epoch', epoch, self.epoch_ttl)
+    return epoch
+
+  def get(self, table):
+    return self.store.get('version:{}'.format(table)) or 0
+
+  ''' Time of the last write of the table, or the start of the epoch if later. '''
+  def modified_at(self, table):
+    return max(self.store.get('version:{}:modified'.format(table)) or 0, self.epoch()[1])
+
+  def bump(self, table):
+    self.store.set('version:{}:modified'.format(table), time.time())
+    return self.store.incr('version:{}'.format(table))
+
+  ''' A tag naming the current version of all the `tables`, e.g. "a1b2c3d4-categories.2-questions.17". '''
+  def tag(self, tables):
+    return '-'.join([self.epoch()[0]] + ['{}.{}'.format(table, self.get(table)) for table in tables])
+
+
+'''
+init_table_versions(app)
+
+Attaches the TableVersions of the app. They are kept in VERSION_STORE when
+one is configured, so that all the workers agree on them, and in process
+otherwise, with an epoch renewed every VERSION_EPOCH_TTL seconds.
+'''
+def init_table_versions(app):
+  store = app.config.get('VERSION_STORE')
+  epoch_ttl = app.config.get('VERSION_EPOCH_TTL', None if store is not None else VERSION_EPOCH_TTL)
+  app.extensions['table_versions'] = TableVersions(store, epoch_ttl)
+
+
+''' The TableVersions of the current app. '''
+def current_versions():
+  return current_app.extensions['table_versions']
+
+
+@on_question_write
+def _bump_questions_version(action, question):
+  for versions in list(_all_versions):
+    versions.bump('questions')
+
+@on_category_write
+def _bump_categories_version(action, category):
+  for versions in list(_all_versions):
+    versions.bump('categories')
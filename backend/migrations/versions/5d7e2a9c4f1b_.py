@@ -0,0 +1,33 @@
+"""trigram index for question search
+
+Revision ID: 5d7e2a9c4f1b
+Revises: 93373cbd6f1f
+Create Date: 2026-10-18 09:12:40.118342
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5d7e2a9c4f1b'
+down_revision = '93373cbd6f1f'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # pg_trgm is Postgres only; other databases use the in-process search index
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+
+    op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    op.create_index('ix_questions_question_trgm', 'questions', ['question'], unique=False,
+                    postgresql_using='gin', postgresql_ops={'question': 'gin_trgm_ops'})
+
+
+def downgrade():
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+
+    op.drop_index('ix_questions_question_trgm', table_name='questions')
@@ -0,0 +1,35 @@
+"""per-category question counts
+
+Revision ID: 8c3f1e6a2b7d
+Revises: 5d7e2a9c4f1b
+Create Date: 2026-10-18 11:02:51.530127
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8c3f1e6a2b7d'
+down_revision = '5d7e2a9c4f1b'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('category_question_counts',
+    sa.Column('category_id', sa.Integer(), autoincrement=False, nullable=False),
+    sa.Column('count', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('category_id')
+    )
+
+    # Fill the counts from the existing questions; category -1 holds the total
+    op.execute('INSERT INTO category_question_counts (category_id, count) '
+               'SELECT categories.id, count(questions.id) FROM categories '
+               'LEFT JOIN questions ON questions.category = categories.id GROUP BY categories.id')
+    op.execute('INSERT INTO category_question_counts (category_id, count) '
+               'SELECT -1, count(*) FROM questions')
+
+
+def downgrade():
+    op.drop_table('category_question_counts')
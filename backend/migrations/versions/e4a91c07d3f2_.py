@@ -0,0 +1,24 @@
+"""index for category listings and quiz draws
+
+Revision ID: e4a91c07d3f2
+Revises: 8c3f1e6a2b7d
+Create Date: 2026-10-18 12:20:07.441905
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e4a91c07d3f2'
+down_revision = '8c3f1e6a2b7d'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_questions_category_id', 'questions', ['category', 'id'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_questions_category_id', table_name='questions')
@@ -1,9 +1,10 @@
 import os
-from sqlalchemy import Column, String, Integer, create_engine
+from sqlalchemy import Column, String, Integer, create_engine, case, func
 from flask_sqlalchemy import SQLAlchemy
 from flask_migrate import Migrate
 import json
 
+from db_pool import engine_options
 """ keystore consists of all the passwords required for the backend """
 from keystore import database_password
 
@@ -17,21 +18,64 @@ db = SQLAlchemy()
 '''
 setup_db(app)
     binds a flask application and a SQLAlchemy service
+    the connection pool is configured from the DB_POOL_* settings, see db_pool
 '''
 def setup_db(app, database_path=database_path):
     app.config["SQLALCHEMY_DATABASE_URI"] = database_path
     app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = engine_options(app, database_path)
     db.app = app
     db.init_app(app)
     migrate = Migrate(app, db)
+
+    # Imported here as the bulk module is built on top of these models
+    from bulk import questions_cli
+    app.cli.add_command(questions_cli)
     #db.create_all()
 
+'''
+Write hooks
+
+Callbacks registered with on_question_write(hook) are called as
+hook(action, question) after a question insert, update or delete has been
+committed, so the in-process indexes built on top of the questions table
+can update or invalidate themselves. After a bulk load the action is 'bulk'
+and the question is None. on_category_write(hook) does the same for
+categories.
+'''
+question_write_hooks = []
+category_write_hooks = []
+
+def on_question_write(hook):
+    question_write_hooks.append(hook)
+    return hook
+
+def notify_question_write(action, question):
+    for hook in question_write_hooks:
+        hook(action, question)
+
+def on_category_write(hook):
+    category_write_hooks.append(hook)
+    return hook
+
+def notify_category_write(action, category):
+    for hook in category_write_hooks:
+        hook(action, category)
+
+# Range of Question.difficulty
+MIN_DIFFICULTY = 1
+MAX_DIFFICULTY = 5
+
 '''
 Question
 
 '''
 class Question(db.Model):  
   __tablename__ = 'questions'
+  __table_args__ = (
+    # Category listings and the quiz id index filter on the category and order by id
+    db.Index('ix_questions_category_id', 'category', 'id'),
+  )
 
   id = Column(Integer, primary_key=True)
   question = Column(db.String, nullable=False)
@@ -47,14 +91,23 @@ class Question(db.Model):
 
   def insert(self):
     db.session.add(self)
+    CategoryQuestionCount.adjust({self.category: 1})
     db.session.commit()
+    notify_question_write('insert', self)
   
   def update(self):
+    # Move the question between the category counts if its category changed
+    added, _, deleted = db.inspect(self).attrs.category.history
+    if added and deleted:
+      CategoryQuestionCount.adjust({added[0]: 1, deleted[0]: -1})
     db.session.commit()
+    notify_question_write('update', self)
 
   def delete(self):
     db.session.delete(self)
+    CategoryQuestionCount.adjust({self.category: -1})
     db.session.commit()
+    notify_question_write('delete', self)
 
   def format(self):
     return {
@@ -75,13 +128,96 @@ class Category(db.Model):
   id = Column(Integer, primary_key=True)
   type = Column(String)
 
-  questions = db.relationship('Question', backref=db.backref('questions', lazy=True))
+  # A query, so callers filter, count and limit the questions of a category in SQL,
+  # e.g. category.questions.filter(Question.difficulty == 1).count(). Deleting a
+  # category leaves the questions to the ON DELETE SET NULL of the foreign key
+  # instead of loading them all.
+  questions = db.relationship('Question', lazy='dynamic', passive_deletes=True,
+                              backref=db.backref('questions', lazy=True))
 
   def __init__(self, type):
     self.type = type
 
+  def insert(self):
+    db.session.add(self)
+    db.session.flush()
+    db.session.add(CategoryQuestionCount(self.id))
+    db.session.commit()
+    notify_category_write('insert', self)
+
+  def update(self):
+    db.session.commit()
+    notify_category_write('update', self)
+
+  def delete(self):
+    db.session.delete(self)
+    CategoryQuestionCount.query.filter(CategoryQuestionCount.category_id == self.id).delete(synchronize_session=False)
+    db.session.commit()
+    notify_category_write('delete', self)
+
   def format(self):
     return {
       'id': self.id,
       'type': self.type
-    }
\ No newline at end of file
+    }
+
+'''
+CategoryQuestionCount
+
+Number of questions of every category, with the total number of questions
+in the row of category TOTAL_QUESTIONS (-1, since a category 0 may exist). The counts are moved by Question.insert() / delete() / update()
+and the bulk import in the transaction of the write itself, so reading a
+total is a primary key lookup instead of a COUNT over the questions table.
+'''
+class CategoryQuestionCount(db.Model):
+  __tablename__ = 'category_question_counts'
+
+  TOTAL_QUESTIONS = -1
+
+  category_id = Column(Integer, primary_key=True, autoincrement=False)
+  count = Column(Integer, nullable=False, default=0)
+
+  def __init__(self, category_id, count=0):
+    self.category_id = category_id
+    self.count = count
+
+  '''
+  adjust(deltas)
+
+  Adds the {category_id: delta} changes, and their sum to the total, with a
+  single UPDATE in the current transaction. Questions without a category
+  only count in the total. A category without a row (created without
+  Category.insert()) is skipped. Like the writes made without the models,
+  it is made right by the next recount, see flaskr.counts.
+  '''
+  @classmethod
+  def adjust(cls, deltas):
+    changes = dict((category_id, delta) for category_id, delta in deltas.items() if category_id is not None and delta)
+    total = sum(deltas.values())
+    if total:
+      changes[cls.TOTAL_QUESTIONS] = total
+    if not changes:
+      return
+
+    table = cls.__table__
+    db.session.execute(table.update()
+      .where(table.c.category_id.in_(list(changes)))
+      .values(count=table.c.count + case(changes, value=table.c.category_id, else_=0)))
+
+  '''
+  recount()
+
+  Rebuilds all the counts from the questions table, e.g. for a new database
+  or after questions were written without the models. Returns them as
+  {category_id: count}.
+  '''
+  @classmethod
+  def recount(cls):
+    per_category = dict(db.session.query(Question.category, func.count(Question.id)).group_by(Question.category))
+    counts = dict((category_id, per_category.get(category_id, 0)) for category_id, in db.session.query(Category.id))
+    counts[cls.TOTAL_QUESTIONS] = sum(per_category.values())
+
+    cls.query.delete(synchronize_session=False)
+    db.session.bulk_insert_mappings(cls, [{'category_id': category_id, 'count': count} for category_id, count in counts.items()])
+    db.session.commit()
+    return counts
@@ -0,0 +1,170 @@
+import asyncio
+import json
+import unittest
+
+from flaskr import asgi
+from flaskr.asgi import create_asgi_app
+from models import setup_db
+
+""" keystore consists of all the passwords required for the backend """
+from keystore import database_password
+
+QUIZ_BODY = {'previous_questions': [], 'quiz_category': {'type': 'Science', 'id': 1}}
+
+'''
+The requests answered by the async handlers, as (method, path, query
+string) and (body, content type) of POST /quizzes, plus a few that only look
+like them and must be left to Flask. Each is sent to both apps and their
+responses compared.
+'''
+LISTING_REQUESTS = [
+    ('GET', '/questions', ''),
+    ('GET', '/questions', 'page=2'),
+    ('GET', '/questions', 'page=abc'),
+    ('GET', '/questions', 'page=-1'),
+    ('GET', '/questions', 'page=1000'),
+    ('GET', '/questions', 'after_id=5&limit=3'),
+    ('GET', '/questions', 'after_id=5&limit=abc'),
+    ('GET', '/questions', 'after_id=abc'),
+    ('GET', '/questions', 'cursor=invalid'),
+    ('GET', '/questions', 'cursor='),
+    ('GET', '/questions/', ''),
+    ('GET', '/categories/1/questions', ''),
+    ('GET', '/categories/1/questions', 'page=abc'),
+    ('GET', '/categories/1/questions', 'page=-1'),
+    ('GET', '/categories/1005341/questions', ''),
+    ('GET', '/categories/1/questions/', ''),
+]
+
+QUIZ_REQUESTS = [
+    (json.dumps(QUIZ_BODY), 'application/json'),
+    (json.dumps(dict(QUIZ_BODY, count=3)), 'application/json'),
+    (json.dumps(dict(QUIZ_BODY, difficulty={'min': 1, 'max': 2})), 'application/json'),
+    (json.dumps(QUIZ_BODY), 'text/plain'),
+    ('{not json', 'application/json'),
+    ('null', 'application/json'),
+    (json.dumps({'previous_questions': [], 'quiz_category': {'type': 'Unknown', 'id': 1005341}}), 'application/json'),
+]
+
+HEADERS = ('etag', 'last-modified', 'cache-control', 'server-timing')
+
+
+''' Sends one request to an ASGI app, returns its status, headers and body. '''
+async def asgi_request(app, method, path, query='', body='', headers=()):
+    messages = [{'type': 'http.request', 'body': body.encode('utf-8'), 'more_body': False}]
+    sent = []
+
+    async def receive():
+        return messages.pop(0) if messages else {'type': 'http.disconnect'}
+
+    async def send(message):
+        sent.append(message)
+
+    await app({
+        'type': 'http', 'http_version': '1.1', 'method': method, 'scheme': 'http',
+        'path': path, 'raw_path': path.encode('utf-8'), 'root_path': '', 'query_string': query.encode('utf-8'),
+        'headers': [(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in headers],
+        'server': ('localhost', 80), 'client': ('127.0.0.1', 0)
+    }, receive, send)
+
+    headers = dict((name.decode('latin-1'), value.decode('latin-1')) for name, value in sent[0]['headers'])
+    return sent[0]['status'], headers, b''.join(message.get('body', b'') for message in sent[1:])
+
+
+@unittest.skipIf(asgi.asyncpg is None or asgi.WsgiToAsgi is None, 'the async serving mode needs asyncpg and asgiref')
+class AsgiParityTestCase(unittest.TestCase):
+    """Checks that the async handlers answer like the Flask views they replace"""
+
+    @classmethod
+    def setUpClass(cls):
+        database_path = "postgresql://{}:{}@{}/{}".format("postgres", database_password, 'localhost:5432', "trivia_test")
+
+        cls.app = create_asgi_app({'RATE_LIMIT_ENABLED': False})
+        setup_db(cls.app.flask_app, database_path)
+
+        cls.loop = asyncio.new_event_loop()
+        cls.loop.run_until_complete(cls.app.startup())
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.loop.run_until_complete(cls.app.shutdown())
+        cls.loop.close()
+
+    def setUp(self):
+        self.client = self.app.flask_app.test_client
+
+    def request(self, method, path, query='', body='', headers=()):
+        return self.loop.run_until_complete(asgi_request(self.app, method, path, query, body, headers))
+
+    def assertSameHeaders(self, headers, res):
+        for name in HEADERS:
+            self.assertEqual(name in headers, name in res.headers, name)
+        self.assertEqual(headers.get('etag'), res.headers.get('ETag'))
+
+    ## TEST 1 ##
+    # Success Test
+    def test_listings_match_flask(self):
+        for method, path, query in LISTING_REQUESTS:
+            with self.subTest(path=path, query=query):
+                status, headers, body = self.request(method, path, query)
+                res = self.client().open(path, method=method, query_string=query)
+
+                self.assertEqual(status, res.status_code)
+                self.assertEqual(json.loads(body), json.loads(res.data))
+                self.assertSameHeaders(headers, res)
+
+    ## TEST 2 ##
+    # Success Test
+    def test_quizzes_match_flask(self):
+        for body, content_type in QUIZ_REQUESTS:
+            with self.subTest(body=body, content_type=content_type):
+                status, headers, data = self.request('POST', '/quizzes', body=body, headers=[('Content-Type', content_type)])
+                res = self.client().post('/quizzes', data=body, content_type=content_type)
+
+                self.assertEqual(status, res.status_code)
+                # The questions are random, the shape of the response is not
+                self.assertEqual(sorted(json.loads(data)), sorted(json.loads(res.data)))
+
+    ## TEST 3 ##
+    # Success Test
+    def test_304_if_questions_not_modified(self):
+        status, headers, body = self.request('GET', '/questions')
+        res = self.client().get('/questions', headers={'If-None-Match': headers['etag']})
+
+        self.assertEqual(res.status_code, 304)
+        status, headers, body = self.request('GET', '/questions', headers=[('If-None-Match', headers['etag'])])
+        self.assertEqual(status, 304)
+        self.assertEqual(body, b'')
+        self.assertSameHeaders(headers, res)
+
+    ## TEST 4 ##
+    # Error Test
+    def test_quizzes_rate_limited_and_shed(self):
+        for config, status in (({'RATE_LIMITS': {'play_quiz': (1, 0)}}, 429), ({'MAX_CONCURRENT_REQUESTS': 0}, 503)):
+            with self.subTest(config=config):
+                # Rejected before any query, so the app needs no connection pool
+                app = create_asgi_app(config)
+                res = self.loop.run_until_complete(asgi_request(app, 'POST', '/quizzes', body=json.dumps(QUIZ_BODY),
+                                                                headers=[('Content-Type', 'application/json')]))
+
+                self.assertEqual(res[0], status)
+                self.assertIn('retry-after', res[1])
+                self.assertEqual(json.loads(res[2])['success'], False)
+
+
+    ## TEST 5 ##
+    # Error Test
+    def test_if_none_match_star_matches_flask(self):
+        # Only a category that exists is "not modified"
+        for path in ('/categories/1/questions', '/categories/1000/questions'):
+            with self.subTest(path=path):
+                status, headers, body = self.request('GET', path, headers=[('If-None-Match', '*')])
+                res = self.client().get(path, headers={'If-None-Match': '*'})
+
+                self.assertEqual(status, res.status_code)
+                self.assertEqual(body and json.loads(body), res.data and json.loads(res.data))
+                self.assertSameHeaders(headers, res)
+
+# Make the tests conveniently executable
+if __name__ == "__main__":
+    unittest.main()
@@ -1,10 +1,13 @@
 import os
+import time
 import unittest
 import json
 from flask_sqlalchemy import SQLAlchemy
 
 from flaskr import create_app
-from models import setup_db, Question, Category
+from flaskr.profiling import QueryBudgetExceeded
+from flaskr import suggest
+from models import setup_db, db, Question, Category
 
 """ keystore consists of all the passwords required for the backend """
 from keystore import database_password
@@ -14,6 +17,8 @@ ERROR_400_MESSAGE = "Bad request"
 ERROR_404_MESSAGE = "Resource not found"
 ERROR_405_MESSAGE = "Method not found"
 ERROR_422_MESSAGE = "Uprocessable"
+ERROR_429_MESSAGE = "Too many requests"
+ERROR_503_MESSAGE = "Service unavailable"
 
 class TriviaTestCase(unittest.TestCase):
     """This class represents the trivia test case"""
@@ -248,6 +253,945 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(data['message'], ERROR_404_MESSAGE)
 
 
+    """ Test for the pagination of the endpoint
+    GET '/questions'
+    """
+    ## TEST 12 ##
+    # Success Test
+    def test_get_second_page_of_questions(self):
+        first = json.loads(self.client().get('/questions?page=1').data)
+        res = self.client().get('/questions?page=2')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertEqual(data['total_questions'], first['total_questions'])
+        self.assertTrue(len(data['questions']) <= 10)
+        self.assertTrue(data['questions'][0]['id'] > first['questions'][-1]['id'])
+
+
+    """ Test for the keyset pagination of the endpoint
+    GET '/questions?cursor=<next_cursor>'
+    """
+    ## TEST 13 ##
+    # Success Test
+    def test_get_questions_after_cursor(self):
+        first = json.loads(self.client().get('/questions?limit=5&after_id=0').data)
+        res = self.client().get('/questions?limit=5&cursor={}'.format(first['next_cursor']))
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertEqual(len(first['questions']), 5)
+        self.assertTrue(len(data['questions']))
+        self.assertTrue(data['questions'][0]['id'] > first['questions'][-1]['id'])
+
+    ## TEST 14 ##
+    # Error Test
+    def test_400_if_cursor_is_invalid(self):
+        res = self.client().get('/questions?cursor=not-a-cursor')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(data['success'], False)
+        self.assertEqual(data['message'], ERROR_400_MESSAGE)
+
+    """ Test for the endpoint
+    POST '/quizzes'
+    """
+    ## TEST 15 ##
+    # Success Test
+    def test_play_quiz_returns_unseen_question(self):
+        category = {'type': 'Science', 'id': 1}
+        first = json.loads(self.client().post('/quizzes', json={'previous_questions': [], 'quiz_category': category}).data)
+        previous_questions = [first['question']['id']]
+
+        res = self.client().post('/quizzes', json={'previous_questions': previous_questions, 'quiz_category': category})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['success'], True)
+        if data['question'] is not None:
+            self.assertEqual(data['question']['category'], 1)
+            self.assertNotIn(data['question']['id'], previous_questions)
+
+    ## TEST 16 ##
+    # Error Test
+    def test_422_if_quiz_category_does_not_exist(self):
+        category = {'type': 'Unknown', 'id': 1005341}
+        res = self.client().post('/quizzes', json={'previous_questions': [], 'quiz_category': category})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 422)
+        self.assertEqual(data['success'], False)
+        self.assertEqual(data['message'], ERROR_422_MESSAGE)
+
+    """ Test for the endpoints
+    POST '/quizzes/sessions'
+    POST '/quizzes/sessions/<session_id>/next'
+    """
+    ## TEST 17 ##
+    # Success Test
+    def test_play_quiz_session(self):
+        category = {'type': 'Science', 'id': 1}
+        session = json.loads(self.client().post('/quizzes/sessions', json={'quiz_category': category}).data)
+
+        played = []
+        for _ in range(session['total_questions']):
+            res = self.client().post('/quizzes/sessions/{}/next'.format(session['session_id']))
+            data = json.loads(res.data)
+
+            self.assertEqual(res.status_code, 200)
+            self.assertEqual(data['success'], True)
+            self.assertNotIn(data['question']['id'], played)
+            played.append(data['question']['id'])
+
+        data = json.loads(self.client().post('/quizzes/sessions/{}/next'.format(session['session_id'])).data)
+        self.assertEqual(data['question'], None)
+        self.assertTrue(session['total_questions'])
+
+    ## TEST 18 ##
+    # Error Test
+    def test_404_if_quiz_session_does_not_exist(self):
+        res = self.client().post('/quizzes/sessions/unknown/next')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 404)
+        self.assertEqual(data['success'], False)
+        self.assertEqual(data['message'], ERROR_404_MESSAGE)
+
+    """ Test for the category cache behind the endpoint
+    GET '/categories'
+    """
+    ## TEST 19 ##
+    # Success Test
+    def test_get_categories_after_category_write(self):
+        self.client().get('/categories')
+
+        with self.app.app_context():
+            category = Category('Cached')
+            category.insert()
+            category_id = category.id
+
+        data = json.loads(self.client().get('/categories').data)
+
+        with self.app.app_context():
+            Category.query.get(category_id).delete()
+
+        self.assertEqual(data['categories'][str(category_id)], 'Cached')
+        data = json.loads(self.client().get('/categories').data)
+        self.assertNotIn(str(category_id), data['categories'])
+
+    """ Test for the minimal response of the endpoint
+    POST '/questions?return=minimal'
+    """
+    ## TEST 20 ##
+    # Success Test
+    def test_create_question_with_minimal_response(self):
+        total = json.loads(self.client().get('/questions').data)['total_questions']
+        res = self.client().post('/questions?return=minimal', json=self.new_question)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertTrue(data['created'])
+        self.assertEqual(data['total_questions'], total + 1)
+        self.assertNotIn('questions', data)
+        self.assertNotIn('categories', data)
+
+    """ Test for the endpoint
+    POST '/questions/bulk'
+    """
+    ## TEST 21 ##
+    # Success Test
+    def test_bulk_import_questions(self):
+        rows = [json.dumps(self.new_question), '{not json', json.dumps(dict(self.new_question, difficulty='hard'))]
+        res = self.client().post('/questions/bulk', data='\n'.join(rows), content_type='application/x-ndjson')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertEqual(data['inserted'], 1)
+        self.assertEqual(data['failed'], 2)
+        self.assertEqual([error['line'] for error in data['errors']], [2, 3])
+        self.assertTrue(data['total_questions'])
+
+    ## TEST 22 ##
+    # Error Test
+    def test_400_if_bulk_import_format_is_unknown(self):
+        res = self.client().post('/questions/bulk?format=xml', data='<questions/>')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(data['success'], False)
+        self.assertEqual(data['message'], ERROR_400_MESSAGE)
+
+    """ Test for the endpoint
+    GET '/questions/export'
+    """
+    ## TEST 23 ##
+    # Success Test
+    def test_export_questions(self):
+        total = json.loads(self.client().get('/questions').data)['total_questions']
+        res = self.client().get('/questions/export?batch_size=5')
+        rows = [json.loads(line) for line in res.get_data(as_text=True).splitlines()]
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(len(rows), total)
+        self.assertEqual(sorted(rows[0]), ['answer', 'category', 'difficulty', 'id', 'question'])
+
+    ## TEST 24 ##
+    # Error Test
+    def test_400_if_export_format_is_unknown(self):
+        res = self.client().get('/questions/export?format=xml')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(data['success'], False)
+        self.assertEqual(data['message'], ERROR_400_MESSAGE)
+
+    """ Test for the endpoint
+    GET '/debug/pool'
+    """
+    ## TEST 25 ##
+    # Success Test
+    def test_get_pool_status(self):
+        self.app.config['DEBUG_ENDPOINTS'] = True
+        self.client().get('/categories')
+        res = self.client().get('/debug/pool')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertTrue(data['pool']['checkouts'])
+        self.assertIn('checkout_wait_seconds_max', data['pool'])
+
+    """ Test for the conditional requests of the endpoint
+    GET '/questions'
+    """
+    ## TEST 26 ##
+    # Success Test
+    def test_304_if_questions_not_modified(self):
+        etag = self.client().get('/questions').headers['ETag']
+        res = self.client().get('/questions', headers={'If-None-Match': etag})
+
+        self.assertEqual(res.status_code, 304)
+        self.assertEqual(res.data, b'')
+        self.assertEqual(res.headers['ETag'], etag)
+
+    ## TEST 27 ##
+    # Success Test
+    def test_get_questions_after_question_created(self):
+        etag = self.client().get('/questions').headers['ETag']
+        self.client().post('/questions?return=minimal', json=self.new_question)
+        res = self.client().get('/questions', headers={'If-None-Match': etag})
+
+        self.assertEqual(res.status_code, 200)
+        self.assertNotEqual(res.headers['ETag'], etag)
+
+    """ Test for the response cache of the endpoint
+    GET '/categories/<int:category_id>/questions'
+    """
+    ## TEST 28 ##
+    # Success Test
+    def test_get_questions_based_on_category_from_response_cache(self):
+        first = self.client().get('/categories/1/questions')
+        response_cache = self.app.extensions['response_cache']
+        hits = response_cache.hits
+        res = self.client().get('/categories/1/questions')
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.data, first.data)
+        self.assertEqual(response_cache.hits, hits + 1)
+
+    """ Test for the query budgets of the endpoints
+    (fails with QueryBudgetExceeded when an endpoint issues too many queries)
+    """
+    ## TEST 29 ##
+    # Success Test
+    def test_endpoints_stay_within_query_budgets(self):
+        # Fill the question counts and the category cache first
+        self.client().get('/categories')
+
+        self.app.config['TESTING'] = True
+        self.app.config['QUERY_BUDGET_STRICT'] = True
+
+        res = self.client().get('/questions?page=2')
+        self.assertEqual(res.status_code, 200)
+        self.assertIn('Server-Timing', res.headers)
+
+        self.assertEqual(self.client().get('/categories').status_code, 200)
+        self.assertEqual(self.client().get('/categories/1/questions').status_code, 200)
+        self.assertEqual(self.client().post('/questions', json={'searchTerm': 'who'}).status_code, 200)
+        self.assertEqual(self.client().post('/quizzes', json={'previous_questions': [], 'quiz_category': {'type': 'ALL', 'id': 0}}).status_code, 200)
+
+        data = json.loads(self.client().get('/debug/queries').data)
+        self.assertEqual(data['requests'][-1]['endpoint'], 'play_quiz')
+
+    ## TEST 30 ##
+    # Error Test
+    def test_query_budget_exceeded(self):
+        app = create_app({'QUERY_BUDGETS': {'retrive_questions': 0}, 'QUERY_BUDGET_STRICT': True, 'TESTING': True})
+        setup_db(app, self.database_path)
+
+        with self.assertRaises(QueryBudgetExceeded):
+            # Unique URL, so the page is not served from the response cache
+            app.test_client().get('/questions?page=1&test=query_budget')
+
+    """ Test for the Prometheus metrics endpoint """
+    ## TEST 31 ##
+    # Success Test
+    def test_get_metrics(self):
+        self.client().get('/questions')
+        self.client().get('/questions?page=1000')
+        self.client().post('/quizzes/sessions', json={'quiz_category': {'type': 'ALL', 'id': 0}})
+
+        res = self.client().get('/metrics')
+        text = res.data.decode('utf-8')
+
+        self.assertEqual(res.status_code, 200)
+        self.assertTrue(res.content_type.startswith('text/plain; version=0.0.4'))
+        self.assertIn('# TYPE trivia_http_request_duration_seconds histogram', text)
+        self.assertIn('trivia_http_request_duration_seconds_bucket{endpoint="retrive_questions",le="+Inf"}', text)
+        self.assertIn('trivia_http_errors_total{endpoint="retrive_questions",status="404"}', text)
+        self.assertIn('trivia_http_requests_in_flight', text)
+        self.assertIn('trivia_quiz_sessions_started_total', text)
+
+    """ Test for the per-category question counts
+    (maintained on insert and delete, returned by GET '/categories')
+    """
+    ## TEST 32 ##
+    # Success Test
+    def test_question_counts(self):
+        counts = json.loads(self.client().get('/categories').data)['question_counts']
+        total = json.loads(self.client().get('/questions').data)['total_questions']
+
+        self.assertEqual(sum(counts.values()), total)
+
+        res = self.client().post('/questions?return=minimal', json=self.new_question)
+        data = json.loads(res.data)
+        self.assertEqual(data['total_questions'], total + 1)
+
+        category_id = str(self.new_question['category'])
+        new_counts = json.loads(self.client().get('/categories').data)['question_counts']
+        self.assertEqual(new_counts[category_id], counts[category_id] + 1)
+
+        data = json.loads(self.client().get('/categories/{}/questions'.format(category_id)).data)
+        self.assertEqual(data['total_questions'], new_counts[category_id])
+
+        self.client().delete('/questions/{}'.format(json.loads(res.data)['created']))
+        self.assertEqual(json.loads(self.client().get('/categories').data)['question_counts'], counts)
+
+    """ Test for the endpoint 
+    POST '/quizzes' with a difficulty range and in adaptive mode
+    """
+    ## TEST 33 ##
+    # Success Test
+    def test_play_quiz_by_difficulty(self):
+        quiz_category = {'type': 'ALL', 'id': 0}
+        previous_questions = []
+
+        while True:
+            res = self.client().post('/quizzes', json={'previous_questions': previous_questions, 'quiz_category': quiz_category, 'difficulty': {'min': 2, 'max': 3}})
+            data = json.loads(res.data)
+            if data['question'] is None:
+                break
+            self.assertIn(data['question']['difficulty'], [2, 3])
+            previous_questions.append(data['question']['id'])
+
+        self.assertEqual(len(previous_questions), Question.query.filter(Question.difficulty.between(2, 3)).count())
+
+        res = self.client().post('/quizzes', json={'previous_questions': [], 'quiz_category': quiz_category, 'adaptive': {'difficulty': 1, 'correct': True}})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['question']['difficulty'], 2)
+
+    ## TEST 34 ##
+    # Error Test
+    def test_422_play_quiz_invalid_difficulty(self):
+        for difficulty in ('hard', {'min': 4, 'max': 2}, {'min': 6}, 0):
+            res = self.client().post('/quizzes', json={'previous_questions': [], 'quiz_category': {'type': 'ALL', 'id': 0}, 'difficulty': difficulty})
+            data = json.loads(res.data)
+
+            self.assertEqual(res.status_code, 422)
+            self.assertEqual(data['success'], False)
+            self.assertEqual(data['message'], ERROR_422_MESSAGE)
+
+    """ Test for the endpoint 
+    POST '/quizzes' with a count (batch of questions)
+    """
+    ## TEST 35 ##
+    # Success Test
+    def test_play_quiz_batch(self):
+        quiz_category = {'type': 'Art', 'id': 2}
+
+        res = self.client().post('/quizzes', json={'previous_questions': [], 'quiz_category': quiz_category, 'count': 3})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(len(data['questions']), 3)
+        self.assertNotIn('answer', data['questions'][0])
+        self.assertEqual(data['previousQuestions'], [question['id'] for question in data['questions']])
+
+        res = self.client().post('/quizzes', json={'previous_questions': data['previousQuestions'], 'quiz_category': quiz_category, 'count': 20})
+        rest = json.loads(res.data)
+
+        self.assertEqual(len(set(rest['previousQuestions'])), Question.query.filter(Question.category == 2).count())
+
+    ## TEST 36 ##
+    # Error Test
+    def test_422_play_quiz_batch_too_large(self):
+        res = self.client().post('/quizzes', json={'previous_questions': [], 'quiz_category': {'type': 'ALL', 'id': 0}, 'count': 1000})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 422)
+        self.assertEqual(data['success'], False)
+        self.assertEqual(data['message'], ERROR_422_MESSAGE)
+
+    """ Test for the endpoint 
+    POST '/quizzes/answers'
+    """
+    ## TEST 37 ##
+    # Success Test
+    def test_check_quiz_answers(self):
+        session_id = json.loads(self.client().post('/quizzes/sessions', json={'quiz_category': {'type': 'Science', 'id': 1}}).data)['session_id']
+        batch = json.loads(self.client().post('/quizzes/sessions/{}/next'.format(session_id), json={'count': 3}).data)
+        question = Question.query.get(batch['questions'][0]['id'])
+
+        self.assertEqual(len(batch['questions']), 3)
+        self.assertNotIn('answer', batch['questions'][0])
+
+        res = self.client().post('/quizzes/answers', json={'session_id': session_id, 'answers': {str(question.id): question.answer.split(' ')[0].upper()}})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['correct'], 1)
+        self.assertEqual(data['results'][str(question.id)]['answer'], question.answer)
+
+    ## TEST 38 ##
+    # Error Test
+    def test_422_check_quiz_answers(self):
+        session_id = json.loads(self.client().post('/quizzes/sessions', json={'quiz_category': {'type': 'Science', 'id': 1}}).data)['session_id']
+
+        for body in ({'session_id': session_id, 'answers': ['Mona Lisa']}, {'answers': {'1': 'Mona Lisa'}}):
+            res = self.client().post('/quizzes/answers', json=body)
+            data = json.loads(res.data)
+
+            self.assertEqual(res.status_code, 422)
+            self.assertEqual(data['success'], False)
+            self.assertEqual(data['message'], ERROR_422_MESSAGE)
+
+    """ Regression test for the endpoint 
+    POST '/quizzes' (the quiz used to only ask the first 10 questions of a category)
+    """
+    ## TEST 39 ##
+    # Success Test
+    def test_play_quiz_uses_whole_category(self):
+        added = []
+        for i in range(12):
+            question = Question('Quiz regression question {}'.format(i), 'answer', 1, 1)
+            question.insert()
+            added.append(question.id)
+
+        category_ids = set(question_id for question_id, in Question.query.filter(Question.category == 1).with_entities(Question.id))
+        previous_questions = []
+
+        try:
+            while True:
+                res = self.client().post('/quizzes', json={'previous_questions': previous_questions, 'quiz_category': {'type': 'Science', 'id': 1}})
+                data = json.loads(res.data)
+                if data['question'] is None:
+                    break
+                previous_questions.append(data['question']['id'])
+        finally:
+            for question_id in added:
+                Question.query.get(question_id).delete()
+
+        self.assertGreater(len(category_ids), 10)
+        self.assertEqual(set(previous_questions), category_ids)
+
+    """ Test for the Category.questions relationship (a query filtered and counted in SQL) """
+    ## TEST 40 ##
+    # Success Test
+    def test_category_questions_query(self):
+        counts = json.loads(self.client().get('/categories').data)['question_counts']
+        # Loaded after the request, whose teardown removes the session and detaches its instances
+        category = Category.query.get(1)
+
+        self.assertEqual(category.questions.count(), counts['1'])
+        self.assertEqual(category.questions.filter(Question.difficulty > 5).count(), 0)
+        self.assertEqual([question.id for question in category.questions.order_by(Question.id).limit(2)],
+                         [question.id for question in Question.query.filter(Question.category == 1).order_by(Question.id).limit(2)])
+
+    """ Test for the rate limits of POST '/quizzes' """
+    ## TEST 41 ##
+    # Error Test
+    def test_429_play_quiz_rate_limited(self):
+        app = create_app({'RATE_LIMITS': {'play_quiz': (1, 2)}})
+        setup_db(app, self.database_path)
+        body = {'previous_questions': [], 'quiz_category': {'type': 'ALL', 'id': 0}}
+
+        statuses = [app.test_client().post('/quizzes', json=body).status_code for _ in range(3)]
+        res = app.test_client().post('/quizzes', json=body)
+        data = json.loads(res.data)
+
+        self.assertEqual(statuses[:2], [200, 200])
+        self.assertEqual(res.status_code, 429)
+        self.assertIn('Retry-After', res.headers)
+        self.assertEqual(data['success'], False)
+        self.assertEqual(data['message'], ERROR_429_MESSAGE)
+
+    """ Test for the load shedding of POST '/quizzes' """
+    ## TEST 42 ##
+    # Error Test
+    def test_503_play_quiz_load_shedding(self):
+        app = create_app({'MAX_CONCURRENT_REQUESTS': 0})
+        setup_db(app, self.database_path)
+
+        res = app.test_client().post('/quizzes', json={'previous_questions': [], 'quiz_category': {'type': 'ALL', 'id': 0}})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 503)
+        self.assertIn('Retry-After', res.headers)
+        self.assertEqual(data['success'], False)
+        self.assertEqual(data['message'], ERROR_503_MESSAGE)
+
+        # Endpoints without rate limits are not shed
+        self.assertEqual(app.test_client().get('/categories').status_code, 200)
+
+    """ Test for the endpoint 
+    GET '/questions/suggest'
+    """
+    ## TEST 43 ##
+    # Success Test
+    def test_suggest_search_terms(self):
+        res = self.client().get('/questions/suggest?q=Wh')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertTrue(data['suggestions'])
+        self.assertTrue(all(suggestion.startswith('wh') for suggestion in data['suggestions']))
+
+        res = self.client().post('/questions', json={'question': 'Zyxwv suggestion test', 'answer': 'answer', 'category': 1, 'difficulty': 1})
+        question_id = json.loads(res.data)['created']
+
+        data = json.loads(self.client().get('/questions/suggest?q=who%20zyx').data)
+        self.assertEqual(data['suggestions'], ['who zyxwv'])
+
+        self.client().delete('/questions/{}'.format(question_id))
+        data = json.loads(self.client().get('/questions/suggest?q=zyx').data)
+        self.assertEqual(data['suggestions'], [])
+
+    ## TEST 44 ##
+    # Error Test
+    def test_400_suggest_without_query(self):
+        res = self.client().get('/questions/suggest')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(data['success'], False)
+        self.assertEqual(data['message'], ERROR_400_MESSAGE)
+
+    """ Regression test for the endpoint 
+    POST '/quizzes' (a quiz of the category with id 0 used to draw from every category)
+    """
+    ## TEST 45 ##
+    # Success Test
+    def test_play_quiz_of_category_zero(self):
+        category = Category.query.get(0)
+        created = category is None
+        if created:
+            category = Category('tech')
+            category.id = 0
+            category.insert()
+        question = Question('Quiz category zero question', 'answer', 0, 1)
+        question.insert()
+
+        category_ids = set(question_id for question_id, in Question.query.filter(Question.category == 0).with_entities(Question.id))
+        previous_questions = []
+
+        try:
+            while True:
+                res = self.client().post('/quizzes', json={'previous_questions': previous_questions, 'quiz_category': {'type': 'tech', 'id': 0}})
+                data = json.loads(res.data)
+                if data['question'] is None:
+                    break
+                self.assertEqual(data['question']['category'], 0)
+                previous_questions.append(data['question']['id'])
+        finally:
+            question.delete()
+            if created:
+                Category.query.get(0).delete()
+
+        self.assertEqual(set(previous_questions), category_ids)
+
+    """ Test for the ranking of the endpoint 
+    POST '/questions' with a searchTerm, in the database and in the in-process index
+    """
+    ## TEST 46 ##
+    # Success Test
+    def test_search_question_ranking(self):
+        added = []
+        for text in ('Zqxjvvv ranking question', 'Zqxj ranking question'):
+            question = Question(text, 'answer', 1, 1)
+            question.insert()
+            added.append(question.id)
+        partial_id, exact_id = added
+
+        try:
+            for config in ({}, {'SEARCH_BACKEND': 'memory'}):
+                app = create_app(config)
+                setup_db(app, self.database_path)
+
+                res = app.test_client().post('/questions', json={'searchTerm': 'ZQXJ'})
+                data = json.loads(res.data)
+
+                self.assertEqual(res.status_code, 200)
+                self.assertEqual(data['total_questions'], 2)
+                # The question where the term is a whole word ranks first, before the older one
+                self.assertEqual([question['id'] for question in data['questions']], [exact_id, partial_id])
+        finally:
+            for question_id in added:
+                Question.query.get(question_id).delete()
+
+    """ Test for the endpoints
+    GET '/debug/pool'
+    GET '/debug/queries'
+    """
+    ## TEST 47 ##
+    # Error Test
+    def test_404_debug_endpoints_disabled_by_default(self):
+        for url in ('/debug/pool', '/debug/queries'):
+            res = self.client().get(url)
+            data = json.loads(res.data)
+
+            self.assertEqual(res.status_code, 404)
+            self.assertEqual(data['success'], False)
+            self.assertEqual(data['message'], ERROR_404_MESSAGE)
+
+    """ Regression test for the endpoint 
+    GET '/metrics' (an unhandled exception used to be counted twice)
+    """
+    ## TEST 48 ##
+    # Success Test
+    def test_metrics_count_unhandled_exception_once(self):
+        @self.app.route('/metrics-test-error')
+        def metrics_test_error():
+            raise RuntimeError('metrics test')
+
+        res = self.client().get('/metrics-test-error')
+        text = self.client().get('/metrics').get_data(as_text=True)
+
+        self.assertEqual(res.status_code, 500)
+        self.assertIn('trivia_http_errors_total{endpoint="metrics_test_error",status="500"} 1\n', text)
+
+    """ Regression test for the question counts of a category created without
+    Category.insert() (e.g. with SQL), which used to count 0 forever
+    """
+    ## TEST 49 ##
+    # Success Test
+    def test_question_counts_of_category_created_with_sql(self):
+        category = Category('Uncounted')
+        db.session.add(category)
+        db.session.commit()
+        category_id = category.id
+        self.app.extensions['category_cache'].invalidate()
+
+        res = self.client().post('/questions', json=dict(self.new_question, category=category_id))
+        question_id = json.loads(res.data)['created']
+
+        try:
+            data = json.loads(self.client().get('/categories/{}/questions'.format(category_id)).data)
+            counts = json.loads(self.client().get('/categories').data)['question_counts']
+        finally:
+            Question.query.get(question_id).delete()
+            Category.query.get(category_id).delete()
+
+        self.assertEqual(data['total_questions'], 1)
+        self.assertEqual(counts[str(category_id)], 1)
+
+    """ Regression test for the endpoint 
+    GET '/questions/suggest' (the most used words past the first MAX_CANDIDATES
+    of a prefix, in alphabetical order, used to be left out)
+    """
+    ## TEST 50 ##
+    # Success Test
+    def test_suggest_ranks_whole_prefix_range(self):
+        added = []
+        for text in ('Qzaa Qzab Qzac suggestion test', 'Qzzpopular suggestion test', 'Qzzpopular suggestion test'):
+            question = Question(text, 'answer', 1, 1)
+            question.insert()
+            added.append(question.id)
+
+        max_candidates = suggest.MAX_CANDIDATES
+        suggest.MAX_CANDIDATES = 1
+        try:
+            data = json.loads(self.client().get('/questions/suggest?q=qz&limit=2').data)
+            self.assertEqual(data['suggestions'], ['qzzpopular', 'qzaa'])
+
+            # A question added by another worker (whose write hooks did not run here)
+            # shows up once the index is rebuilt in the background
+            question = Question('Qzzz suggestion test', 'answer', 1, 1)
+            question.insert()
+            added.append(question.id)
+            self.app.extensions['suggest_index'].remove(question.id)
+            self.assertEqual(json.loads(self.client().get('/questions/suggest?q=qzzz').data)['suggestions'], [])
+            self.app.extensions['suggest_index'].invalidate()
+
+            self.client().get('/questions/suggest?q=qz')
+            for _ in range(50):
+                if not self.app.extensions['suggest_index']._rebuilding:
+                    break
+                time.sleep(0.1)
+
+            data = json.loads(self.client().get('/questions/suggest?q=qzzz').data)
+            self.assertEqual(data['suggestions'], ['qzzz'])
+        finally:
+            suggest.MAX_CANDIDATES = max_candidates
+            for question_id in added:
+                Question.query.get(question_id).delete()
+
+    """ Regression test for the question counts after questions were written with SQL,
+    which used to leave them wrong forever
+    """
+    ## TEST 51 ##
+    # Success Test
+    def test_question_counts_reconciled_after_sql_writes(self):
+        db.session.execute("INSERT INTO questions (question, answer, category, difficulty) VALUES ('Uncounted question', 'answer', 1, 1)")
+        db.session.commit()
+
+        try:
+            # Counted again at least every QUESTION_COUNTS_TTL seconds
+            self.app.extensions['question_counts']._expires_at = 0
+            counts = json.loads(self.client().get('/categories').data)['question_counts']
+            total = json.loads(self.client().get('/questions').data)['total_questions']
+
+            self.assertEqual(counts['1'], Question.query.filter(Question.category == 1).count())
+            self.assertEqual(total, Question.query.count())
+        finally:
+            db.session.execute("DELETE FROM questions WHERE question = 'Uncounted question'")
+            db.session.commit()
+
+        # Counts above the actual rows are made right too
+        self.app.extensions['question_counts']._expires_at = 0
+        counts = json.loads(self.client().get('/categories').data)['question_counts']
+        self.assertEqual(counts['1'], Question.query.filter(Question.category == 1).count())
+
+    """ Regression test for the endpoint
+    POST '/questions/bulk' (a line that is not UTF-8 used to fail the whole import
+    with a 500, and true or 2.9 were taken as integers)
+    """
+    ## TEST 52 ##
+    # Success Test
+    def test_bulk_import_rejects_invalid_rows(self):
+        rows = [json.dumps(dict(self.new_question, category=True)).encode('utf-8'),
+                json.dumps(dict(self.new_question, difficulty=2.9)).encode('utf-8'),
+                json.dumps(dict(self.new_question, difficulty=9)).encode('utf-8'),
+                # Latin-1, not UTF-8
+                json.dumps(dict(self.new_question, question='Caf\u00e9'), ensure_ascii=False).encode('latin-1')]
+        res = self.client().post('/questions/bulk', data=b'\n'.join(rows), content_type='application/x-ndjson')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['inserted'], 0)
+        self.assertEqual([error['line'] for error in data['errors']], [1, 2, 3, 4])
+
+        csv_rows = b'question,answer,category,difficulty\nCaf\xe9,answer,1,1\n'
+        data = json.loads(self.client().post('/questions/bulk', data=csv_rows, content_type='text/csv').data)
+
+        self.assertEqual(data['inserted'], 0)
+        self.assertEqual(data['errors'], [{'line': 2, 'error': 'invalid UTF-8'}])
+
+    """ Regression test for the query budgets on cold caches (filling the category
+    cache used to put the listings over their budget)
+    """
+    ## TEST 53 ##
+    # Success Test
+    def test_endpoints_stay_within_query_budgets_on_cold_caches(self):
+        app = create_app({'QUERY_BUDGET_STRICT': True, 'TESTING': True})
+        setup_db(app, self.database_path)
+
+        for url in ('/questions?page=2&test=cold_cache', '/categories/1/questions?test=cold_cache', '/categories'):
+            with self.subTest(url=url):
+                app.extensions['category_cache'].invalidate()
+                app.extensions['question_counts']._expires_at = 0
+
+                res = app.test_client().get(url)
+                self.assertEqual(res.status_code, 200)
+
+        data = json.loads(app.test_client().get('/debug/queries').data)
+        self.assertTrue(all(entry['cache_fill_queries'] for entry in data['requests'][:3]))
+
+    """ Regression test for the endpoints
+    POST '/quizzes/sessions' and POST '/quizzes/sessions/<session_id>/next'
+    (every session used to store the shuffled ids of its category, in an unbounded store)
+    """
+    ## TEST 54 ##
+    # Success Test
+    def test_quiz_sessions_are_bounded_and_survive_deletes(self):
+        app = create_app({'QUIZ_SESSION_MAX_ENTRIES': 1})
+        setup_db(app, self.database_path)
+        category = {'type': 'Science', 'id': 1}
+
+        evicted = json.loads(app.test_client().post('/quizzes/sessions', json={'quiz_category': category}).data)
+        session = json.loads(app.test_client().post('/quizzes/sessions', json={'quiz_category': category}).data)
+        self.assertEqual(app.test_client().post('/quizzes/sessions/{}/next'.format(evicted['session_id'])).status_code, 404)
+
+        first = json.loads(app.test_client().post('/quizzes/sessions/{}/next'.format(session['session_id'])).data)
+        category_ids = set(question_id for question_id, in Question.query.filter(Question.category == 1).with_entities(Question.id))
+
+        # Deleting a question played already neither skips nor repeats the others
+        question = Question.query.get(first['question']['id'])
+        data = question.format()
+        question.delete()
+        try:
+            played = []
+            while True:
+                res = json.loads(app.test_client().post('/quizzes/sessions/{}/next'.format(session['session_id'])).data)
+                if res['question'] is None:
+                    break
+                played.append(res['question']['id'])
+        finally:
+            Question(data['question'], data['answer'], data['category'], data['difficulty']).insert()
+
+        self.assertEqual(sorted(played), sorted(category_ids - {first['question']['id']}))
+
+    """ Regression test for the caches and indexes of two apps in the same process
+    (they used to be module globals shared by every app)
+    """
+    ## TEST 55 ##
+    # Success Test
+    def test_caches_are_kept_per_app(self):
+        app = create_app()
+        setup_db(app, self.database_path)
+
+        self.client().get('/categories')
+        self.client().post('/quizzes', json={'previous_questions': [], 'quiz_category': {'type': 'Science', 'id': 1}})
+        for name in ('category_cache', 'question_counts', 'question_ids', 'search_index', 'suggest_index'):
+            self.assertIsNot(app.extensions[name], self.app.extensions[name])
+        self.assertIsNone(app.extensions['question_ids'].cached(1))
+        self.assertIsNotNone(self.app.extensions['question_ids'].cached(1))
+
+        # A write through the models still reaches the caches of every app
+        app.test_client().get('/categories')
+        category = Category('Per app')
+        category.insert()
+        try:
+            self.assertIsNone(app.extensions['category_cache'].cached())
+            self.assertIsNone(self.app.extensions['category_cache'].cached())
+        finally:
+            category.delete()
+
+    """ Regression test for the endpoint
+    POST '/questions' with a searchTerm shorter than 3 characters in the in-process
+    index (which used to scan every question text under the index lock)
+    """
+    ## TEST 56 ##
+    # Success Test
+    def test_search_short_terms_in_database(self):
+        added = []
+        for text in ('Zqxjvvv short search question', 'Zqxj short search question'):
+            question = Question(text, 'answer', 1, 1)
+            question.insert()
+            added.append(question.id)
+        partial_id, exact_id = added
+
+        app = create_app({'SEARCH_BACKEND': 'memory'})
+        setup_db(app, self.database_path)
+        try:
+            for term in ('ZQ', 'zqxj'):
+                with self.subTest(term=term):
+                    data = json.loads(app.test_client().post('/questions', json={'searchTerm': term}).data)
+
+                    self.assertEqual(data['total_questions'], 2)
+                    # The shortest text ranks first, with either backend
+                    self.assertEqual([question['id'] for question in data['questions']], [exact_id, partial_id])
+                    self.assertEqual(app.extensions['search_index']._index is not None, len(term) >= 3)
+        finally:
+            for question_id in added:
+                Question.query.get(question_id).delete()
+
+    """ Regression test for the endpoint
+    GET '/categories/<category_id>/questions' with If-None-Match: * (a category that
+    does not exist used to be answered with 304)
+    """
+    ## TEST 57 ##
+    # Error Test
+    def test_404_if_none_match_star_of_missing_category(self):
+        res = self.client().get('/categories/1000/questions', headers={'If-None-Match': '*'})
+
+        self.assertEqual(res.status_code, 404)
+        self.assertEqual(json.loads(res.data)['message'], ERROR_404_MESSAGE)
+        self.assertEqual(self.client().get('/categories/1/questions', headers={'If-None-Match': '*'}).status_code, 304)
+
+    """ Regression test for the endpoint
+    POST '/quizzes' in adaptive mode ("correct": "false" used to count as a correct answer)
+    """
+    ## TEST 58 ##
+    # Error Test
+    def test_422_play_quiz_adaptive_correct_not_boolean(self):
+        quiz_category = {'type': 'ALL', 'id': 0}
+
+        for correct in ('false', 'true', 0, 1):
+            with self.subTest(correct=correct):
+                res = self.client().post('/quizzes', json={'previous_questions': [], 'quiz_category': quiz_category, 'adaptive': {'difficulty': 3, 'correct': correct}})
+                data = json.loads(res.data)
+
+                self.assertEqual(res.status_code, 422)
+                self.assertEqual(data['message'], ERROR_422_MESSAGE)
+
+        res = self.client().post('/quizzes', json={'previous_questions': [], 'quiz_category': quiz_category, 'adaptive': {'difficulty': 3, 'correct': False}})
+        self.assertEqual(json.loads(res.data)['question']['difficulty'], 2)
+
+    """ Regression test for the endpoint
+    POST '/quizzes/answers' (a null guess used to be graded as "None", one invalid id
+    failed the whole batch, and any question could be graded to read its answer)
+    """
+    ## TEST 59 ##
+    # Error Test
+    def test_check_quiz_answers_per_item_errors(self):
+        session_id = json.loads(self.client().post('/quizzes/sessions', json={'quiz_category': {'type': 'Science', 'id': 1}}).data)['session_id']
+        first, second = json.loads(self.client().post('/quizzes/sessions/{}/next'.format(session_id), json={'count': 2}).data)['questions']
+        unsent = Question.query.filter(Question.category == 1, ~Question.id.in_([first['id'], second['id']])).first()
+        other = Question.query.filter(Question.category != 1).first()
+
+        answers = {str(first['id']): None, 'one': 'guess', str(second['id']): 'guess', str(unsent.id): 'guess', str(other.id): 'guess'}
+        res = self.client().post('/quizzes/answers', json={'session_id': session_id, 'answers': answers})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['correct'], 0)
+        self.assertEqual(data['results'], {
+            str(first['id']): {'error': 'guess must be a string'},
+            'one': {'error': 'invalid question id'},
+            str(second['id']): {'correct': False, 'answer': Question.query.get(second['id']).answer},
+            str(unsent.id): {'error': 'not sent by this quiz session'},
+            str(other.id): {'error': 'not sent by this quiz session'}
+        })
+
+        res = self.client().post('/quizzes/answers', json={'session_id': 'expired', 'answers': {str(second['id']): 'guess'}})
+        self.assertEqual(res.status_code, 404)
+
+    """ Regression test for the endpoint
+    DELETE '/questions/<question_id>' with a bad cursor (the 400 raised after the
+    question was deleted used to be reported as a 422, as if the delete had failed)
+    """
+    ## TEST 60 ##
+    # Error Test
+    def test_400_delete_question_with_bad_cursor(self):
+        question = Question('Deleted with a bad cursor', 'answer', 1, 1)
+        question.insert()
+        question_id = question.id
+
+        res = self.client().delete('/questions/{}?cursor=not-a-cursor'.format(question_id))
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(data['success'], False)
+        self.assertIsNone(Question.query.get(question_id))
+
 # Make the tests conveniently executable
 if __name__ == "__main__":
     unittest.main()
\ No newline at end of file
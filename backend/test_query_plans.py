@@ -0,0 +1,167 @@
+import unittest
+
+from sqlalchemy import event, inspect
+
+from flaskr import create_app
+from flaskr.response_cache import RESPONSE_CACHE_SIZE
+from flaskr.search import has_pg_trgm
+from flaskr.store import MemoryStore
+from models import setup_db, db, Question, Category, CategoryQuestionCount
+
+""" keystore consists of all the passwords required for the backend """
+from keystore import database_password
+
+SEEDED_QUESTIONS = 3000
+SEEDED_PREFIX = 'Query plan check'
+
+'''
+The requests whose SQL must be answered from an index. Every statement they
+run against the questions table is EXPLAINed.
+'''
+ENDPOINTS = [
+    ('get', '/questions?page=2', None),
+    ('get', '/questions?after_id=10&limit=10', None),
+    ('get', '/categories/1/questions', None),
+    ('get', '/categories/1/questions?after_id=10&limit=10', None),
+    ('post', '/quizzes', {'previous_questions': [], 'quiz_category': {'type': 'Science', 'id': 1}}),
+    ('post', '/quizzes', {'previous_questions': [], 'quiz_category': {'type': 'ALL', 'id': 0}}),
+    ('post', '/quizzes', {'previous_questions': [], 'quiz_category': {'type': 'Science', 'id': 1}, 'difficulty': {'min': 2, 'max': 3}}),
+    ('post', '/quizzes', {'previous_questions': [], 'quiz_category': {'type': 'Science', 'id': 1}, 'count': 10}),
+    ('post', '/quizzes/sessions', {'quiz_category': {'type': 'Science', 'id': 1}}),
+]
+
+
+def plan_nodes(node):
+    yield node
+    for child in node.get('Plans', []):
+        for descendant in plan_nodes(child):
+            yield descendant
+
+
+class QueryPlanTestCase(unittest.TestCase):
+    """Checks that the queries of the endpoints use the indexes of the questions table"""
+
+    @classmethod
+    def setUpClass(cls):
+        database_path = "postgresql://{}:{}@{}/{}".format("postgres", database_password, 'localhost:5432', "trivia_test")
+
+        # Fresh response cache, so that every request runs its queries
+        cls.app = create_app({'RESPONSE_CACHE_STORE': MemoryStore(max_entries=RESPONSE_CACHE_SIZE)})
+        setup_db(cls.app, database_path)
+
+        with cls.app.app_context():
+            db.create_all()
+
+            # A database restored from trivia.psql lacks the indexes of the migrations
+            existing = set(index['name'] for index in inspect(db.engine).get_indexes('questions'))
+            for index in Question.__table__.indexes:
+                if index.name not in existing:
+                    index.create(db.engine)
+
+            category_ids = [category_id for category_id, in db.session.query(Category.id).order_by(Category.id)]
+            db.session.bulk_insert_mappings(Question, [{
+                'question': '{} {}'.format(SEEDED_PREFIX, i),
+                'answer': 'answer',
+                'category': category_ids[i % len(category_ids)],
+                'difficulty': i % 5 + 1
+            } for i in range(SEEDED_QUESTIONS)])
+            db.session.commit()
+
+            # The trigram index of the search is Postgres only, so it is not declared on the model
+            cls.pg_trgm = has_pg_trgm()
+            if cls.pg_trgm:
+                db.session.execute('CREATE INDEX IF NOT EXISTS ix_questions_question_trgm ON questions USING gin (question gin_trgm_ops)')
+
+            CategoryQuestionCount.recount()
+            db.session.execute('ANALYZE questions')
+            db.session.commit()
+
+    @classmethod
+    def tearDownClass(cls):
+        with cls.app.app_context():
+            Question.query.filter(Question.question.like(SEEDED_PREFIX + '%')).delete(synchronize_session=False)
+            db.session.commit()
+            CategoryQuestionCount.recount()
+
+    def setUp(self):
+        self.client = self.app.test_client
+        self.statements = []
+        self.app.extensions['question_ids'].invalidate()
+
+        with self.app.app_context():
+            self.engine = db.engine
+        event.listen(self.engine, 'before_cursor_execute', self.capture)
+
+    def tearDown(self):
+        event.remove(self.engine, 'before_cursor_execute', self.capture)
+
+    def capture(self, connection, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith('SELECT') and 'FROM questions' in statement:
+            self.statements.append((statement, parameters))
+
+    '''
+    Scans of the questions table that do not use an index, or that use one
+    only to throw rows away with a filter. Sequential scans are disabled for
+    the EXPLAIN, so the planner falls back to them only when no index fits.
+    '''
+    def unindexed_scans(self, statement, parameters):
+        with self.engine.connect() as connection:
+            transaction = connection.begin()
+            try:
+                cursor = connection.connection.cursor()
+                cursor.execute('SET LOCAL enable_seqscan = off')
+                cursor.execute('EXPLAIN (FORMAT JSON) ' + statement, parameters)
+                plan = cursor.fetchone()[0][0]['Plan']
+            finally:
+                transaction.rollback()
+
+        return [node for node in plan_nodes(plan)
+                if node.get('Relation Name') == 'questions' and (node['Node Type'] == 'Seq Scan' or 'Filter' in node)]
+
+    ## TEST 1 ##
+    # Success Test
+    def test_endpoint_queries_use_indexes(self):
+        for method, url, body in ENDPOINTS:
+            with self.subTest(method=method, url=url):
+                del self.statements[:]
+                self.app.extensions['question_ids'].invalidate()
+
+                res = getattr(self.client(), method)(url, json=body)
+                self.assertEqual(res.status_code, 200)
+                self.assertTrue(self.statements)
+
+                for statement, parameters in self.statements:
+                    self.assertEqual(self.unindexed_scans(statement, parameters), [], statement)
+
+    ## TEST 2 ##
+    # Success Test
+    def test_search_queries_use_trigram_index(self):
+        if not self.pg_trgm:
+            self.skipTest('the search only queries the database with pg_trgm installed')
+
+        res = self.client().post('/questions', json={'searchTerm': 'plan check 12'})
+        self.assertEqual(res.status_code, 200)
+        self.assertTrue(self.statements)
+
+        for statement, parameters in self.statements:
+            self.assertEqual(self.unindexed_scans(statement, parameters), [], statement)
+
+    ## TEST 3 ##
+    # Success Test
+    def test_quiz_session_queries_use_indexes(self):
+        session_id = self.client().post('/quizzes/sessions', json={'quiz_category': {'type': 'Science', 'id': 1}}).get_json()['session_id']
+        questions = self.client().post('/quizzes/sessions/{}/next'.format(session_id), json={'count': 10}).get_json()['questions']
+        answers = dict((str(question['id']), 'guess') for question in questions)
+
+        res = self.client().post('/quizzes/answers', json={'session_id': session_id, 'answers': answers})
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(len(res.get_json()['results']), 10)
+        self.assertTrue(self.statements)
+
+        for statement, parameters in self.statements:
+            self.assertEqual(self.unindexed_scans(statement, parameters), [], statement)
+
+
+# Make the tests conveniently executable
+if __name__ == "__main__":
+    unittest.main()
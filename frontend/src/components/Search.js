@@ -1,8 +1,16 @@
 import React, { Component } from 'react'
+import $ from 'jquery';
+
+const SUGGEST_DELAY = 200;
 
 class Search extends Component {
   state = {
     query: '',
+    suggestions: [],
+  }
+
+  componentWillUnmount() {
+    clearTimeout(this.suggestTimer);
   }
 
   getInfo = (event) => {
@@ -10,10 +18,38 @@ class Search extends Component {
     this.props.submitSearch(this.state.query)
   }
 
+  getSuggestions = () => {
+    const query = this.state.query;
+    if (!query.trim()) {
+      this.setState({ suggestions: [] })
+      return;
+    }
+
+    $.ajax({
+      url: `/questions/suggest?q=${encodeURIComponent(query)}`,
+      type: "GET",
+      success: (result) => {
+        // Drop the answer of a query the user has typed past
+        if (query === this.state.query) {
+          this.setState({ suggestions: result.suggestions })
+        }
+        return;
+      },
+      error: (error) => {
+        // Suggestions are optional, searching still works without them
+        return;
+      }
+    })
+  }
+
   handleInputChange = () => {
     this.setState({
       query: this.search.value
     })
+
+    // Only ask for suggestions once the user stops typing
+    clearTimeout(this.suggestTimer);
+    this.suggestTimer = setTimeout(this.getSuggestions, SUGGEST_DELAY);
   }
 
   render() {
@@ -23,7 +59,14 @@ class Search extends Component {
           placeholder="Search questions..."
           ref={input => this.search = input}
           onChange={this.handleInputChange}
+          list="search-suggestions"
+          autoComplete="off"
         />
+        <datalist id="search-suggestions">
+          {this.state.suggestions.map(suggestion => (
+            <option key={suggestion} value={suggestion}/>
+          ))}
+        </datalist>
         <input type="submit" value="Submit" className="button"/>
       </form>
     )